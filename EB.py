@@ -1,15 +1,31 @@
 import streamlit as st
-import pandas as pd
-from datetime import date
-from st_supabase_connection import SupabaseConnection
+from datetime import date, timedelta
 import random
-import math
-import time
-import urllib.parse
+
+# pandas and the modules built on it (analytics, backfill, billing,
+# readings_import) are imported inside the views that use them, so the
+# login page renders without loading them.
+import db
+import dues
+import instrumentation
+import ledger
+import meters
 
 # --- 1. CONFIGURATION ---
 st.set_page_config(page_title="S. Vihar Property Manager", page_icon="🏠", layout="wide")
-conn = st.connection("supabase", type=SupabaseConnection)
+
+def session_query_cache():
+    if 'query_cache' not in st.session_state:
+        st.session_state.query_cache = db.QueryCache()
+    return st.session_state.query_cache
+
+def session_metrics():
+    if 'query_metrics' not in st.session_state:
+        st.session_state.query_metrics = instrumentation.MetricsLog()
+    return st.session_state.query_metrics
+
+# Opened on first use: the login form paints before the backend client is built.
+conn = db.CachedConnection(db.LazyConnection(), session_query_cache(), recorder=session_metrics().record)
 
 # --- 2. AUTHENTICATION & HELPER FUNCTIONS ---
 
@@ -19,17 +35,36 @@ def generate_captcha():
         st.session_state.captcha_num2 = random.randint(1, 10)
     return st.session_state.captcha_num1, st.session_state.captcha_num2
 
-def ensure_profile_exists(user_id, email):
-    try:
-        resp = conn.table("profiles").select("*").eq("id", user_id).execute()
-        if not resp.data:
-            conn.table("profiles").insert({
-                "id": user_id, "email": email, "full_name": "User", "role": "tenant", "num_people": 0, "rent_amount": 0
-            }).execute()
-            resp = conn.table("profiles").select("*").eq("id", user_id).execute()
+def load_profile(user_id, email):
+    resp = conn.table("profiles").select("*").eq("id", user_id).execute()
+    if resp.data:
         return resp.data[0]
-    except:
-        return None
+    # First login: insert-if-missing and get the new row back in one atomic call.
+    resp = conn.table("profiles").upsert({
+        "id": user_id, "email": email, "full_name": "User", "role": "tenant", "num_people": 0, "rent_amount": 0
+    }, on_conflict="id", ignore_duplicates=True).execute()
+    if not resp.data:
+        # Another session created it first.
+        resp = conn.table("profiles").select("*").eq("id", user_id).execute()
+    return resp.data[0]
+
+# The signed-in profile is fetched once per session; call refresh_profile() after editing it.
+def current_profile(user):
+    profile = st.session_state.get('profile')
+    if profile is None or profile.get('id') != user.id:
+        profile = st.session_state.profile = load_profile(user.id, user.email)
+    return profile
+
+def refresh_profile():
+    st.session_state.pop('profile', None)
+
+# Feedback that has to survive st.rerun(): queued here, shown as toasts on the next run.
+def notify(message, icon="✅"):
+    st.session_state.setdefault('toasts', []).append((message, icon))
+
+def show_toasts():
+    for message, icon in st.session_state.pop('toasts', []):
+        st.toast(message, icon=icon)
 
 # --- LOGOUT DIALOG (MODAL) ---
 @st.dialog("⚠️ Confirm Logout")
@@ -39,17 +74,16 @@ def show_logout_dialog():
     
     col1, col2 = st.columns(2)
     
-    if col1.button("✅ Yes, Logout", use_container_width=True):
+    if col1.button("✅ Yes, Logout", width="stretch"):
         perform_logout()
         
-    if col2.button("❌ No, Stay", use_container_width=True):
+    if col2.button("❌ No, Stay", width="stretch"):
         st.rerun()
 
 def perform_logout():
     conn.auth.sign_out()
     st.session_state.clear()
-    st.toast("Thank you for visiting the app! Visit again soon. 👋", icon="👋")
-    time.sleep(1.5)
+    notify("Thank you for visiting the app! Visit again soon. 👋", icon="👋")
     st.rerun()
 
 def render_top_nav(profile):
@@ -61,7 +95,7 @@ def render_top_nav(profile):
     with col_logout:
         st.write("") 
         st.write("") 
-        if st.button("Logout", type="secondary", use_container_width=True):
+        if st.button("Logout", type="secondary", width="stretch"):
             show_logout_dialog()
 
     st.divider()
@@ -71,12 +105,11 @@ def login():
     email = st.text_input("Email", key="login_email")
     password = st.text_input("Password", type="password", key="login_pass")
     
-    if st.button("Sign In", type="primary", use_container_width=True):
+    if st.button("Sign In", type="primary", width="stretch"):
         try:
             session = conn.auth.sign_in_with_password(dict(email=email, password=password))
             st.session_state.user = session.user
-            st.success("Logged in successfully!")
-            time.sleep(0.5)
+            notify("Logged in successfully!")
             st.rerun()
         except Exception as e:
             st.error(f"Login failed: {e}")
@@ -94,7 +127,7 @@ def register():
         n1, n2 = generate_captcha()
         ans = st.number_input(f"{n1} + {n2} = ?", step=1)
         
-        if st.form_submit_button("Register", use_container_width=True):
+        if st.form_submit_button("Register", width="stretch"):
             if ans != (n1 + n2):
                 st.error("Wrong Captcha")
             else:
@@ -108,650 +141,830 @@ def register():
                 except Exception as e:
                     st.error(f"Error: {e}")
 
-def get_last_month_reading(flat_number, current_date):
-    try:
-        res = conn.table("sub_meter_readings").select("current_reading").eq("flat_number", flat_number).lt("bill_month", str(current_date)).order("bill_month", desc=True).limit(1).execute()
-        if res.data: return res.data[0]['current_reading']
-    except: pass
-    return 0
-
-def get_meter_rate_for_flat(flat_number, rates_data):
-    if not flat_number: return rates_data.get('Ground Meter', 0)
-    if flat_number in ['101', '102']: return rates_data.get('Ground Meter', 0)
-    if flat_number in ['201', '202']: return rates_data.get('Middle Meter', 0)
-    if flat_number in ['301', '302', '401']: return rates_data.get('Upper Meter', 0)
-    return rates_data.get('Ground Meter', 0)
+def save_batch(table, rows, on_conflict, label):
+    bar = st.progress(0.0, text=f"Saving {label}...")
+
+    def report(done, total):
+        bar.progress(done / total, text=f"Saving {label}: batch {done}/{total}")
+
+    return db.bulk_upsert(conn, table, rows, on_conflict, progress=report)
 
 # --- 3. ADMIN DASHBOARD ---
 
+def tenants_query():
+    return conn.table("profiles").select("*").eq("role", "tenant").order("flat_number")
+
+def load_tenants():
+    return tenants_query().execute().data
+
+def tenant_options(tenants):
+    return {f"{u['full_name']} ({u.get('flat_number', '?')})": u for u in tenants}
+
 def admin_dashboard(user_details):
     render_top_nav(user_details)
-    
-    tab1, tab2, tab3, tab4, tab5, tab6 = st.tabs([
-        "💰 Dues & Payments", 
-        "👥 Tenants & Flats", 
-        "🏢 Meters", 
-        "⚡ Generate Monthly", 
-        "📊 Records",
-        "📉 Outstanding Summary"
-    ])
-
-    # --- TAB 1: DUES & PAYMENTS ---
-    with tab1:
-        st.subheader("1. Payment Verification Queue (Online Claims)")
-        pending_approvals = conn.table("bills").select("*").eq("status", "Verifying").execute()
-        rent_approvals = conn.table("rent_records").select("*, profiles(full_name)").eq("status", "Verifying").execute()
+
+    sections = [
+        ("💰 Dues & Payments", render_dues_tab),
+        ("👥 Tenants & Flats", render_tenants_tab),
+        ("🏢 Meters", render_meters_tab),
+        ("⚡ Generate Monthly", render_generate_tab),
+        ("📊 Records", render_records_tab),
+        ("📉 Outstanding Summary", render_outstanding_tab),
+        ("📈 Consumption", render_analytics_tab)
+    ]
+    # Tabs track their state, so only the open tab's body runs on a rerun.
+    tabs = st.tabs([label for label, _ in sections], key="admin_tab", on_change="rerun")
+    for tab, (label, render) in zip(tabs, sections):
+        if tab.open is not False:
+            with tab, instrumentation.section(label):
+                render()
+
+# Each unpaid row gets its own fragment, so its widgets rerun on their own.
+@st.fragment
+def payment_form(table, record, amount_key, key_prefix, label, paid_msg):
+    rid = record['id']
+    already_paid = record.get('amount_paid', 0) or 0
+    total_amount = record[amount_key]
+    remaining = total_amount - already_paid
+    status_label = f" (Paid: ₹{already_paid})" if already_paid > 0 else ""
+
+    with st.expander(f"{label}: {record['bill_month']} | Due: ₹{remaining}{status_label}"):
+        pc1, pc2 = st.columns(2)
+        pay_mode = pc1.selectbox("Payment Mode", ["Cash", "Online (UPI/Bank)"], key=f"pm_{key_prefix}_{rid}")
+        pay_date = pc2.date_input("Date of Payment", value=date.today(), key=f"pd_{key_prefix}_{rid}")
+        
+        st.divider()
+        
+        pt1, pt2 = st.columns(2)
+        payment_type = pt1.selectbox("Payment Type", ["Full Payment", "Partial Payment"], index=0, key=f"pt_{key_prefix}_{rid}")
         
-        rent_verify_data = []
-        if rent_approvals.data:
-            for r in rent_approvals.data:
-                r['customer_name'] = r['profiles']['full_name'] if r['profiles'] else "Unknown"
-                rent_verify_data.append(r)
-
-        if not pending_approvals.data and not rent_verify_data:
-            st.info("No online payment claims waiting for verification.")
+        final_paying_amount = 0
+        if payment_type == "Full Payment":
+            final_paying_amount = remaining
+            pt2.info(f"✅ Full Amount: ₹{final_paying_amount}")
+            st.success("New Balance: ₹0")
         else:
-            for bill in pending_approvals.data:
-                paid_so_far = bill.get('amount_paid', 0) or 0
-                total = bill.get('total_amount', 0)
-                remaining = total - paid_so_far
-                
-                with st.expander(f"⚡ Verify Elec: {bill['customer_name']} - Claim for Remaining ₹{remaining}"):
-                    c1, c2, c3 = st.columns([2, 1, 1])
-                    c1.write(f"Month: {bill['bill_month']}")
-                    if c2.button("Approve Full", key=f"app_elec_{bill['id']}"):
-                        conn.table("bills").update({"status": "Paid", "amount_paid": total}).eq("id", bill['id']).execute()
-                        st.success("Approved!")
-                        time.sleep(0.5)
-                        st.rerun()
-                    if c3.button("Reject", key=f"rej_elec_{bill['id']}"):
-                        conn.table("bills").update({"status": "Pending"}).eq("id", bill['id']).execute()
-                        st.error("Rejected.")
-                        time.sleep(0.5)
-                        st.rerun()
-
-            for r in rent_verify_data:
-                paid_so_far = r.get('amount_paid', 0) or 0
-                total = r.get('amount', 0)
-                remaining = total - paid_so_far
-
-                with st.expander(f"🏠 Verify Rent: {r['customer_name']} - Claim for Remaining ₹{remaining}"):
-                    c1, c2, c3 = st.columns([2, 1, 1])
-                    c1.write(f"Month: {r['bill_month']}")
-                    if c2.button("Approve Full", key=f"app_rent_{r['id']}"):
-                        conn.table("rent_records").update({"status": "Paid", "amount_paid": total}).eq("id", r['id']).execute()
-                        st.success("Approved!")
-                        time.sleep(0.5)
-                        st.rerun()
-                    if c3.button("Reject", key=f"rej_rent_{r['id']}"):
-                        conn.table("rent_records").update({"status": "Pending"}).eq("id", r['id']).execute()
-                        st.error("Rejected.")
-                        time.sleep(0.5)
-                        st.rerun()
+            final_paying_amount = pt2.number_input("Enter Partial Amount (₹)", min_value=1, max_value=int(remaining), value=1, key=f"amt_{key_prefix}_{rid}")
+            bal = remaining - final_paying_amount
+            st.warning(f"🧮 **Calc:** ₹{remaining} - ₹{final_paying_amount} = **₹{bal} (Remaining)**")
 
-        st.divider()
+        txn_id = ""
+        if pay_mode == "Online (UPI/Bank)":
+            txn_id = st.text_input("Transaction ID / Ref No", key=f"tx_{key_prefix}_{rid}")
+        
+        if st.button(f"✅ Record Payment (₹{final_paying_amount})", key=f"btn_{key_prefix}_{rid}"):
+            new_total_paid = already_paid + final_paying_amount
+            new_status = "Paid" if new_total_paid >= total_amount else "Partial"
+            conn.table(table).update({"status": new_status, "amount_paid": new_total_paid, "payment_mode": pay_mode, "payment_date": str(pay_date), "txn_id": txn_id}).eq("id", rid).execute()
+            ledger.refresh(conn, [record['user_id']])
+            if new_status == "Paid": notify(paid_msg)
+            else: notify(f"Partial Payment Recorded.", icon="ℹ️")
+            st.rerun()
+
+# One amount spread oldest-first over every unpaid row; the preview uses the page's rows,
+# the write re-reads them so it never applies a payment to stale balances.
+@st.fragment
+def lump_sum_form(uid, rent_rows, elec_rows):
+    import pandas as pd
+    lc1, lc2, lc3 = st.columns(3)
+    amount = lc1.number_input("Amount Received (₹)", min_value=0, value=0, key=f"lump_amt_{uid}")
+    pay_mode = lc2.selectbox("Payment Mode", ["Cash", "Online (UPI/Bank)"], key=f"lump_pm_{uid}")
+    pay_date = lc3.date_input("Date of Payment", value=date.today(), key=f"lump_pd_{uid}")
+
+    txn_id = ""
+    if pay_mode == "Online (UPI/Bank)":
+        txn_id = st.text_input("Transaction ID / Ref No", key=f"lump_tx_{uid}")
+
+    allocations, leftover = dues.allocate_payment(rent_rows, elec_rows, amount)
+    if allocations:
+        st.dataframe(
+            pd.DataFrame(allocations)[['category', 'bill_month', 'due', 'applied', 'amount_paid', 'status']].rename(
+                columns={
+                    'category': 'Type',
+                    'bill_month': 'Month',
+                    'due': 'Due (₹)',
+                    'applied': 'Applied (₹)',
+                    'amount_paid': 'Total Paid (₹)',
+                    'status': 'New Status'
+                }
+            ),
+            hide_index=True, width="stretch"
+        )
+    if leftover > 0:
+        st.warning(f"₹{leftover} is more than the total pending and will not be recorded.")
+
+    if st.button(f"✅ Record Payment (₹{amount - leftover})", key=f"lump_btn_{uid}", disabled=not allocations):
+        payment_fields = {"payment_mode": pay_mode, "payment_date": str(pay_date), "txn_id": txn_id}
+        try:
+            try:
+                written, unapplied = dues.record_payment(conn, uid, amount, payment_fields)
+            finally:
+                ledger.refresh(conn, [uid])
+            notify(f"Payment applied to {len(written)} dues! 🎉")
+            if unapplied > leftover:
+                notify(f"₹{unapplied} was not recorded: some dues changed meanwhile. Check the balance.", icon="⚠️")
+            st.rerun()
+        except Exception as e:
+            st.error(f"❌ Error: {e}")
+
+# --- TAB 1: DUES & PAYMENTS ---
+VERIFY_PAGE_SIZE = 50
+
+# Online claims as one table: tick rows, then approve or reject them with one write per table.
+def render_verification_queue():
+    import pandas as pd
+    st.subheader("1. Payment Verification Queue (Online Claims)")
+    bills_res, rent_res = db.fetch_all(
+        conn.table("bills").select("*").eq("status", "Verifying").order("bill_month"),
+        conn.table("rent_records").select("*").eq("status", "Verifying").order("bill_month"),
+    )
+    names = {t['id']: t.get('full_name') for t in load_tenants()}
+    queue = [{"table": "bills", "row": b, "type": "⚡ Electricity", "name": b.get('customer_name'), "total": b.get('total_amount') or 0}
+             for b in bills_res.data or []]
+    queue += [{"table": "rent_records", "row": r, "type": "🏠 Rent", "name": names.get(r['user_id'], "Unknown"), "total": r.get('amount') or 0}
+              for r in rent_res.data or []]
+    if not queue:
+        st.info("No online payment claims waiting for verification.")
+        return
+    # Oldest claim first; the rows of one claim share a stamp, so they stay together.
+    queue.sort(key=lambda item: (str(item['row'].get('claimed_at') or ""), str(item['name'])))
+
+    pages = -(-len(queue) // VERIFY_PAGE_SIZE)
+    if st.session_state.get('verify_page', 1) > pages:
+        st.session_state.verify_page = pages
+    qc1, qc2, qc3 = st.columns([1, 1, 3])
+    page = qc1.number_input("Page", min_value=1, max_value=pages, key="verify_page") if pages > 1 else 1
+    select_all = qc2.checkbox("Select all on page", key=f"verify_all_{st.session_state.get('verify_round', 0)}")
+    page_items = queue[(page - 1) * VERIFY_PAGE_SIZE:page * VERIFY_PAGE_SIZE]
+    qc3.caption(f"{len(queue)} claim(s) waiting · showing {(page - 1) * VERIFY_PAGE_SIZE + 1}–"
+                f"{(page - 1) * VERIFY_PAGE_SIZE + len(page_items)}")
+
+    by_key = {f"{item['table']}:{item['row']['id']}": item for item in page_items}
+    frame = pd.DataFrame([{
+        "Select": select_all,
+        "Type": item['type'],
+        "Tenant": item['name'],
+        "Claimed At": str(item['row'].get('claimed_at') or "")[:16].replace("T", " "),
+        "Month": item['row']['bill_month'],
+        "Total (₹)": item['total'],
+        "Paid (₹)": item['row'].get('amount_paid') or 0,
+        "Claimed (₹)": item['total'] - (item['row'].get('amount_paid') or 0),
+    } for item in page_items], index=list(by_key))
+    # Rows are indexed by table:id and the key changes with the rows shown (and after every
+    # action / select-all), so a tick always stays on the claim it was made on.
+    edited = st.data_editor(
+        frame, hide_index=True, width="stretch",
+        disabled=[c for c in frame.columns if c != "Select"],
+        column_config={"Select": st.column_config.CheckboxColumn("✔")},
+        key=f"verify_editor_{st.session_state.get('verify_round', 0)}_{hash(tuple(by_key))}_{select_all}",
+    )
+    chosen = [by_key[k] for k in edited.index[edited["Select"]] if k in by_key]
+    bill_ids = [item['row']['id'] for item in chosen if item['table'] == "bills"]
+    rent_ids = [item['row']['id'] for item in chosen if item['table'] == "rent_records"]
+
+    b1, b2, _ = st.columns([1, 1, 3])
+    if b1.button(f"✅ Approve Selected ({len(chosen)})", type="primary", disabled=not chosen, width="stretch"):
+        approved = dues.approve_claims(conn, bill_ids, rent_ids)
+        ledger.refresh(conn, [item['row']['user_id'] for item in chosen])
+        st.session_state.verify_round = st.session_state.get('verify_round', 0) + 1
+        done = sum(len(ids) for ids in approved.values())
+        notify(f"Approved {done} claim(s).")
+        if done < len(chosen):
+            notify(f"{len(chosen) - done} claim(s) were no longer waiting and were left as they are.", icon="ℹ️")
+        st.rerun()
+    if b2.button(f"❌ Reject Selected ({len(chosen)})", disabled=not chosen, width="stretch"):
+        rejected = dues.reject_claims(conn, bill_ids, rent_ids)
+        st.session_state.verify_round = st.session_state.get('verify_round', 0) + 1
+        done = sum(len(ids) for ids in rejected.values())
+        notify(f"Rejected {done} claim(s).", icon="❌")
+        if done < len(chosen):
+            notify(f"{len(chosen) - done} claim(s) were no longer waiting and were left as they are.", icon="ℹ️")
+        st.rerun()
+
+def render_dues_tab():
+    render_verification_queue()
 
-        # --- MANUAL PAYMENT ENTRY ---
-        st.subheader("2. Manual Payment Entry (Full or Partial)")
-        users_resp = conn.table("profiles").select("*").eq("role", "tenant").order("flat_number").execute()
-        user_opts = {f"{u['full_name']} ({u.get('flat_number', '?')})": u for u in users_resp.data}
+    st.divider()
+
+    # --- MANUAL PAYMENT ENTRY ---
+    st.subheader("2. Manual Payment Entry (Full or Partial)")
+    user_opts = tenant_options(load_tenants())
+    
+    if user_opts:
+        sel_label = st.selectbox("Select Tenant", list(user_opts.keys()))
+        sel_u = user_opts[sel_label]
+        uid = sel_u['id']
         
-        if user_opts:
-            sel_label = st.selectbox("Select Tenant", list(user_opts.keys()))
-            sel_u = user_opts[sel_label]
-            uid = sel_u['id']
-            
-            elec_res = conn.table("bills").select("*").eq("user_id", uid).neq("status", "Paid").execute()
-            rent_res = conn.table("rent_records").select("*").eq("user_id", uid).neq("status", "Paid").execute()
-            
-            total_elec_due = sum([(item['total_amount'] - (item.get('amount_paid', 0) or 0)) for item in elec_res.data])
-            total_rent_due = sum([(item['amount'] - (item.get('amount_paid', 0) or 0)) for item in rent_res.data])
-            
-            c1, c2, c3 = st.columns(3)
-            c1.metric("Total Pending", f"₹{total_elec_due + total_rent_due}")
-            c2.metric("Rent Pending", f"₹{total_rent_due}")
-            c3.metric("Electricity Pending", f"₹{total_elec_due}")
-            
-            st.write("### 📝 Record Payment Details")
-            
+        elec_res, rent_res, bal_res = db.fetch_all(
+            conn.table("bills").select("*").eq("user_id", uid).neq("status", "Paid"),
+            conn.table("rent_records").select("*").eq("user_id", uid).neq("status", "Paid"),
+            ledger.balances_query(conn, uid),
+        )
+        
+        balances = ledger.index(bal_res.data)
+        total_elec_due = ledger.owed(balances, uid, "electricity")
+        total_rent_due = ledger.owed(balances, uid, "rent")
+        
+        c1, c2, c3 = st.columns(3)
+        c1.metric("Total Pending", f"₹{total_elec_due + total_rent_due}")
+        c2.metric("Rent Pending", f"₹{total_rent_due}")
+        c3.metric("Electricity Pending", f"₹{total_elec_due}")
+        
+        st.write("### 📝 Record Payment Details")
+        entry_mode = st.radio("Entry Mode", ["Lump-Sum (Oldest First)", "Per Bill"], horizontal=True, key="entry_mode")
+
+        if entry_mode == "Lump-Sum (Oldest First)":
+            if rent_res.data or elec_res.data:
+                lump_sum_form(uid, rent_res.data, elec_res.data)
+        else:
             # --- RENT PAYMENTS ---
             if rent_res.data:
                 st.markdown("**🏠 Rent Dues**")
                 for r in rent_res.data:
-                    already_paid = r.get('amount_paid', 0) or 0
-                    total_amount = r['amount']
-                    remaining = total_amount - already_paid
-                    status_label = f" (Paid: ₹{already_paid})" if already_paid > 0 else ""
-                    
-                    with st.expander(f"Pay Rent: {r['bill_month']} | Due: ₹{remaining}{status_label}"):
-                        rc1, rc2 = st.columns(2)
-                        pay_mode = rc1.selectbox("Payment Mode", ["Cash", "Online (UPI/Bank)"], key=f"pm_rent_{r['id']}")
-                        pay_date = rc2.date_input("Date of Payment", value=date.today(), key=f"pd_rent_{r['id']}")
-                        
-                        st.divider()
-                        
-                        pt1, pt2 = st.columns(2)
-                        payment_type = pt1.selectbox("Payment Type", ["Full Payment", "Partial Payment"], index=0, key=f"pt_rent_{r['id']}")
-                        
-                        final_paying_amount = 0
-                        if payment_type == "Full Payment":
-                            final_paying_amount = remaining
-                            pt2.info(f"✅ Full Amount: ₹{final_paying_amount}")
-                            st.success("New Balance: ₹0")
-                        else:
-                            final_paying_amount = pt2.number_input("Enter Partial Amount (₹)", min_value=1, max_value=int(remaining), value=1, key=f"amt_rent_{r['id']}")
-                            bal = remaining - final_paying_amount
-                            st.warning(f"🧮 **Calc:** ₹{remaining} - ₹{final_paying_amount} = **₹{bal} (Remaining)**")
-
-                        txn_id = ""
-                        if pay_mode == "Online (UPI/Bank)":
-                            txn_id = st.text_input("Transaction ID / Ref No", key=f"tx_rent_{r['id']}")
-                        
-                        if st.button(f"✅ Record Payment (₹{final_paying_amount})", key=f"btn_rent_{r['id']}"):
-                            new_total_paid = already_paid + final_paying_amount
-                            new_status = "Paid" if new_total_paid >= total_amount else "Partial"
-                            conn.table("rent_records").update({"status": new_status, "amount_paid": new_total_paid, "payment_mode": pay_mode, "payment_date": str(pay_date), "txn_id": txn_id}).eq("id", r['id']).execute()
-                            if new_status == "Paid": st.success("Rent Fully Paid! 🎉")
-                            else: st.info(f"Partial Payment Recorded.")
-                            time.sleep(1)
-                            st.rerun()
+                    payment_form("rent_records", r, "amount", "rent", "Pay Rent", "Rent Fully Paid! 🎉")
             
             # --- ELECTRICITY PAYMENTS ---
             if elec_res.data:
                 st.divider()
                 st.markdown("**⚡ Electricity Dues**")
                 for b in elec_res.data:
-                    already_paid = b.get('amount_paid', 0) or 0
-                    total_amount = b['total_amount']
-                    remaining = total_amount - already_paid
-                    status_label = f" (Paid: ₹{already_paid})" if already_paid > 0 else ""
-
-                    with st.expander(f"Pay Bill: {b['bill_month']} | Due: ₹{remaining}{status_label}"):
-                        ec1, ec2 = st.columns(2)
-                        pay_mode = ec1.selectbox("Payment Mode", ["Cash", "Online (UPI/Bank)"], key=f"pm_elec_{b['id']}")
-                        pay_date = ec2.date_input("Date of Payment", value=date.today(), key=f"pd_elec_{b['id']}")
-                        
-                        st.divider()
-                        
-                        et1, et2 = st.columns(2)
-                        payment_type = et1.selectbox("Payment Type", ["Full Payment", "Partial Payment"], index=0, key=f"pt_elec_{b['id']}")
-                        
-                        final_paying_amount = 0
-                        if payment_type == "Full Payment":
-                            final_paying_amount = remaining
-                            et2.info(f"✅ Full Amount: ₹{final_paying_amount}")
-                            st.success("New Balance: ₹0")
-                        else:
-                            final_paying_amount = et2.number_input("Enter Partial Amount (₹)", min_value=1, max_value=int(remaining), value=1, key=f"amt_elec_{b['id']}")
-                            bal = remaining - final_paying_amount
-                            st.warning(f"🧮 **Calc:** ₹{remaining} - ₹{final_paying_amount} = **₹{bal} (Remaining)**")
-
-                        txn_id = ""
-                        if pay_mode == "Online (UPI/Bank)":
-                            txn_id = st.text_input("Transaction ID / Ref No", key=f"tx_elec_{b['id']}")
-                        
-                        if st.button(f"✅ Record Payment (₹{final_paying_amount})", key=f"btn_elec_{b['id']}"):
-                            new_total_paid = already_paid + final_paying_amount
-                            new_status = "Paid" if new_total_paid >= total_amount else "Partial"
-                            conn.table("bills").update({"status": new_status, "amount_paid": new_total_paid, "payment_mode": pay_mode, "payment_date": str(pay_date), "txn_id": txn_id}).eq("id", b['id']).execute()
-                            if new_status == "Paid": st.success("Bill Fully Paid! 🎉")
-                            else: st.info(f"Partial Payment Recorded.")
-                            time.sleep(1)
-                            st.rerun()
-
-    # --- TAB 2: MANAGE TENANT DETAILS ---
-    with tab2:
-        st.subheader("Tenant Allotment & Rent Settings")
-        if users_resp.data:
-            df_users = pd.DataFrame(users_resp.data)
-            
-            # --- UPDATED: Showing Num People with nice column names ---
-            df_display = df_users[['full_name', 'flat_number', 'num_people', 'rent_amount', 'mobile']].rename(
-                columns={
-                    'full_name': 'Name', 
-                    'flat_number': 'Flat', 
-                    'num_people': 'People Count', 
-                    'rent_amount': 'Rent (₹)', 
-                    'mobile': 'Mobile'
-                }
-            )
-            st.dataframe(df_display, hide_index=True, use_container_width=True)
-            
-            st.divider()
-            st.write("### Edit Tenant Profile")
-            col1, col2 = st.columns(2)
-            sel_u_edit_name = col1.selectbox("Select Tenant to Edit", list(user_opts.keys()), key="edit_sel")
-            sel_u_edit = user_opts[sel_u_edit_name]
-            
-            flat_opts = ["101", "102", "201", "202", "301", "302", "401", "Other"]
-            current_flat = sel_u_edit.get('flat_number')
-            f_idx = flat_opts.index(current_flat) if current_flat in flat_opts else 7
-            
-            with st.form("update_tenant_full"):
-                c1, c2 = st.columns(2)
-                new_flat = c1.selectbox("Assign Flat", flat_opts, index=f_idx)
-                new_rent = c2.number_input("Monthly Rent Amount (₹)", value=sel_u_edit.get('rent_amount', 0) or 0, min_value=0)
-                
-                c3, c4 = st.columns(2)
-                new_count = c3.number_input("People Count", value=sel_u_edit.get('num_people', 0) or 0, min_value=0)
-                new_mobile = c4.text_input("Mobile", value=sel_u_edit.get('mobile', ''))
-                
-                if st.form_submit_button("Update Tenant"):
-                    conn.table("profiles").update({
-                        "num_people": new_count, 
-                        "flat_number": new_flat,
-                        "mobile": new_mobile,
-                        "rent_amount": new_rent
-                    }).eq("id", sel_u_edit['id']).execute()
-                    st.success("✅ Tenant details updated successfully!")
-                    st.rerun()
-
-    # --- TAB 3: MAIN METERS CALCULATOR ---
-    with tab3:
-        st.subheader("Input Meter Readings")
-        col_sel1, col_sel2 = st.columns(2)
-        meter_type = col_sel1.radio("Select Floor:", ["Ground Meter", "Middle Meter", "Upper Meter"], horizontal=True)
-        bill_date = col_sel2.date_input("Bill Date", value=date.today())
-
-        main_prev = 0
-        try:
-            last_meter = conn.table("main_meters").select("current_reading").eq("meter_name", meter_type).lt("bill_month", str(bill_date)).order("bill_month", desc=True).limit(1).execute()
-            if last_meter.data: main_prev = last_meter.data[0]['current_reading']
-        except: pass
-
-        st.markdown(f"### 1. {meter_type} (Main)")
-        col_m1, col_m2, col_m3 = st.columns(3)
-        mm_prev = col_m1.number_input("Main Prev", min_value=0, value=int(main_prev or 0))
-        mm_curr = col_m2.number_input("Main Curr", min_value=0, value=0)
-        mm_bill = col_m3.number_input("Total Bill (₹)", min_value=0.0)
+                    payment_form("bills", b, "total_amount", "elec", "Pay Bill", "Bill Fully Paid! 🎉")
+
+# --- TAB 2: MANAGE TENANT DETAILS ---
+def render_tenants_tab():
+    import pandas as pd
+    st.subheader("Tenant Allotment & Rent Settings")
+    tenants = load_tenants()
+    if tenants:
+        user_opts = tenant_options(tenants)
+        df_users = pd.DataFrame(tenants)
         
-        mm_units = mm_curr - mm_prev
-        mm_rate = 0.0
-        if mm_units > 0: mm_rate = mm_bill / mm_units
-        st.info(f"**Consumption:** {mm_units} | **Rate:** ₹{mm_rate:.4f}")
+        # --- UPDATED: Showing Num People with nice column names ---
+        df_display = df_users[['full_name', 'flat_number', 'num_people', 'rent_amount', 'mobile']].rename(
+            columns={
+                'full_name': 'Name', 
+                'flat_number': 'Flat', 
+                'num_people': 'People Count', 
+                'rent_amount': 'Rent (₹)', 
+                'mobile': 'Mobile'
+            }
+        )
+        st.dataframe(df_display, hide_index=True, width="stretch")
         
-        water_units = 0
-        water_cost = 0.0
-        sub_readings_to_save = [] 
-
-        if meter_type == "Ground Meter":
-            st.markdown("### 2. Sub-Meters")
-            c_g1, c_g2 = st.columns(2)
-            p101 = get_last_month_reading("101", bill_date)
-            g1_prev = c_g1.number_input("101 Prev", value=int(p101), key="101p")
-            g1_curr = c_g1.number_input("101 Curr", value=0, key="101c")
-            sub_readings_to_save.append({"flat": "101", "prev": g1_prev, "curr": g1_curr, "units": g1_curr - g1_prev})
-            
-            p102 = get_last_month_reading("102", bill_date)
-            g2_prev = c_g2.number_input("102 Prev", value=int(p102), key="102p")
-            g2_curr = c_g2.number_input("102 Curr", value=0, key="102c")
-            sub_readings_to_save.append({"flat": "102", "prev": g2_prev, "curr": g2_curr, "units": g2_curr - g2_prev})
-            
-            water_units = mm_units - ((g1_curr-g1_prev) + (g2_curr-g2_prev))
-            if water_units < 0: water_units = 0
-            water_cost = water_units * mm_rate
-            st.warning(f"💧 **Common/Water Usage:** {water_units} Units (Cost: ₹{water_cost:.2f})")
-
-        elif meter_type == "Middle Meter":
-            st.markdown("### 2. Sub-Meters")
-            c_m1, c_m2 = st.columns(2)
-            p201 = get_last_month_reading("201", bill_date)
-            m201_prev = c_m1.number_input("201 Prev", value=int(p201), key="201p")
-            m201_curr = c_m1.number_input("201 Curr", value=0, key="201c")
-            m201_units = m201_curr - m201_prev
-            sub_readings_to_save.append({"flat": "201", "prev": m201_prev, "curr": m201_curr, "units": m201_units})
-            
-            m202_units = mm_units - m201_units
-            if m202_units < 0: m202_units = 0
-            p202 = get_last_month_reading("202", bill_date)
-            sub_readings_to_save.append({"flat": "202", "prev": p202, "curr": p202 + m202_units, "units": m202_units})
-
-        elif meter_type == "Upper Meter":
-            st.markdown("### 2. Sub-Meters")
-            c_u1, c_u2 = st.columns(2)
-            p301 = get_last_month_reading("301", bill_date)
-            u301_prev = c_u1.number_input("301 Prev", value=int(p301), key="301p")
-            u301_curr = c_u1.number_input("301 Curr", value=0, key="301c")
-            u301_units = u301_curr - u301_prev
-            sub_readings_to_save.append({"flat": "301", "prev": u301_prev, "curr": u301_curr, "units": u301_units})
+        st.divider()
+        st.write("### Edit Tenant Profile")
+        col1, col2 = st.columns(2)
+        sel_u_edit_name = col1.selectbox("Select Tenant to Edit", list(user_opts.keys()), key="edit_sel")
+        sel_u_edit = user_opts[sel_u_edit_name]
+        
+        flat_opts = meters.all_flats(meters.load_topology()) + ["Other"]
+        current_flat = sel_u_edit.get('flat_number')
+        f_idx = flat_opts.index(current_flat) if current_flat in flat_opts else len(flat_opts) - 1
+        
+        with st.form("update_tenant_full"):
+            c1, c2 = st.columns(2)
+            new_flat = c1.selectbox("Assign Flat", flat_opts, index=f_idx)
+            new_rent = c2.number_input("Monthly Rent Amount (₹)", value=sel_u_edit.get('rent_amount', 0) or 0, min_value=0)
             
-            p401 = get_last_month_reading("401", bill_date)
-            u401_prev = c_u2.number_input("401 Prev", value=int(p401), key="401p")
-            u401_curr = c_u2.number_input("401 Curr", value=0, key="401c")
-            u401_units = u401_curr - u401_prev
-            sub_readings_to_save.append({"flat": "401", "prev": u401_prev, "curr": u401_curr, "units": u401_units})
+            c3, c4 = st.columns(2)
+            new_count = c3.number_input("People Count", value=sel_u_edit.get('num_people', 0) or 0, min_value=0)
+            new_mobile = c4.text_input("Mobile", value=sel_u_edit.get('mobile', ''))
             
-            u302_units = mm_units - (u301_units + u401_units)
-            if u302_units < 0: u302_units = 0
-            p302 = get_last_month_reading("302", bill_date)
-            sub_readings_to_save.append({"flat": "302", "prev": p302, "curr": p302 + u302_units, "units": u302_units})
+            if st.form_submit_button("Update Tenant"):
+                conn.table("profiles").update({
+                    "num_people": new_count, 
+                    "flat_number": new_flat,
+                    "mobile": new_mobile,
+                    "rent_amount": new_rent
+                }).eq("id", sel_u_edit['id']).execute()
+                if sel_u_edit['id'] == st.session_state.user.id:
+                    refresh_profile()
+                notify("✅ Tenant details updated successfully!")
+                st.rerun()
 
-        if st.button(f"Save {meter_type} Readings"):
-            try:
-                conn.table("main_meters").upsert({
-                    "meter_name": meter_type,
-                    "bill_month": str(bill_date),
-                    "previous_reading": mm_prev,
-                    "current_reading": mm_curr,
-                    "units_consumed": mm_units,
-                    "total_bill_amount": mm_bill,
-                    "calculated_rate": mm_rate,
-                    "water_units": water_units,
-                    "water_cost": water_cost
-                }, on_conflict="meter_name, bill_month").execute()
-                
-                for item in sub_readings_to_save:
-                    conn.table("sub_meter_readings").upsert({
-                        "flat_number": item['flat'],
-                        "bill_month": str(bill_date),
-                        "previous_reading": item['prev'],
-                        "current_reading": item['curr'],
-                        "units_consumed": item['units']
-                    }, on_conflict="flat_number, bill_month").execute()
-                    
-                st.success(f"✅ Saved Readings!")
-            except Exception as e:
-                st.error(f"❌ Error: {e}")
+# --- TAB 3: MAIN METERS CALCULATOR ---
+# Fragment: typing a reading only reruns this calculator.
+@st.fragment
+def render_meters_tab():
+    st.subheader("Input Meter Readings")
+    topology = meters.load_topology()
+    col_sel1, col_sel2 = st.columns(2)
+    meter_type = col_sel1.radio("Select Floor:", topology["mains"], horizontal=True)
+    bill_date = col_sel2.date_input("Bill Date", value=date.today())
 
-    # --- TAB 4: GENERATE BILLS ---
-    with tab4:
-        st.subheader("Generate Monthly Bills")
-        col_gen1, col_gen2 = st.columns(2)
-        gen_date = col_gen1.date_input("Bill Date for Generation", value=date.today())
-        
-        st.markdown("### 📊 Financial Overview for Month")
-        admin_paid = 0
+    floor_meters = meters.meters_under(topology, meter_type)
+    metered_names = [n for n in floor_meters if topology["meters"][n]["type"] == "metered"]
+    try:
+        main_prev = meters.previous_main_readings(conn, [meter_type], bill_date).get(meter_type, 0)
+        prev_readings = meters.previous_sub_readings(conn, meters.flats_under(topology, meter_type) + metered_names, bill_date)
+    except Exception as e:
+        st.error(f"🚨 DATABASE ERROR (Fetching Previous Readings): {e}")
+        main_prev, prev_readings = 0, {}
+
+    st.markdown(f"### 1. {meter_type} (Main)")
+    col_m1, col_m2, col_m3 = st.columns(3)
+    mm_prev = col_m1.number_input("Main Prev", min_value=0, value=int(main_prev or 0))
+    mm_curr = col_m2.number_input("Main Curr", min_value=0, value=0)
+    mm_bill = col_m3.number_input("Total Bill (₹)", min_value=0.0)
+    
+    mm_units = mm_curr - mm_prev
+    mm_rate = 0.0
+    if mm_units > 0: mm_rate = mm_bill / mm_units
+    st.info(f"**Consumption:** {mm_units} | **Rate:** ₹{mm_rate:.4f}")
+
+    metered = {}
+    if floor_meters:
+        st.markdown("### 2. Sub-Meters")
+        sub_cols = st.columns(2)
+        for i, name in enumerate(metered_names):
+            col = sub_cols[i % 2]
+            prev = prev_readings.get(meters.reading_key(topology, name)) or 0
+            sub_prev = col.number_input(f"{name} Prev", value=int(prev), key=f"{name}p")
+            sub_curr = col.number_input(f"{name} Curr", value=0, key=f"{name}c")
+            metered[name] = (sub_prev, sub_curr)
+
+    sub_readings_to_save, water = meters.compute_readings(topology, {meter_type: mm_units}, metered, prev_readings)
+    water_units = water[meter_type]
+    water_cost = water_units * mm_rate
+    if any(topology["meters"][n]["type"] == "derived" and not topology["meters"][n].get("flat") for n in floor_meters):
+        st.warning(f"💧 **Common/Water Usage:** {water_units} Units (Cost: ₹{water_cost:.2f})")
+
+    if st.button(f"Save {meter_type} Readings"):
         try:
-            mm_res_fin = conn.table("main_meters").select("total_bill_amount").eq("bill_month", str(gen_date)).execute()
-            if mm_res_fin.data:
-                admin_paid = sum([m['total_bill_amount'] for m in mm_res_fin.data])
+            conn.table("main_meters").upsert({
+                "meter_name": meter_type,
+                "bill_month": str(bill_date),
+                "previous_reading": mm_prev,
+                "current_reading": mm_curr,
+                "units_consumed": mm_units,
+                "total_bill_amount": mm_bill,
+                "calculated_rate": mm_rate,
+                "water_units": water_units,
+                "water_cost": water_cost
+            }, on_conflict="meter_name, bill_month").execute()
+
+            save_batch("sub_meter_readings", [{
+                "flat_number": item['flat'],
+                "bill_month": str(bill_date),
+                "previous_reading": item['prev'],
+                "current_reading": item['curr'],
+                "units_consumed": item['units']
+            } for item in sub_readings_to_save], "flat_number, bill_month", "Sub-Meter Readings")
+            st.success(f"✅ Saved Readings!")
         except Exception as e:
-            st.error(f"🚨 DATABASE ERROR (Fetching Main Meters for Overview): {e}")
-            
-        tenant_recovery = 0
+            st.error(f"❌ Error: {e}")
+        else:
+            # The readings are saved by now; a rollup failure only leaves the Consumption tab stale.
+            try:
+                import analytics
+                analytics.update_month(conn, bill_date)
+            except Exception as e:
+                st.warning(f"⚠️ Readings saved, but the consumption rollups were not updated: {e}. "
+                           "Use Rebuild Rollups in the Consumption tab.")
+
+    render_readings_import(topology)
+
+# Bulk upload of many months/buildings at once; same residual/water rules as the form above.
+def render_readings_import(topology):
+    import pandas as pd
+    import readings_import
+    with st.expander("📥 Bulk Import Readings (CSV / Excel)"):
+        st.caption(
+            "One row per meter per month: bill_month, meter (main meter or flat), previous_reading (optional), "
+            "current_reading, total_bill_amount (main meters only). Sort by month; derived flats and water are computed."
+        )
+        st.download_button("⬇️ Template (CSV)", readings_import.template_csv(topology), file_name="readings_template.csv", mime="text/csv")
+        upload = st.file_uploader("Readings File", type=["csv", "xlsx"], key="readings_file")
+        if upload is None:
+            return
+
+        i1, i2 = st.columns(2)
+        validate = i1.button("🔍 Validate Only", width="stretch")
+        commit = i2.button("📥 Import Readings", type="primary", width="stretch")
+        if not (validate or commit):
+            return
+
+        bar = st.progress(0.0, text="Reading file...")
+        def report_progress(rows):
+            bar.progress(min(upload.tell() / max(upload.size, 1), 1.0), text=f"{rows} rows read")
+        upload.seek(0)
         try:
-            bills_res = conn.table("bills").select("total_amount").eq("bill_month", str(gen_date)).execute()
-            if bills_res.data:
-                tenant_recovery = sum([b['total_amount'] for b in bills_res.data])
+            report = readings_import.import_readings(
+                conn, readings_import.read_chunks(upload, upload.name), topology, commit=commit, progress=report_progress
+            )
         except Exception as e:
-            pass
-            
-        f1, f2 = st.columns(2)
-        f1.metric("💸 Total Admin Payment", f"₹{admin_paid}")
-        f2.metric("💰 Total Tenant Recovery", f"₹{tenant_recovery}")
+            st.error(f"❌ Error: {e}")
+            return
+        finally:
+            bar.empty()
+
+        verb = "Imported" if commit else "Ready to import"
+        st.success(
+            f"{verb}: {report['main_rows']} main meter and {report['sub_rows']} sub-meter readings "
+            f"across {len(report['months'])} month(s), from {report['rows']} rows."
+        )
+        if report['errors']:
+            errors = pd.DataFrame(report['errors'])
+            st.error(f"{len(errors)} row(s) rejected.")
+            st.dataframe(errors, hide_index=True, width="stretch")
+            st.download_button("⬇️ Error Report (CSV)", errors.to_csv(index=False), file_name="import_errors.csv", mime="text/csv")
+
+# --- TAB 4: GENERATE BILLS ---
+# Fragment: changing the date only recomputes this preview.
+@st.fragment
+def render_generate_tab():
+    import billing
+    st.subheader("Generate Monthly Bills")
+    col_gen1, col_gen2 = st.columns(2)
+    gen_date = col_gen1.date_input("Bill Date for Generation", value=date.today())
+    # Every read this tab needs goes out at once; failures come back in place of results.
+    tenants_res, mm_res_fin, bills_res, mm_res_full, sub_res_all = db.fetch_all(
+        tenants_query(),
+        conn.table("main_meters").select("total_bill_amount").eq("bill_month", str(gen_date)),
+        conn.table("bills").select("total_amount").eq("bill_month", str(gen_date)),
+        conn.table("main_meters").select("*").eq("bill_month", str(gen_date)),
+        conn.table("sub_meter_readings").select("*").eq("bill_month", str(gen_date)),
+        return_exceptions=True,
+    )
+    if isinstance(tenants_res, Exception):
+        raise tenants_res
+    tenants = tenants_res.data
+    
+    st.markdown("### 📊 Financial Overview for Month")
+    admin_paid = 0
+    if isinstance(mm_res_fin, Exception):
+        st.error(f"🚨 DATABASE ERROR (Fetching Main Meters for Overview): {mm_res_fin}")
+    elif mm_res_fin.data:
+        admin_paid = sum([m['total_bill_amount'] for m in mm_res_fin.data])
         
-        st.divider()
-        col_A, col_B = st.columns(2)
+    tenant_recovery = 0
+    if not isinstance(bills_res, Exception) and bills_res.data:
+        tenant_recovery = sum([b['total_amount'] for b in bills_res.data])
         
-        with col_A:
-            st.markdown("### ⚡ Electricity Generation")
-            rates_data = {}
-            water_stats = {"units": 0, "rate": 0}
-            
-            try:
-                mm_res_full = conn.table("main_meters").select("*").eq("bill_month", str(gen_date)).execute()
-                if mm_res_full.data:
-                    for m in mm_res_full.data:
-                        rates_data[m['meter_name']] = m['calculated_rate']
-                        if m['meter_name'] == "Ground Meter":
-                            water_stats["units"] = m.get('water_units', 0)
-                            water_stats["rate"] = m.get('calculated_rate', 0)
-            except Exception as e:
-                st.error(f"🚨 DATABASE ERROR (Fetching Main Meters Details): {e}")
+    f1, f2 = st.columns(2)
+    f1.metric("💸 Total Admin Payment", f"₹{admin_paid}")
+    f2.metric("💰 Total Tenant Recovery", f"₹{tenant_recovery}")
+    
+    st.divider()
+    col_A, col_B = st.columns(2)
+    
+    with col_A:
+        st.markdown("### ⚡ Electricity Generation")
+        mm_rows = []
+        if isinstance(mm_res_full, Exception):
+            st.error(f"🚨 DATABASE ERROR (Fetching Main Meters Details): {mm_res_full}")
+        else:
+            mm_rows = mm_res_full.data or []
 
-            if not rates_data:
-                st.warning("⚠️ Meters not saved for this exact date.")
+        if not mm_rows:
+            st.warning("⚠️ Meters not saved for this exact date.")
+        else:
+            if isinstance(sub_res_all, Exception):
+                st.error(f"🚨 DATABASE ERROR (Fetching Sub Meters): {sub_res_all}")
+                sub_rows = []
             else:
-                water_rate = rates_data.get('Ground Meter', 0)
-                
+                sub_rows = sub_res_all.data or []
+
+            bill_frame, water = billing.compute_electricity_bills(mm_rows, sub_rows, tenants, gen_date)
+            elec_batch = billing.bill_records(bill_frame)
+
+            st.caption(
+                f"💧 Water Share: ({water['units']} Units / {water['active_people']} Active People) × Tenant People, "
+                f"billed at ₹{water['rate']:.2f}/Unit. Inactive tenants (0 units) skip the water charge."
+            )
+            st.dataframe(
+                bill_frame[['customer_name', 'flat_number', 'units_consumed', 'rate_per_unit', 'elec_cost',
+                            'num_people', 'tenant_water_units', 'water_charge', 'total_amount', 'is_active']].rename(
+                    columns={
+                        'customer_name': 'Name',
+                        'flat_number': 'Flat',
+                        'units_consumed': 'Units',
+                        'rate_per_unit': 'Rate (₹/Unit)',
+                        'elec_cost': 'Electricity (₹)',
+                        'num_people': 'People',
+                        'tenant_water_units': 'Water Units',
+                        'water_charge': 'Water (₹)',
+                        'total_amount': 'Total (₹)',
+                        'is_active': 'Active'
+                    }
+                ).style.format({
+                    'Rate (₹/Unit)': "{:.2f}",
+                    'Electricity (₹)': "₹{:.2f}",
+                    'Water Units': "{:.2f}",
+                    'Water (₹)': "₹{:.2f}"
+                }),
+                hide_index=True, width="stretch"
+            )
+
+            if st.button("🚀 Generate Electricity Bills", type="primary", disabled=len(elec_batch)==0):
+                if elec_batch:
+                    try:
+                        written = save_batch("bills", elec_batch, "user_id, bill_month", "Electricity Bills")
+                        ledger.refresh(conn, [b['user_id'] for b in elec_batch])
+                        st.success(f"Generated {written} Electricity Bills!")
+                    except db.PartialWriteError as e:
+                        ledger.refresh(conn, [b['user_id'] for b in elec_batch[:e.written.get("bills", 0)]])
+                        st.error(f"❌ {e}")
+                    except Exception as e:
+                        st.error(f"❌ Error: {e}")
+
+    # RENT GENERATION
+    with col_B:
+        st.markdown("### 🏠 Rent Generation")
+        rent_frame = billing.build_rent_batch(tenants, gen_date)
+        rent_batch = billing.rent_records(rent_frame)
+        for name, amount in zip(rent_frame['customer_name'], rent_frame['amount']):
+            st.caption(f"✅ {name}: ₹{amount}")
+        
+        if st.button("🚀 Generate Rent Bills", type="primary"):
+            if rent_batch:
                 try:
-                    sub_res_all = conn.table("sub_meter_readings").select("*").eq("bill_month", str(gen_date)).execute()
-                    sub_map = {row['flat_number']: row for row in sub_res_all.data} if sub_res_all.data else {}
+                    written = save_batch("rent_records", rent_batch, "user_id, bill_month", "Rent Records")
+                    ledger.refresh(conn, [r['user_id'] for r in rent_batch])
+                    st.success(f"Generated {written} Rent Records!")
+                except db.PartialWriteError as e:
+                    ledger.refresh(conn, [r['user_id'] for r in rent_batch[:e.written.get("rent_records", 0)]])
+                    st.error(f"❌ {e}")
                 except Exception as e:
-                    st.error(f"🚨 DATABASE ERROR (Fetching Sub Meters): {e}")
-                    sub_map = {}
-                
-                processed_tenants = []
-                total_active_people = 0
-                
-                if users_resp.data:
-                    for t in users_resp.data:
-                        flat = t.get('flat_number', 'Unknown')
-                        t_people = t.get('num_people') or 0
-                        reading_data = sub_map.get(flat, {})
-                        
-                        elec_units = reading_data.get('units_consumed', 0)
-                        t_prev = reading_data.get('previous_reading', 0)
-                        t_curr = reading_data.get('current_reading', 0)
-                        
-                        is_active = elec_units > 0
-                        if is_active:
-                            total_active_people += t_people
-                        
-                        processed_tenants.append({
-                            'tenant': t,
-                            'elec_units': elec_units,
-                            't_prev': t_prev,
-                            't_curr': t_curr,
-                            't_people': t_people,
-                            'is_active': is_active
-                        })
-                
-                if total_active_people == 0: total_active_people = 1 
-                units_per_person = water_stats["units"] / total_active_people
-                
-                elec_batch = []
-                for item in processed_tenants:
-                    t = item['tenant']
-                    elec_units = item['elec_units']
-                    is_active = item['is_active']
-                    flat = t.get('flat_number', 'Unknown')
-                    
-                    rate = get_meter_rate_for_flat(flat, rates_data)
-                    elec_cost = elec_units * rate
-                    
-                    if is_active:
-                        t_people = item['t_people']
-                        tenant_water_share_units = units_per_person * t_people
-                        water_cost = tenant_water_share_units * water_rate
-                        total_elec_amt = math.ceil(elec_cost + water_cost)
-                        
-                        elec_obj = {
-                            "user_id": t['id'], "customer_name": t['full_name'], "bill_month": str(gen_date),
-                            "previous_reading": item['t_prev'], "current_reading": item['t_curr'],
-                            "units_consumed": elec_units, "tenant_water_units": tenant_water_share_units,
-                            "rate_per_unit": rate, "water_charge": water_cost,
-                            "total_amount": total_elec_amt, "status": "Pending"
-                        }
-                        elec_batch.append(elec_obj)
-                        
-                        with st.expander(f"✅ {t['full_name']}: ₹{total_elec_amt}"):
-                            st.write("**1. Electricity**")
-                            st.caption(f"{elec_units} units × ₹{rate:.2f}/unit = **₹{elec_cost:.2f}**")
-                            st.write("**2. Water Share**")
-                            st.caption(f"({water_stats['units']} Units / {total_active_people} Active People) × {t_people} Tenant People = {tenant_water_share_units:.2f} Units")
-                            st.caption(f"{tenant_water_share_units:.2f} Units × ₹{water_rate:.2f}/Unit = **₹{water_cost:.2f}**")
-                            st.divider()
-                            st.write(f"**Grand Total:** ₹{elec_cost:.2f} + ₹{water_cost:.2f} = **₹{total_elec_amt}**")
-                    else:
-                        with st.expander(f"⚠️ {t['full_name']} (Inactive)"):
-                            st.info("Electricity consumption is 0. Water charge is skipped.")
-                            st.caption(f"Electricity: 0 units | Water: ₹0")
-
-                if st.button("🚀 Generate Electricity Bills", type="primary", disabled=len(elec_batch)==0):
-                    if elec_batch:
-                        for obj in elec_batch:
-                            conn.table("bills").upsert(obj, on_conflict="user_id, bill_month").execute()
-                        st.success(f"Generated {len(elec_batch)} Electricity Bills!")
-
-        # RENT GENERATION
-        with col_B:
-            st.markdown("### 🏠 Rent Generation")
-            rent_batch = []
-            if users_resp.data:
-                for t in users_resp.data:
-                    rent_amt = t.get('rent_amount') or 0
-                    if rent_amt > 0:
-                        rent_obj = {
-                            "user_id": t['id'], "bill_month": str(gen_date),
-                            "amount": rent_amt, "status": "Pending"
-                        }
-                        rent_batch.append(rent_obj)
-                        st.caption(f"✅ {t['full_name']}: ₹{rent_amt}")
-            
-            if st.button("🚀 Generate Rent Bills", type="primary"):
-                if rent_batch:
-                    for obj in rent_batch:
-                        conn.table("rent_records").upsert(obj, on_conflict="user_id, bill_month").execute()
-                    st.success(f"Generated {len(rent_batch)} Rent Records!")
-                else:
-                    st.warning("No tenants with rent amount > 0 found.")
+                    st.error(f"❌ Error: {e}")
+            else:
+                st.warning("No tenants with rent amount > 0 found.")
 
-    # --- TAB 5: RECORDS ---
-    with tab5:
-        st.subheader("Records")
-        r_opt = st.radio("View:", ["Electricity Bills", "Rent Records"])
-        if st.button("Refresh"): st.rerun()
-        
-        if r_opt == "Electricity Bills":
-            res = conn.table("bills").select("*").order("created_at", desc=True).limit(20).execute()
-            if res.data: 
-                clean_data = []
-                for item in res.data:
-                    item['txn_id'] = item.get('txn_id') or '-'
-                    item['payment_mode'] = item.get('payment_mode') or '-'
-                    clean_data.append(item)
-                st.dataframe(pd.DataFrame(clean_data)[['customer_name', 'bill_month', 'total_amount', 'amount_paid', 'status', 'payment_mode', 'txn_id']])
-        else:
-            rent_res = conn.table("rent_records").select("*").order("created_at", desc=True).limit(20).execute()
-            if rent_res.data:
-                prof_res = conn.table("profiles").select("id, full_name").execute()
-                p_map = {p['id']: p['full_name'] for p in prof_res.data}
-                clean_data = []
-                for r in rent_res.data:
-                    r['name'] = p_map.get(r['user_id'], 'Unknown')
-                    r['txn_id'] = r.get('txn_id') or '-'
-                    r['payment_mode'] = r.get('payment_mode') or '-'
-                    clean_data.append(r)
-                st.dataframe(pd.DataFrame(clean_data)[['name', 'bill_month', 'amount', 'amount_paid', 'status', 'payment_mode', 'txn_id']])
-
-    # --- TAB 6: OUTSTANDING SUMMARY ---
-    with tab6:
-        st.subheader("📉 Consolidated Outstanding Summary")
-        
-        summary_data = []
-        all_tenants = conn.table("profiles").select("*").eq("role", "tenant").execute()
-        all_pending_elec = conn.table("bills").select("*").neq("status", "Paid").execute()
-        all_pending_rent = conn.table("rent_records").select("*").neq("status", "Paid").execute()
-        
-        def get_user_total(uid, record_list, amount_key):
-            return sum([(r[amount_key] - (r.get('amount_paid', 0) or 0)) for r in record_list if r['user_id'] == uid])
-
-        if all_tenants.data:
-            for t in all_tenants.data:
-                uid = t['id']
-                rent_pending = get_user_total(uid, all_pending_rent.data, 'amount')
-                
-                # --- NEW WHATSAPP LOGIC (ELECTRICITY ONLY) ---
-                user_elec_bills = [b for b in all_pending_elec.data if b['user_id'] == uid]
-                elec_pending = 0
-                breakdown_text = ""
-                valid_bills_count = 0
-
-                for b in user_elec_bills:
-                    rem = b['total_amount'] - (b.get('amount_paid', 0) or 0)
-                    if rem > 0:
-                        elec_pending += rem
-                        breakdown_text += f"- {b['bill_month']}: ₹{rem}\n"
-                        valid_bills_count += 1
-                
-                total = rent_pending + elec_pending
-                wa_link = None
-                
-                if elec_pending > 0:
-                    mobile = str(t.get('mobile', '')).strip()
-                    if len(mobile) == 10: mobile = "91" + mobile
-                    elif mobile.startswith("+"): mobile = mobile[1:]
-                    
-                    if mobile:
-                        msg = f"Hello,\n\nThis is a gentle reminder regarding your Electricity dues.\n\n"
-                        
-                        if valid_bills_count == 1:
-                            msg += f"Pending {breakdown_text}"
-                        else:
-                            msg += f"Breakdown of pending months:\n{breakdown_text}\n*Total Electricity Due: ₹{elec_pending}*\n"
-                            
-                        msg += "\nThank you"
-                        safe_msg = urllib.parse.quote(msg)
-                        wa_link = f"https://wa.me/{mobile}?text={safe_msg}"
-                # ----------------------------------------------
-
-                summary_data.append({
-                    "Tenant Name": t['full_name'],
-                    "Flat Number": t.get('flat_number', 'N/A'),
-                    "Rent Pending (₹)": rent_pending,
-                    "Electricity Pending (₹)": elec_pending,
-                    "Total Due (₹)": total,
-                    "WhatsApp Link": wa_link
-                })
-        
-        if summary_data:
-            df_summary = pd.DataFrame(summary_data)
-            total_row = pd.DataFrame({
-                "Tenant Name": ["TOTAL"],
-                "Flat Number": ["-"],
-                "Rent Pending (₹)": [df_summary["Rent Pending (₹)"].sum()],
-                "Electricity Pending (₹)": [df_summary["Electricity Pending (₹)"].sum()],
-                "Total Due (₹)": [df_summary["Total Due (₹)"].sum()],
-                "WhatsApp Link": [None]
-            })
-            df_final = pd.concat([df_summary, total_row], ignore_index=True)
-            
+    st.divider()
+    render_backfill()
+
+# Recompute a range of past months after a reading correction; preview first, then commit.
+def render_backfill():
+    import pandas as pd
+    import backfill
+    with st.expander("🔁 Recompute Past Months (Backfill)"):
+        st.caption(
+            "Re-chains saved readings month by month and recomputes every electricity bill in the range. "
+            "Bills that already have payments keep their amount paid and status."
+        )
+        b1, b2 = st.columns(2)
+        bf_start = b1.date_input("From Bill Date", value=date.today() - timedelta(days=180), key="bf_start")
+        bf_end = b2.date_input("To Bill Date", value=date.today(), key="bf_end")
+        rechain = st.checkbox("Re-chain previous readings from the month before", value=True, key="bf_rechain")
+
+        if st.button("🔍 Preview Changes"):
+            with st.spinner("Recomputing bills..."):
+                st.session_state.backfill_plan = backfill.plan(conn, bf_start, bf_end, rechain_readings=rechain)
+
+        plan = st.session_state.get('backfill_plan')
+        if not plan:
+            return
+        s = plan['summary']
+        p1, p2, p3, p4 = st.columns(4)
+        p1.metric("Months", len(plan['months']))
+        p2.metric("New Bills", s['new'])
+        p3.metric("Changed Bills", s['changed'], help=f"{s['paid_changed']} of them already paid")
+        p4.metric("Readings Re-chained", len(plan['main_meters']) + len(plan['sub_meter_readings']))
+        if s['paid_changed']:
+            st.warning(f"⚠️ {s['paid_changed']} paid bill(s) change total; their payment status is kept as is.")
+
+        changes = [d for d in plan['diff'] if d['change'] != "unchanged"]
+        if changes:
             st.dataframe(
-                df_final.style.format({
-                    "Rent Pending (₹)": "₹{:.2f}", 
-                    "Electricity Pending (₹)": "₹{:.2f}", 
-                    "Total Due (₹)": "₹{:.2f}"
-                }).apply(lambda x: ['font-weight: bold' if x.name == len(df_final)-1 else '' for i in x], axis=1), 
-                column_config={
-                    "WhatsApp Link": st.column_config.LinkColumn(
-                        "Send Reminder", 
-                        display_text="📱 WhatsApp"
-                    )
-                },
-                hide_index=True, use_container_width=True
+                pd.DataFrame(changes)[['bill_month', 'customer_name', 'change', 'status', 'old_units', 'new_units', 'old_total', 'new_total']].rename(
+                    columns={
+                        'bill_month': 'Month',
+                        'customer_name': 'Name',
+                        'change': 'Change',
+                        'status': 'Status',
+                        'old_units': 'Units (Old)',
+                        'new_units': 'Units (New)',
+                        'old_total': 'Total (Old)',
+                        'new_total': 'Total (New)'
+                    }
+                ),
+                hide_index=True, width="stretch"
             )
         else:
-            st.info("No tenant data available.")
+            st.success("✅ Every bill in this range already matches its readings.")
+
+        if st.button("✅ Commit Backfill", type="primary", disabled=not (plan['bills'] or plan['main_meters'] or plan['sub_meter_readings'])):
+            try:
+                written = backfill.commit(conn, plan)
+                del st.session_state.backfill_plan
+                notify(f"Backfill saved: {written['bills']} bills, {written['main_meters'] + written['sub_meter_readings']} readings.")
+                st.rerun()
+            except Exception as e:
+                st.error(f"❌ Error: {e}")
+
+# --- TAB 5: RECORDS ---
+RECORD_VIEWS = {
+    "Electricity Bills": ("bills", "id, created_at, customer_name, bill_month, total_amount, amount_paid, status, payment_mode, txn_id", 'total_amount'),
+    "Rent Records": ("rent_records", "id, created_at, bill_month, amount, amount_paid, status, payment_mode, txn_id, profiles(full_name)", 'amount')
+}
+
+def render_records_tab():
+    import pandas as pd
+    st.subheader("Records")
+    r_opt = st.radio("View:", list(RECORD_VIEWS.keys()))
+    table, columns, amount_key = RECORD_VIEWS[r_opt]
+
+    fc1, fc2, fc3, fc4 = st.columns([2, 2, 2, 1])
+    user_opts = tenant_options(load_tenants())
+    sel_tenant = fc1.selectbox("Tenant", ["All"] + list(user_opts.keys()), key="rec_tenant")
+    month_range = fc2.date_input("Bill Month Range", value=[], key="rec_months")
+    statuses = fc3.multiselect("Status", ["Pending", "Partial", "Verifying", "Paid"], key="rec_status")
+    page_size = fc4.selectbox("Rows", [20, 50, 100], key="rec_page_size")
+
+    filters = []
+    if sel_tenant != "All": filters.append(("eq", "user_id", user_opts[sel_tenant]['id']))
+    if len(month_range) >= 1: filters.append(("gte", "bill_month", str(month_range[0])))
+    if len(month_range) == 2: filters.append(("lte", "bill_month", str(month_range[1])))
+    if statuses: filters.append(("in_", "status", statuses))
+
+    # Cursor stack for keyset paging; any change of view or filter starts again at page 1.
+    signature = repr((table, filters, page_size))
+    if st.session_state.get('rec_signature') != signature:
+        st.session_state.rec_signature = signature
+        st.session_state.rec_cursors = [None]
+    cursors = st.session_state.rec_cursors
+
+    rows, next_cursor = db.fetch_page(conn, table, columns, page_size, cursors[-1], filters)
+
+    nc1, nc2, nc3, nc4 = st.columns([1, 1, 1, 4])
+    if nc1.button("⬅️ Prev", disabled=len(cursors) == 1):
+        cursors.pop()
+        st.rerun()
+    if nc2.button("Next ➡️", disabled=next_cursor is None):
+        cursors.append(next_cursor)
+        st.rerun()
+    if nc3.button("Refresh"):
+        conn.cache.clear()
+        st.rerun()
+    nc4.caption(f"Page {len(cursors)}")
+
+    if rows:
+        clean_data = []
+        for r in rows:
+            if table == "rent_records":
+                r['customer_name'] = r['profiles']['full_name'] if r.get('profiles') else 'Unknown'
+            r['txn_id'] = r.get('txn_id') or '-'
+            r['payment_mode'] = r.get('payment_mode') or '-'
+            clean_data.append(r)
+        st.dataframe(pd.DataFrame(clean_data)[['customer_name', 'bill_month', amount_key, 'amount_paid', 'status', 'payment_mode', 'txn_id']])
+    else:
+        st.info("No records match these filters.")
+
+    st.divider()
+    render_statements_zip()
+
+# Every tenant's statement for a month (HTML + PDF), rendered in a process pool into one ZIP.
+def render_statements_zip():
+    import io
+    import statements
+    with st.expander("🧾 Monthly Statements (ZIP)"):
+        month = st.date_input("Any day in the month", value=date.today(), key="stmt_zip_month")
+        if st.button("📦 Build Statements ZIP", key="stmt_zip_build"):
+            try:
+                rows = statements.month_statements(conn, month)
+                if not rows:
+                    st.warning("No bills or rent records in that month.")
+                else:
+                    bar = st.progress(0.0, text="Rendering statements...")
+                    buf = io.BytesIO()
+                    files = statements.write_zip(rows, buf, progress=lambda done: bar.progress(
+                        done / len(rows), text=f"Rendered {done} / {len(rows)} statements"))
+                    st.session_state.statements_zip = (f"statements-{str(month)[:7]}.zip", buf.getvalue(), len(rows), files)
+            except Exception as e:
+                st.error(f"❌ Error: {e}")
+        if 'statements_zip' in st.session_state:
+            name, data, count, files = st.session_state.statements_zip
+            st.download_button(f"⬇️ Download {name} ({count} tenants, {files} files)", data, file_name=name,
+                               mime="application/zip", key="stmt_zip_download")
+
+# --- TAB 6: OUTSTANDING SUMMARY ---
+def render_outstanding_tab():
+    import pandas as pd
+    st.subheader("📉 Consolidated Outstanding Summary")
+    
+    all_tenants, all_balances, all_pending_elec = db.fetch_all(
+        conn.table("profiles").select("*").eq("role", "tenant"),
+        ledger.balances_query(conn),
+        conn.table("bills").select("user_id, bill_month, total_amount, amount_paid").neq("status", "Paid"),
+    )
+    summary_data = dues.outstanding_summary(all_tenants.data, ledger.index(all_balances.data), all_pending_elec.data)
+    
+    if summary_data:
+        df_summary = pd.DataFrame(summary_data)
+        total_row = pd.DataFrame({
+            "Tenant Name": ["TOTAL"],
+            "Flat Number": ["-"],
+            "Rent Pending (₹)": [df_summary["Rent Pending (₹)"].sum()],
+            "Electricity Pending (₹)": [df_summary["Electricity Pending (₹)"].sum()],
+            "Total Due (₹)": [df_summary["Total Due (₹)"].sum()],
+            "WhatsApp Link": [None]
+        })
+        df_final = pd.concat([df_summary, total_row], ignore_index=True)
+        
+        st.dataframe(
+            df_final.style.format({
+                "Rent Pending (₹)": "₹{:.2f}", 
+                "Electricity Pending (₹)": "₹{:.2f}", 
+                "Total Due (₹)": "₹{:.2f}"
+            }).apply(lambda x: ['font-weight: bold' if x.name == len(df_final)-1 else '' for i in x], axis=1), 
+            column_config={
+                "WhatsApp Link": st.column_config.LinkColumn(
+                    "Send Reminder", 
+                    display_text="📱 WhatsApp"
+                )
+            },
+            hide_index=True, width="stretch"
+        )
+    else:
+        st.info("No tenant data available.")
+
+    st.divider()
+    st.caption("Balances are kept per tenant as payments are recorded. Reconcile checks them against every unpaid bill and rent record.")
+    if st.button("🔄 Reconcile Balances"):
+        mismatches = ledger.reconcile(conn, fix=True)
+        if mismatches:
+            notify(f"Fixed {len(mismatches)} balance(s) that had drifted.", icon="🔄")
+        else:
+            notify("All balances match the bills and rent records.")
+        st.rerun()
+
+# --- TAB 7: CONSUMPTION ANALYTICS ---
+def render_analytics_tab():
+    import analytics
+    st.subheader("📈 Consumption Analytics")
+    rollups = analytics.rollups_query(conn).execute().data
+
+    if not rollups:
+        st.info("No monthly rollups yet. Save meter readings, or rebuild them from the full history below.")
+    else:
+        meter_units = analytics.meter_units(rollups)
+        flat_units = analytics.flat_units(rollups)
+
+        st.markdown("### 🏢 Main Meters")
+        m1, m2 = st.columns(2)
+        m1.caption("Units per month")
+        m1.line_chart(meter_units)
+        m2.caption("Realised rate (₹/Unit)")
+        m2.line_chart(analytics.meter_rates(rollups))
+        st.dataframe(
+            analytics.latest_changes(meter_units).rename(columns={
+                'name': 'Meter', 'month': 'Month', 'units': 'Units', 'change': 'Change vs Prev', 'change_pct': 'Change %'
+            }),
+            hide_index=True, width="stretch"
+        )
+
+        st.markdown("### 💧 Water / Common Share")
+        share = analytics.water_share(rollups)
+        w1, w2 = st.columns(2)
+        w1.caption("Share of main meter units (%)")
+        w1.line_chart(share['water_share_pct'])
+        w2.caption("Water units per month")
+        w2.bar_chart(share['water_units'])
+
+        st.markdown("### 🏠 Flats")
+        flats = list(flat_units.columns)
+        picked = st.multiselect("Flats", flats, default=flats[:5], key="analytics_flats")
+        if picked:
+            f1, f2 = st.columns(2)
+            f1.caption("Units per month")
+            f1.line_chart(flat_units[picked])
+            f2.caption("Month-over-month change")
+            f2.bar_chart(flat_units[picked].diff())
+        st.dataframe(
+            analytics.latest_changes(flat_units).rename(columns={
+                'name': 'Flat', 'month': 'Month', 'units': 'Units', 'change': 'Change vs Prev', 'change_pct': 'Change %'
+            }),
+            hide_index=True, width="stretch"
+        )
+
+    st.divider()
+    if st.button("🔁 Rebuild Rollups from History"):
+        written = analytics.rebuild(conn)
+        notify(f"Rebuilt {written} monthly rollups.")
+        st.rerun()
 
 # --- 5. TENANT DASHBOARD ---
 def tenant_dashboard(user_details):
     render_top_nav(user_details)
     
-    elec_res = conn.table("bills").select("*").eq("user_id", user_details['id']).neq("status", "Paid").execute()
-    rent_res = conn.table("rent_records").select("*").eq("user_id", user_details['id']).neq("status", "Paid").execute()
+    elec_res, rent_res, bal_res = db.fetch_all(
+        conn.table("bills").select("*").eq("user_id", user_details['id']).neq("status", "Paid"),
+        conn.table("rent_records").select("*").eq("user_id", user_details['id']).neq("status", "Paid"),
+        ledger.balances_query(conn, user_details['id']),
+    )
     
-    elec_due = sum([(b['total_amount'] - (b.get('amount_paid', 0) or 0)) for b in elec_res.data])
-    rent_due = sum([(r['amount'] - (r.get('amount_paid', 0) or 0)) for r in rent_res.data])
-    total_due = elec_due + rent_due
+    total_due = ledger.owed(ledger.index(bal_res.data), user_details['id'])
     
     if total_due > 0:
         st.error(f"⚠️ Total Outstanding Due: ₹{total_due}")
         with st.expander("💳 PAY DUES (UPI)", expanded=True):
-            upi_id = "s.vihar@upi"
-            upi_url = f"upi://pay?pa={upi_id}&pn=S_Vihar_Society&am={total_due}&cu=INR"
-            qr_api = f"https://api.qrserver.com/v1/create-qr-code/?size=250x250&data={upi_url}"
             c1, c2 = st.columns([1, 2])
-            c1.image(qr_api, caption=f"Scan to Pay ₹{total_due}")
+            c1.image(dues.upi_qr_png(dues.UPI_PAYEE, total_due), caption=f"Scan to Pay ₹{total_due}", width=250)
             c2.write("1. Scan QR\n2. Pay Amount\n3. Click 'I have Paid' below")
             
             if c2.button("✅ I have Paid (Cash/Online)"):
-                for b in elec_res.data:
-                    conn.table("bills").update({"status": "Verifying"}).eq("id", b['id']).execute()
-                for r in rent_res.data:
-                    conn.table("rent_records").update({"status": "Verifying"}).eq("id", r['id']).execute()
-                st.success("Sent for verification!")
-                time.sleep(1)
+                claimed = dues.claim_payment(conn, user_details['id'], [b['id'] for b in elec_res.data], [r['id'] for r in rent_res.data])
+                notify(f"Sent {len(claimed['bills']) + len(claimed['rent_records'])} dues for verification!")
                 st.rerun()
     else:
         st.success("🎉 No Pending Dues!")
@@ -776,22 +989,96 @@ def tenant_dashboard(user_details):
                 st.write(f"**{r['bill_month']}**: Remaining ₹{rem} (Paid: ₹{paid}) - {r['status']}")
         else: st.info("No rent dues.")
 
+    st.divider()
+    render_tenant_statement(user_details)
+
+def render_tenant_statement(user_details):
+    st.subheader("🧾 Monthly Statement")
+    c1, c2 = st.columns([1, 2])
+    month = c1.date_input("Any day in the month", value=date.today(), key="stmt_month")
+    if c1.button("📄 Prepare Statement"):
+        import statements
+        rows = statements.month_statements(conn, month, user_ids=[user_details['id']])
+        st.session_state.statement = rows[0] if rows else str(month)[:7]
+    statement = st.session_state.get('statement')
+    if isinstance(statement, str):
+        c2.info(f"No bill or rent record for {statement}.")
+    elif statement:
+        import statements
+        c2.markdown("\n".join(f"- **{label}**{': ' + detail if detail else ''} — {amount}"
+                               for label, detail, amount in statements.lines(statement)))
+        d1, d2 = c2.columns(2)
+        d1.download_button("⬇️ HTML", statements.render_html(statement), file_name=statements.file_name(statement, "html"),
+                           mime="text/html", width="stretch")
+        d2.download_button("⬇️ PDF", statements.render_pdf(statement), file_name=statements.file_name(statement, "pdf"),
+                           mime="application/pdf", width="stretch")
+
+# --- DEBUG PANEL (ADMIN ONLY) ---
+def render_debug_panel():
+    import pandas as pd
+    metrics = session_metrics()
+    with st.sidebar.expander("🛠️ Debug: Queries & Reruns"):
+        totals = metrics.totals()
+        d1, d2, d3 = st.columns(3)
+        d1.metric("DB Queries", totals['queries'])
+        d2.metric("Cache Hits", totals['cache_hits'])
+        d3.metric("DB Time", f"{totals['db_seconds'] * 1000:.0f} ms")
+
+        st.caption("This rerun, by section")
+        st.dataframe(pd.DataFrame(metrics.by_section()), hide_index=True, width="stretch")
+        st.caption("This rerun, query by query")
+        queries = metrics.current['queries']
+        if queries:
+            st.dataframe(pd.DataFrame(queries)[['section', 'caller', 'table', 'action', 'rows', 'cached', 'seconds', 'query']], hide_index=True, width="stretch")
+
+        st.caption("Recent reruns")
+        history = [dict(rerun=r['rerun'], seconds=r.get('seconds'), **metrics.totals(r)) for r in metrics.reruns]
+        st.dataframe(pd.DataFrame(history), hide_index=True, width="stretch")
+
+        st.download_button("⬇️ Export Metrics (JSONL)", metrics.to_jsonl(), file_name="query_metrics.jsonl", mime="application/jsonl")
+        if st.button("⏱️ Profile Next Rerun"):
+            st.session_state.profile_next_rerun = True
+            st.rerun()
+        if 'rerun_profile' in st.session_state:
+            prof_bytes, summary = st.session_state.rerun_profile
+            st.download_button("⬇️ Download cProfile (.prof)", prof_bytes, file_name="rerun.prof")
+            st.code(summary)
+
 # --- 6. MAIN ---
 def main():
-    if 'user' not in st.session_state:
-        c1, c2, c3 = st.columns([1, 2, 1]) 
-        with c2:
-            tab1, tab2 = st.tabs(["Login", "Register"])
-            with tab1: login()
-            with tab2: register()
-    else:
-        user = st.session_state.user
-        profile = ensure_profile_exists(user.id, user.email)
-        if profile:
-            if profile.get('role') == 'admin':
-                admin_dashboard(profile)
-            else:
-                tenant_dashboard(profile)
+    metrics = session_metrics()
+    metrics.start_rerun()
+    show_toasts()
+    profiler = None
+    if st.session_state.pop('profile_next_rerun', False):
+        profiler = instrumentation.RerunProfiler()
+        profiler.start()
+
+    try:
+        if 'user' not in st.session_state:
+            c1, c2, c3 = st.columns([1, 2, 1]) 
+            with c2:
+                tab1, tab2 = st.tabs(["Login", "Register"])
+                with tab1: login()
+                with tab2: register()
+        else:
+            user = st.session_state.user
+            try:
+                profile = current_profile(user)
+            except Exception as e:
+                st.error(f"🚨 DATABASE ERROR (Loading Profile): {e}")
+                profile = None
+            if profile:
+                if profile.get('role') == 'admin':
+                    admin_dashboard(profile)
+                    render_debug_panel()
+                else:
+                    with instrumentation.section("Tenant Dashboard"):
+                        tenant_dashboard(profile)
+    finally:
+        metrics.finish_rerun()
+        if profiler:
+            st.session_state.rerun_profile = profiler.stop()
 
 if __name__ == "__main__":
     main()
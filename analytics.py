@@ -0,0 +1,142 @@
+"""Consumption analytics over monthly rollups.
+
+The ``consumption_rollups`` table has one row per calendar month and main
+meter or flat. ``kind`` is ``"meter"`` or ``"flat"``. Each row holds that
+month's ``units``, ``amount`` (₹ billed, meters only) and ``water_units``
+(common usage, meters only), and ``(kind, name, month)`` is unique. Saving
+a month's readings calls ``update_month``, which rebuilds only that month's
+rows, so the analytics views read the small rollup table instead of
+rescanning reading history. ``rebuild`` backfills every month.
+``migrations/consumption_rollups.sql`` creates the table on Supabase.
+"""
+import pandas as pd
+
+import db
+
+TABLE = "consumption_rollups"
+ROLLUP_KEY = "kind, name, month"
+
+
+def month_start(value):
+    """``YYYY-MM-01`` of the calendar month containing a bill date."""
+    return str(value)[:7] + "-01"
+
+
+def next_month_start(value):
+    year, month = int(str(value)[:4]), int(str(value)[5:7])
+    return f"{year + month // 12:04d}-{month % 12 + 1:02d}-01"
+
+
+def rollup_rows(main_rows, sub_rows):
+    """Rollup rows for every month present in raw ``main_meters`` / ``sub_meter_readings`` rows."""
+    frames = []
+    mm = pd.DataFrame(main_rows or [], columns=["meter_name", "bill_month", "units_consumed", "total_bill_amount", "water_units"])
+    if not mm.empty:
+        mm = mm.assign(month=mm["bill_month"].astype(str).str[:7] + "-01")
+        agg = mm.fillna({"units_consumed": 0, "total_bill_amount": 0, "water_units": 0}) \
+            .groupby(["meter_name", "month"], as_index=False) \
+            .agg(units=("units_consumed", "sum"), amount=("total_bill_amount", "sum"), water_units=("water_units", "sum"))
+        frames.append(agg.rename(columns={"meter_name": "name"}).assign(kind="meter"))
+    subs = pd.DataFrame(sub_rows or [], columns=["flat_number", "bill_month", "units_consumed"])
+    if not subs.empty:
+        subs = subs.assign(month=subs["bill_month"].astype(str).str[:7] + "-01")
+        agg = subs.fillna({"units_consumed": 0}).groupby(["flat_number", "month"], as_index=False) \
+            .agg(units=("units_consumed", "sum"))
+        frames.append(agg.rename(columns={"flat_number": "name"}).assign(kind="flat", amount=0.0, water_units=0.0))
+    if not frames:
+        return []
+
+    out = pd.concat(frames, ignore_index=True)[["kind", "name", "month", "units", "amount", "water_units"]]
+    out["name"] = out["name"].astype(str)
+    out["units"] = pd.to_numeric(out["units"], downcast="integer")
+    out["amount"] = out["amount"].astype(float).round(2)
+    out["water_units"] = out["water_units"].astype(float)
+    return out.to_dict("records")
+
+
+def update_month(conn, bill_month):
+    """Rebuild the rollup rows of the calendar month containing ``bill_month``.
+
+    Reads only that month's readings and its existing rollup rows. It upserts
+    the new rows and deletes rollups for meters or flats that no longer have
+    readings that month. Returns the rows written.
+    """
+    first, after = month_start(bill_month), next_month_start(bill_month)
+    mm, subs, existing = db.fetch_all(
+        conn.table("main_meters").select("meter_name, bill_month, units_consumed, total_bill_amount, water_units")
+            .gte("bill_month", first).lt("bill_month", after),
+        conn.table("sub_meter_readings").select("flat_number, bill_month, units_consumed")
+            .gte("bill_month", first).lt("bill_month", after),
+        conn.table(TABLE).select("id, kind, name").eq("month", first),
+    )
+    rows = rollup_rows(mm.data, subs.data)
+    if rows:
+        db.bulk_upsert(conn, TABLE, rows, ROLLUP_KEY)
+    kept = {(r["kind"], r["name"]) for r in rows}
+    stale = [r["id"] for r in existing.data or [] if (r["kind"], r["name"]) not in kept]
+    if stale:
+        conn.table(TABLE).delete().in_("id", stale).execute()
+    return rows
+
+
+def rebuild(conn):
+    """Recompute every month's rollups from the full history (backfill). Returns the row count."""
+    mm, subs = db.fetch_all(
+        db.all_pages(lambda: conn.table("main_meters").select("id, meter_name, bill_month, units_consumed, total_bill_amount, water_units")),
+        db.all_pages(lambda: conn.table("sub_meter_readings").select("id, flat_number, bill_month, units_consumed")),
+    )
+    return db.bulk_upsert(conn, TABLE, rollup_rows(mm.data, subs.data), ROLLUP_KEY)
+
+
+def rollups_query(conn):
+    """Every rollup row, paged past the server's row limit (the pivots sort by month)."""
+    return db.all_pages(lambda: conn.table(TABLE).select("id, kind, name, month, units, amount, water_units"))
+
+
+def _pivot(rollups, kind, value="units"):
+    frame = pd.DataFrame(rollups or [], columns=["kind", "name", "month", "units", "amount", "water_units"])
+    frame = frame[frame["kind"] == kind]
+    return frame.pivot_table(index="month", columns="name", values=value, aggfunc="sum").sort_index()
+
+
+def flat_units(rollups):
+    """Units per flat (columns) per month (index)."""
+    return _pivot(rollups, "flat")
+
+
+def meter_units(rollups):
+    """Units per main meter (columns) per month (index)."""
+    return _pivot(rollups, "meter")
+
+
+def meter_rates(rollups):
+    """Realised ₹/unit per main meter and month: amount billed over units consumed."""
+    units = _pivot(rollups, "meter")
+    amount = _pivot(rollups, "meter", "amount")
+    return (amount / units.where(units > 0)).round(4)
+
+
+def water_share(rollups):
+    """Per month: common/water units, total main meter units and the water share in %."""
+    units = _pivot(rollups, "meter").sum(axis=1)
+    water = _pivot(rollups, "meter", "water_units").sum(axis=1)
+    return pd.DataFrame({
+        "water_units": water,
+        "total_units": units,
+        "water_share_pct": (100 * water / units.where(units > 0)).round(2),
+    })
+
+
+def latest_changes(pivot):
+    """Last month's value per column with the month-over-month change (units and %)."""
+    if pivot.empty:
+        return pd.DataFrame(columns=["name", "month", "units", "change", "change_pct"])
+    previous = pivot.shift(1).iloc[-1]
+    latest = pivot.iloc[-1]
+    return pd.DataFrame({
+        "name": pivot.columns.astype(str),
+        "month": pivot.index[-1],
+        "units": latest.values,
+        "change": (latest - previous).values,
+        "change_pct": (100 * (latest - previous) / previous.where(previous > 0)).round(1).values,
+    }).sort_values("units", ascending=False, ignore_index=True)
@@ -0,0 +1,275 @@
+"""Recompute electricity bills over a range of past months.
+
+A corrected reading affects every later month: the next month's previous
+reading, the units of metered flats and the residual of derived flats.
+``plan`` first re-chains the saved readings month by month. That pass is
+cheap and has to be sequential. It then computes each month's bills, in a
+process pool when the range is large enough to pay for one (months are
+independent once their readings are fixed), and diffs the result against
+the stored ``bills``. ``commit`` writes the
+changed readings and bills. Existing bills keep ``amount_paid``, ``status``
+and their payment details.
+
+    python backfill.py --start 2026-01-01 --end 2026-06-30           # preview
+    python backfill.py --start 2026-01-01 --end 2026-06-30 --commit
+"""
+import argparse
+import multiprocessing
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date
+
+import analytics
+import billing
+import db
+import ledger
+import meters
+
+PAYMENT_FIELDS = ["amount_paid", "status", "payment_mode", "payment_date", "txn_id"]
+COMPARED_FIELDS = ["previous_reading", "current_reading", "units_consumed", "total_amount"]
+MAIN_FIELDS = ["previous_reading", "units_consumed", "calculated_rate", "water_units", "water_cost"]
+SUB_FIELDS = ["previous_reading", "current_reading", "units_consumed"]
+TOLERANCE = 0.005
+# A bill computes in well under a millisecond while a spawned worker takes
+# a second or more to import pandas; below this many bills per process the
+# pool costs more than it saves.
+BILLS_PER_WORKER = 20000
+
+
+def _group(rows, key="bill_month"):
+    out = {}
+    for row in rows or []:
+        out.setdefault(str(row[key])[:10], []).append(row)
+    return out
+
+
+def _differs(old, new, fields):
+    for field in fields:
+        a, b = old.get(field), new.get(field)
+        if isinstance(a, (int, float)) and isinstance(b, (int, float)):
+            if abs(a - b) > TOLERANCE:
+                return True
+        elif a != b:
+            return True
+    return False
+
+
+def _strip(row):
+    return {k: v for k, v in row.items() if k not in ("id", "created_at")}
+
+
+def rechain(topology, months, previous):
+    """Re-derive each month's readings from the month before, oldest first.
+
+    ``months`` is ``[(bill_month, main_rows, sub_rows)]`` and ``previous``
+    maps reading key -> last reading before the range. Saved current readings
+    are kept. Previous readings come from the month before, and units, rates,
+    derived flats and water usage are recomputed as the Meters tab does.
+    Readings outside the topology pass through unchanged. Returns the months
+    with their corrected rows.
+    """
+    last = dict(previous)
+    out = []
+    for bill_month, mains, subs in months:
+        by_key = {s['flat_number']: s for s in subs}
+        new_mains, new_subs, handled = [], [], set()
+        for m in mains:
+            main = m['meter_name']
+            if main not in topology["mains"]:
+                new_mains.append(m)
+                continue
+            prev = last.get(main, m.get('previous_reading') or 0)
+            units = (m.get('current_reading') or 0) - prev
+            rate = (m.get('total_bill_amount') or 0) / units if units > 0 else 0.0
+
+            metered, saved = {}, set()
+            for name in meters.meters_under(topology, main):
+                node = topology["meters"][name]
+                key = meters.reading_key(topology, name)
+                if node["type"] == "metered":
+                    row = by_key.get(key)
+                    if row is not None:
+                        metered[name] = (last.get(key, row.get('previous_reading') or 0), row.get('current_reading') or 0)
+                        saved.add(key)
+                    else:
+                        metered[name] = (last.get(key) or 0, last.get(key) or 0)
+                elif node.get("flat"):
+                    saved.add(key)
+            readings, water = meters.compute_readings(topology, {main: units}, metered, last)
+
+            new_mains.append(dict(m, previous_reading=prev, units_consumed=units, calculated_rate=rate,
+                                  water_units=water[main], water_cost=water[main] * rate))
+            for item in readings:
+                if item['flat'] in saved:
+                    base = by_key.get(item['flat'], {"flat_number": item['flat'], "bill_month": bill_month})
+                    new_subs.append(dict(base, previous_reading=item['prev'], current_reading=item['curr'],
+                                         units_consumed=item['units']))
+                    handled.add(item['flat'])
+        new_subs += [s for s in subs if s['flat_number'] not in handled]
+
+        last.update({m['meter_name']: m.get('current_reading') or 0 for m in new_mains})
+        last.update({s['flat_number']: s.get('current_reading') or 0 for s in new_subs})
+        out.append((bill_month, new_mains, new_subs))
+    return out
+
+
+def _month_bills(args):
+    bill_month, mains, subs, tenants, topology = args
+    frame, _ = billing.compute_electricity_bills(mains, subs, tenants, bill_month, topology)
+    return billing.bill_records(frame)
+
+
+def compute_bills(months, tenants, topology, workers=None):
+    """``{bill_month: bill records}`` for every month, computed in a process pool.
+
+    ``workers`` defaults to one process per ``BILLS_PER_WORKER`` bills (one
+    per sub-meter reading), up to the CPU count; with one worker (or one
+    month) everything runs in this process.
+    """
+    jobs = [(bill_month, mains, subs, tenants, topology) for bill_month, mains, subs in months]
+    if workers is None:
+        workers = min(os.cpu_count() or 1, sum(len(subs) for _, _, subs in months) // BILLS_PER_WORKER)
+    workers = min(len(jobs), workers)
+    if workers <= 1:
+        return {job[0]: _month_bills(job) for job in jobs}
+    # spawn, not fork: the app process runs server threads.
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as pool:
+        return dict(zip((job[0] for job in jobs), pool.map(_month_bills, jobs)))
+
+
+def merge_bill(new, old):
+    """The row to save for a recomputed bill, keeping ``old``'s payment state."""
+    row = dict(new, amount_paid=0, payment_mode=None, payment_date=None, txn_id=None)
+    if old is None:
+        return row
+    row.update({field: old.get(field) for field in PAYMENT_FIELDS})
+    paid = old.get('amount_paid') or 0
+    if old.get('status') != "Paid" and paid > 0 and paid >= row['total_amount']:
+        row['status'] = "Paid"
+    return row
+
+
+def plan(conn, start, end, rechain_readings=True, workers=None, topology=None):
+    """Everything a backfill of ``[start, end]`` would change, without writing.
+
+    Returns ``{"months", "diff", "bills", "main_meters", "sub_meter_readings",
+    "summary"}``. ``diff`` has one row per bill (``change`` is ``new``,
+    ``changed``, ``unchanged`` or ``not billed`` for stored bills the
+    recomputation no longer produces, which are left alone). The other lists
+    are the rows ``commit`` will upsert.
+    """
+    topology = topology or meters.load_topology()
+    start, end = str(start), str(end)
+    mm, subs, bills, tenants = db.fetch_all(*(
+        db.all_pages(lambda table=table: conn.table(table).select("*").gte("bill_month", start).lte("bill_month", end))
+        for table in ("main_meters", "sub_meter_readings", "bills")
+    ), db.all_pages(lambda: conn.table("profiles").select("*").eq("role", "tenant")))
+    mm_by_month, subs_by_month = _group(mm.data), _group(subs.data)
+    months = [(m, mm_by_month[m], subs_by_month.get(m, [])) for m in sorted(mm_by_month)]
+
+    changed_mains, changed_subs = [], []
+    if rechain_readings and months:
+        keys = list(dict.fromkeys(meters.reading_key(topology, n) for n in topology["meters"]
+                                  if topology["meters"][n]["type"] != "main"))
+        previous = meters.previous_main_readings(conn, topology["mains"], start)
+        previous.update(meters.previous_sub_readings(conn, keys, start))
+        fixed = rechain(topology, months, previous)
+        for (_, old_mains, old_subs), (_, new_mains, new_subs) in zip(months, fixed):
+            old_main = {m['meter_name']: m for m in old_mains}
+            old_sub = {s['flat_number']: s for s in old_subs}
+            changed_mains += [_strip(m) for m in new_mains if _differs(old_main[m['meter_name']], m, MAIN_FIELDS)]
+            changed_subs += [_strip(s) for s in new_subs
+                             if s['flat_number'] not in old_sub or _differs(old_sub[s['flat_number']], s, SUB_FIELDS)]
+        months = fixed
+
+    computed = compute_bills(months, tenants.data, topology, workers)
+    stored = {(b['user_id'], str(b['bill_month'])[:10]): b for b in bills.data or []}
+
+    diff, to_save = [], []
+    for bill_month, records in computed.items():
+        for new in records:
+            old = stored.pop((new['user_id'], bill_month), None)
+            change = "new" if old is None else "changed" if _differs(old, new, COMPARED_FIELDS) else "unchanged"
+            diff.append({
+                "bill_month": bill_month, "customer_name": new['customer_name'], "user_id": new['user_id'],
+                "change": change, "status": old.get('status') if old else "Pending",
+                "old_units": old.get('units_consumed') if old else None, "new_units": new['units_consumed'],
+                "old_total": old.get('total_amount') if old else None, "new_total": new['total_amount'],
+            })
+            if change != "unchanged":
+                to_save.append(merge_bill(new, old))
+    for (user_id, bill_month), old in stored.items():
+        if bill_month in computed:
+            diff.append({
+                "bill_month": bill_month, "customer_name": old.get('customer_name'), "user_id": user_id,
+                "change": "not billed", "status": old.get('status'),
+                "old_units": old.get('units_consumed'), "new_units": None,
+                "old_total": old.get('total_amount'), "new_total": None,
+            })
+
+    summary = {c: sum(d['change'] == c for d in diff) for c in ("new", "changed", "unchanged", "not billed")}
+    summary["paid_changed"] = sum(d['change'] == "changed" and d['status'] == "Paid" for d in diff)
+    return {
+        "months": list(computed),
+        "diff": sorted(diff, key=lambda d: (d['bill_month'], str(d['customer_name']))),
+        "bills": to_save,
+        "main_meters": changed_mains,
+        "sub_meter_readings": changed_subs,
+        "summary": summary,
+    }
+
+
+def commit(conn, plan, progress=None):
+    """Write a ``plan``: corrected readings, then bills; refresh balances and rollups.
+
+    Returns ``{table: rows written}``. If the write fails partway, balances
+    are refreshed for the bills already saved and ``db.PartialWriteError`` is
+    raised; committing the same plan again finishes it.
+    """
+    try:
+        written = db.write_all(conn, [
+            ("main_meters", plan["main_meters"], "meter_name, bill_month"),
+            ("sub_meter_readings", plan["sub_meter_readings"], "flat_number, bill_month"),
+            ("bills", plan["bills"], "user_id, bill_month"),
+        ], progress=progress)
+    except db.PartialWriteError as e:
+        ledger.refresh(conn, [b['user_id'] for b in plan["bills"][:e.written.get("bills", 0)]])
+        raise
+    ledger.refresh(conn, [b['user_id'] for b in plan["bills"]])
+    for month in sorted({analytics.month_start(r['bill_month']) for r in plan["main_meters"] + plan["sub_meter_readings"]}):
+        analytics.update_month(conn, month)
+    return written
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Recompute electricity bills over a range of months.")
+    parser.add_argument("--start", required=True, type=date.fromisoformat, help="first bill date (YYYY-MM-DD)")
+    parser.add_argument("--end", required=True, type=date.fromisoformat, help="last bill date (YYYY-MM-DD)")
+    parser.add_argument("--commit", action="store_true", help="write the changes (default: preview only)")
+    parser.add_argument("--workers", type=int, default=None, help="processes for the bill computation")
+    parser.add_argument("--no-rechain", action="store_true", help="bill from the saved readings as they are")
+    args = parser.parse_args(argv)
+
+    conn = db.connect()
+    result = plan(conn, args.start, args.end, rechain_readings=not args.no_rechain, workers=args.workers)
+    for d in result["diff"]:
+        if d["change"] != "unchanged":
+            print(f"{d['bill_month']} {str(d['customer_name']):<24} {d['change']:<10} {d['status']:<9} "
+                  f"units {d['old_units']} -> {d['new_units']}  total {d['old_total']} -> {d['new_total']}")
+    s = result["summary"]
+    print(f"{len(result['months'])} month(s): {s['new']} new, {s['changed']} changed ({s['paid_changed']} already paid), "
+          f"{s['unchanged']} unchanged, {s['not billed']} not billed; "
+          f"{len(result['main_meters'])} main and {len(result['sub_meter_readings'])} sub-meter readings re-chained.")
+    if args.commit:
+        try:
+            written = commit(conn, result)
+        except db.PartialWriteError as e:
+            print(f"error: {e}", file=sys.stderr)
+            return 1
+        print("Written: " + ", ".join(f"{n} {t}" for t, n in written.items()))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,125 @@
+"""Benchmark every dashboard view against synthetic buildings.
+
+Runs each admin tab and the tenant dashboard headlessly through Streamlit's
+AppTest on the SQLite backend, plus the extracted billing/dues logic, and
+reports wall time, database queries and peak traced memory per view.
+
+    python benchmarks/bench_dashboards.py --scales 10,100,1000 --months 12
+"""
+import argparse
+import gc
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+import warnings
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import billing  # noqa: E402
+import db  # noqa: E402
+import dues  # noqa: E402
+import ledger  # noqa: E402
+import synthetic  # noqa: E402
+
+APP = os.path.join(ROOT, "EB.py")
+ADMIN_TABS = [
+    "💰 Dues & Payments",
+    "👥 Tenants & Flats",
+    "🏢 Meters",
+    "⚡ Generate Monthly",
+    "📊 Records",
+    "📉 Outstanding Summary",
+    "📈 Consumption",
+]
+
+
+def measure(fn):
+    """``(result, seconds, peak_bytes)`` for one call of ``fn``."""
+    gc.collect()
+    tracemalloc.start()
+    start = time.perf_counter()
+    try:
+        result = fn()
+    finally:
+        elapsed = time.perf_counter() - start
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    return result, elapsed, peak
+
+
+def run_view(conn, user, tab=None, reruns=1):
+    """Cold run plus ``reruns`` warm reruns of one view; one result row each."""
+    from streamlit.testing.v1 import AppTest
+
+    at = AppTest.from_file(APP, default_timeout=600)
+    at.session_state["user"] = user
+    if tab:
+        at.session_state["admin_tab"] = tab
+    rows = []
+    for i in range(1 + reruns):
+        before = conn.query_count
+        _, elapsed, peak = measure(at.run)
+        if at.exception:
+            raise RuntimeError(f"{tab or 'tenant'}: {at.exception[0].value}")
+        rows.append({"run": "cold" if i == 0 else "warm", "seconds": elapsed,
+                     "queries": conn.query_count - before, "peak_kb": peak / 1024})
+    return rows
+
+
+def run_logic(conn, month):
+    """Time the extracted computations on data already fetched from ``conn``."""
+    tenants = conn.table("profiles").select("*").eq("role", "tenant").execute().data
+    mm = conn.table("main_meters").select("*").eq("bill_month", month).execute().data
+    subs = conn.table("sub_meter_readings").select("*").eq("bill_month", month).execute().data
+    pending_elec = conn.table("bills").select("*").neq("status", "Paid").execute().data
+    balances = ledger.index(conn.table("balances").select("*").execute().data)
+
+    results = {}
+    _, elapsed, peak = measure(lambda: billing.compute_electricity_bills(mm, subs, tenants, month))
+    results["logic: compute_electricity_bills"] = {"run": "-", "seconds": elapsed, "queries": 0, "peak_kb": peak / 1024}
+    _, elapsed, peak = measure(lambda: dues.outstanding_summary(tenants, balances, pending_elec))
+    results["logic: outstanding_summary"] = {"run": "-", "seconds": elapsed, "queries": 0, "peak_kb": peak / 1024}
+    return results
+
+
+def bench_scale(tenants, months, reruns, seed):
+    with tempfile.TemporaryDirectory() as tmp:
+        os.environ["EB_BACKEND"] = "sqlite"
+        os.environ["EB_SQLITE_PATH"] = os.path.join(tmp, "bench.db")
+        conn = db.connect()
+        users = synthetic.populate(conn, tenants, months, seed=seed)
+        month = str(users["months"][-1])
+
+        results = []
+        for tab in ADMIN_TABS:
+            for row in run_view(conn, users["admin"], tab, reruns):
+                results.append((f"admin: {tab}", row))
+        for row in run_view(conn, users["tenant"], None, reruns):
+            results.append(("tenant dashboard", row))
+        for name, row in run_logic(conn, month).items():
+            results.append((name, row))
+
+        db.close(os.environ["EB_SQLITE_PATH"])
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scales", default="10,100,1000", help="comma-separated tenant counts")
+    parser.add_argument("--months", type=int, default=12, help="months of history per scale")
+    parser.add_argument("--reruns", type=int, default=1, help="warm reruns measured after the cold run")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    warnings.filterwarnings("ignore")
+    print(f"{'tenants':>8} {'view':<42} {'run':<5} {'seconds':>9} {'queries':>8} {'peak KiB':>10}")
+    for scale in [int(s) for s in args.scales.split(",") if s.strip()]:
+        for view, row in bench_scale(scale, args.months, args.reruns, args.seed):
+            print(f"{scale:>8} {view:<42} {row['run']:<5} {row['seconds']:>9.3f} {row['queries']:>8} {row['peak_kb']:>10.0f}")
+
+
+if __name__ == "__main__":
+    main()
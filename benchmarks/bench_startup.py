@@ -0,0 +1,105 @@
+"""Benchmark cold start: time to first paint of a fresh process.
+
+Every sample is a new Python process that renders one page of ``EB.py``
+once through Streamlit's AppTest on the SQLite backend. The wall time from
+spawning the process to the rendered page is the time to first paint. It
+includes interpreter start-up and every import the page triggers. The child
+also reports which heavy modules ended up loaded. ``--eager`` adds a run
+that imports pandas and the modules built on it up front, as ``EB.py`` used
+to at import, for comparison.
+
+    python benchmarks/bench_startup.py --runs 5 --eager
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import warnings
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+APP = os.path.join(ROOT, "EB.py")
+VIEWS = ["login", "tenant", "admin"]
+HEAVY_MODULES = ["pandas", "numpy", "openpyxl", "supabase", "st_supabase_connection"]
+EAGER_IMPORTS = ["pandas", "analytics", "backfill", "billing", "readings_import"]
+
+
+def child(view, user, eager):
+    """Render ``view`` once in this (fresh) process and print a JSON report."""
+    start = time.perf_counter()
+    warnings.filterwarnings("ignore")
+    if eager:
+        for name in EAGER_IMPORTS:
+            __import__(name)
+    from types import SimpleNamespace
+
+    from streamlit.testing.v1 import AppTest
+
+    at = AppTest.from_file(APP, default_timeout=600)
+    if user:
+        at.session_state["user"] = SimpleNamespace(**user)
+    at.run()
+    if at.exception:
+        raise RuntimeError(f"{view}: {at.exception[0].value}")
+    print(json.dumps({
+        "in_process": time.perf_counter() - start,
+        "loaded": [m for m in HEAVY_MODULES if m in sys.modules],
+    }))
+
+
+def sample(view, user, eager):
+    """``(first_paint_seconds, child_report)`` for one fresh process."""
+    cmd = [sys.executable, os.path.abspath(__file__), "--child", view]
+    if user:
+        cmd += ["--user", json.dumps(user)]
+    if eager:
+        cmd.append("--eager")
+    start = time.perf_counter()
+    out = subprocess.run(cmd, check=True, capture_output=True, text=True, cwd=ROOT).stdout
+    elapsed = time.perf_counter() - start
+    return elapsed, json.loads(out.strip().splitlines()[-1])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5, help="fresh processes per view")
+    parser.add_argument("--views", default=",".join(VIEWS), help="comma-separated subset of " + ",".join(VIEWS))
+    parser.add_argument("--tenants", type=int, default=10, help="tenants in the synthetic database")
+    parser.add_argument("--eager", action="store_true", help="also measure with the heavy modules imported up front")
+    parser.add_argument("--child", choices=VIEWS, help=argparse.SUPPRESS)
+    parser.add_argument("--user", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.child:
+        child(args.child, json.loads(args.user) if args.user else None, args.eager)
+        return
+
+    import db
+    import synthetic
+
+    with tempfile.TemporaryDirectory() as tmp:
+        os.environ["EB_BACKEND"] = "sqlite"
+        os.environ["EB_SQLITE_PATH"] = os.path.join(tmp, "bench.db")
+        conn = db.connect()
+        users = synthetic.populate(conn, args.tenants, 3)
+        db.close(os.environ["EB_SQLITE_PATH"])
+        users = {view: {"id": users[view].id, "email": users[view].email} for view in ("admin", "tenant")}
+
+        print(f"{'view':<8} {'imports':<8} {'median s':>9} {'min s':>7} {'in-proc s':>10}  loaded")
+        for view in [v.strip() for v in args.views.split(",") if v.strip()]:
+            for eager in [False, True] if args.eager else [False]:
+                samples = [sample(view, users.get(view), eager) for _ in range(args.runs)]
+                times = [s[0] for s in samples]
+                in_process = statistics.median(s[1]["in_process"] for s in samples)
+                loaded = ", ".join(samples[-1][1]["loaded"]) or "-"
+                print(f"{view:<8} {'eager' if eager else 'lazy':<8} {statistics.median(times):>9.3f} "
+                      f"{min(times):>7.3f} {in_process:>10.3f}  {loaded}")
+
+
+if __name__ == "__main__":
+    main()
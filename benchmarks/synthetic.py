@@ -0,0 +1,109 @@
+"""Synthetic buildings for benchmarking: tenants, monthly readings, bills and rent.
+
+Everything is written through the normal connection API, so the same data
+works against the SQLite stand-in (``EB_BACKEND=sqlite``).
+"""
+import os
+import random
+import sys
+from datetime import date, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import analytics  # noqa: E402
+import db  # noqa: E402
+import ledger  # noqa: E402
+import meters  # noqa: E402
+
+ADMIN_EMAIL = "admin@bench.local"
+PASSWORD = "bench"
+
+
+def month_dates(months, end=None):
+    """``months`` bill dates, oldest first, the last one being ``end`` (today)."""
+    end = end or date.today()
+    return [end - timedelta(days=30 * k) for k in reversed(range(months))]
+
+
+def populate(conn, tenants, months, seed=0, end=None):
+    """Fill ``conn`` with one admin and ``tenants`` tenants over ``months`` months.
+
+    Flats cycle through the configured topology, one building per round
+    (``B2-101``, ...); flats outside the first building bill at the default
+    meter rate. Older months are mostly paid, recent ones are a mix of
+    Pending/Partial/Verifying; balances and consumption rollups are built
+    once at the end. Returns ``{"admin": user, "tenant": user, "months": [...]}``.
+    """
+    rng = random.Random(seed)
+    topology = meters.load_topology()
+    flats = meters.all_flats(topology)
+    dates = month_dates(months, end)
+
+    admin = conn.auth.sign_up({"email": ADMIN_EMAIL, "password": PASSWORD}).user
+    conn.table("profiles").insert({"id": admin.id, "email": ADMIN_EMAIL, "full_name": "Admin", "role": "admin"}).execute()
+
+    profiles = []
+    for i in range(tenants):
+        building, flat = divmod(i, len(flats))
+        flat_number = flats[flat] if building == 0 else f"B{building + 1}-{flats[flat]}"
+        profiles.append({
+            "id": f"tenant-{i:06d}", "email": f"tenant{i}@bench.local", "full_name": f"Tenant {i}",
+            "role": "tenant", "flat_number": flat_number, "num_people": rng.randint(1, 5),
+            "rent_amount": rng.choice([4000, 5000, 6500, 8000]), "mobile": f"9{rng.randint(0, 999999999):09d}",
+        })
+    db.bulk_upsert(conn, "profiles", profiles, "id")
+    first_tenant = conn.auth.sign_up({"email": "tenant0@bench.local", "password": PASSWORD}).user
+    if profiles:
+        conn.table("profiles").update({"id": first_tenant.id}).eq("id", profiles[0]["id"]).execute()
+        profiles[0]["id"] = first_tenant.id
+
+    readings = {p["flat_number"]: rng.randint(0, 5000) for p in profiles}
+    main_prev = {m: rng.randint(10000, 50000) for m in topology["mains"]}
+    for k, bill_date in enumerate(dates):
+        month = str(bill_date)
+        recent = k >= len(dates) - 3
+
+        subs = []
+        for flat, prev in readings.items():
+            units = rng.randint(0, 400) if rng.random() > 0.05 else 0
+            readings[flat] = prev + units
+            subs.append({"flat_number": flat, "bill_month": month, "previous_reading": prev,
+                         "current_reading": prev + units, "units_consumed": units})
+        mains = []
+        for name in topology["mains"]:
+            units = rng.randint(500, 3000) + len(profiles) * 50
+            bill_amount = round(units * rng.uniform(7, 11), 2)
+            mains.append({"meter_name": name, "bill_month": month, "previous_reading": main_prev[name],
+                          "current_reading": main_prev[name] + units, "units_consumed": units,
+                          "total_bill_amount": bill_amount, "calculated_rate": bill_amount / units,
+                          "water_units": rng.randint(20, 200) if name == topology["water_meter"] else 0,
+                          "water_cost": 0})
+            main_prev[name] += units
+        db.bulk_upsert(conn, "main_meters", mains, "meter_name, bill_month")
+        db.bulk_upsert(conn, "sub_meter_readings", subs, "flat_number, bill_month")
+
+        bills, rent = [], []
+        for p, sub in zip(profiles, subs):
+            total = rng.randint(200, 4000)
+            bills.append(dict({"user_id": p["id"], "customer_name": p["full_name"], "bill_month": month,
+                               "previous_reading": sub["previous_reading"], "current_reading": sub["current_reading"],
+                               "units_consumed": sub["units_consumed"], "total_amount": total}, **_payment(rng, total, recent)))
+            rent.append(dict({"user_id": p["id"], "bill_month": month, "amount": p["rent_amount"]},
+                             **_payment(rng, p["rent_amount"], recent)))
+        db.bulk_upsert(conn, "bills", bills, "user_id, bill_month")
+        db.bulk_upsert(conn, "rent_records", rent, "user_id, bill_month")
+
+    ledger.reconcile(conn, fix=True)
+    analytics.rebuild(conn)
+    return {"admin": admin, "tenant": first_tenant, "months": dates}
+
+
+def _payment(rng, total, recent):
+    roll = rng.random()
+    if not recent and roll < 0.85:
+        return {"status": "Paid", "amount_paid": total, "payment_mode": "Cash"}
+    if roll < 0.5:
+        return {"status": "Pending", "amount_paid": 0}
+    if roll < 0.8:
+        return {"status": "Partial", "amount_paid": rng.randint(1, total - 1), "payment_mode": "Online (UPI/Bank)"}
+    return {"status": "Verifying", "amount_paid": 0}
@@ -0,0 +1,128 @@
+"""Billing engine for the monthly electricity and rent run.
+
+Pure, UI-free computations over columnar data. ``EB.py`` feeds in the rows
+returned by Supabase and only renders the resulting frames.
+"""
+import numpy as np
+import pandas as pd
+
+import meters
+
+BILL_COLUMNS = [
+    "user_id", "customer_name", "bill_month", "previous_reading", "current_reading",
+    "units_consumed", "tenant_water_units", "rate_per_unit", "water_charge",
+    "total_amount", "status",
+]
+
+
+def _frame(rows, columns):
+    df = pd.DataFrame(list(rows or []))
+    for col in columns:
+        if col not in df.columns:
+            df[col] = np.nan
+    return df
+
+
+def _filled(series):
+    """Fill gaps with 0, keeping integer columns integral for the JSON payload."""
+    return pd.to_numeric(series.fillna(0), downcast="integer")
+
+
+def meter_rates(main_meters):
+    """``{meter_name: calculated_rate}`` for one month of ``main_meters`` rows."""
+    mm = _frame(main_meters, ["meter_name", "calculated_rate"])
+    return dict(zip(mm["meter_name"], mm["calculated_rate"].fillna(0).astype(float)))
+
+
+def rates_for_flats(flats, rates, topology=None):
+    """Vectorized rate lookup: flat numbers -> rate of the main meter feeding them.
+
+    Flats missing from the topology pay the default meter's rate.
+    """
+    topology = topology or meters.load_topology()
+    flats = pd.Series(flats)
+    feeding = flats.map(topology["flat_meter"]).fillna(topology["default_meter"])
+    return feeding.map(rates).fillna(0).astype(float)
+
+
+def compute_electricity_bills(main_meters, sub_readings, tenants, bill_month, topology=None):
+    """Compute every tenant's electricity bill for ``bill_month`` in one pass.
+
+    ``main_meters`` and ``sub_readings`` are that month's rows, ``tenants`` the
+    tenant profiles. Returns ``(frame, water)`` where ``frame`` has one row per
+    tenant (``is_active`` marks who gets billed) and ``water`` holds the shared
+    water figures used for the split.
+    """
+    topology = topology or meters.load_topology()
+    water_meter = topology["water_meter"]
+    mm = _frame(main_meters, ["meter_name", "calculated_rate", "water_units"])
+    rates = meter_rates(main_meters)
+    water_row = mm[mm["meter_name"] == water_meter].tail(1)
+    water_units = float(water_row["water_units"].fillna(0).sum())
+    water_rate = float(rates.get(water_meter, 0))
+
+    t = _frame(tenants, ["id", "full_name", "flat_number", "num_people"])
+    subs = _frame(sub_readings, ["flat_number", "previous_reading", "current_reading", "units_consumed"])
+    subs = subs.drop_duplicates("flat_number", keep="last").set_index("flat_number")
+
+    flats = t["flat_number"]
+    units = _filled(flats.map(subs["units_consumed"]))
+    people = _filled(t["num_people"])
+    is_active = units > 0
+
+    active_people = people[is_active].sum()
+    if active_people == 0:
+        active_people = 1
+    units_per_person = water_units / active_people
+
+    rate = rates_for_flats(flats, rates, topology)
+    elec_cost = units * rate
+    water_share = np.where(is_active, units_per_person * people, 0.0)
+    water_cost = water_share * water_rate
+    total = np.ceil(elec_cost + water_cost).astype("int64")
+
+    frame = pd.DataFrame({
+        "user_id": t["id"],
+        "customer_name": t["full_name"],
+        "flat_number": flats,
+        "bill_month": str(bill_month),
+        "previous_reading": _filled(flats.map(subs["previous_reading"])),
+        "current_reading": _filled(flats.map(subs["current_reading"])),
+        "units_consumed": units,
+        "num_people": people,
+        "tenant_water_units": water_share,
+        "rate_per_unit": rate,
+        "elec_cost": elec_cost,
+        "water_charge": water_cost,
+        "total_amount": np.where(is_active, total, 0),
+        "is_active": is_active,
+        "status": "Pending",
+    })
+    water = {"units": water_units, "rate": water_rate, "active_people": int(active_people)}
+    return frame, water
+
+
+def bill_records(frame):
+    """Upsert payloads for the active rows of a ``compute_electricity_bills`` frame."""
+    active = frame[frame["is_active"]]
+    return active[BILL_COLUMNS].to_dict("records")
+
+
+def build_rent_batch(tenants, bill_month):
+    """Rent rows for every tenant with a positive ``rent_amount``."""
+    t = _frame(tenants, ["id", "full_name", "rent_amount"])
+    rent = _filled(t["rent_amount"])
+    billable = t[rent > 0]
+    frame = pd.DataFrame({
+        "user_id": billable["id"],
+        "customer_name": billable["full_name"],
+        "bill_month": str(bill_month),
+        "amount": rent[rent > 0],
+        "status": "Pending",
+    })
+    return frame
+
+
+def rent_records(frame):
+    """Upsert payloads for a ``build_rent_batch`` frame."""
+    return frame[["user_id", "bill_month", "amount", "status"]].to_dict("records")
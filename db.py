@@ -0,0 +1,516 @@
+"""Database helpers shared by the dashboards.
+
+Everything here talks to the connection through the same ``conn.table(...)``
+query builder the app already uses, whichever backend provides it.
+"""
+import contextvars
+import operator
+import os
+import re
+import sys
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, wait
+
+UPSERT_CHUNK_SIZE = 500
+UPSERT_RETRIES = 3
+RETRY_BACKOFF = 0.5
+
+CACHE_TTL = 60
+CACHE_MAX_ENTRIES = 256
+WRITE_METHODS = {"insert", "update", "upsert", "delete"}
+# Query calls a cached result can be patched through after a write; any
+# other call (or_, count, ...) makes the entry refetch instead.
+PATCHABLE_METHODS = {"select", "eq", "neq", "in_", "lt", "lte", "gt", "gte", "order", "limit"}
+
+# Rows per request for reads that must see every row: at or below PostgREST's
+# default max-rows (1000), which silently truncates larger responses.
+READ_PAGE_SIZE = 1000
+
+FETCH_WORKERS = 8
+_fetch_pool = None
+_fetch_pool_lock = threading.Lock()
+# Name of the function that handed a query to fetch_all, for instrumentation
+# (pool threads have no app frames on their stack).
+QUERY_ORIGIN = contextvars.ContextVar("eb_query_origin", default=None)
+
+BACKEND_ENV = "EB_BACKEND"
+SQLITE_PATH_ENV = "EB_SQLITE_PATH"
+DEFAULT_SQLITE_PATH = "eb_local.db"
+_sqlite_connections = {}
+
+
+def connect(backend=None):
+    """Open the configured backend connection.
+
+    ``backend`` (or ``$EB_BACKEND``) is ``"supabase"`` (default) for the
+    hosted database or ``"sqlite"`` for the local stand-in at
+    ``$EB_SQLITE_PATH``. Both expose the same ``table(...)``/``auth`` API.
+    """
+    backend = (backend or os.environ.get(BACKEND_ENV) or "supabase").lower()
+    if backend == "sqlite":
+        import sqlite_backend
+        path = os.environ.get(SQLITE_PATH_ENV) or DEFAULT_SQLITE_PATH
+        if path not in _sqlite_connections:
+            _sqlite_connections[path] = sqlite_backend.SQLiteConnection(path)
+        return _sqlite_connections[path]
+    if backend == "supabase":
+        import streamlit as st
+        from st_supabase_connection import SupabaseConnection
+        return st.connection("supabase", type=SupabaseConnection)
+    raise ValueError(f"Unknown backend '{backend}' (expected 'supabase' or 'sqlite')")
+
+
+class LazyConnection:
+    """A ``connect(backend)`` that is only opened on first use.
+
+    Building the backend client (and importing it) is deferred until a query
+    or ``auth`` call needs it, so pages that never touch the database do not
+    pay for it.
+    """
+
+    def __init__(self, backend=None):
+        self.backend = backend
+        self._conn = None
+
+    def __getattr__(self, name):
+        if self._conn is None:
+            self._conn = connect(self.backend)
+        return getattr(self._conn, name)
+
+
+def close(path=None):
+    """Close the cached SQLite connection for ``path`` (default: all of them)."""
+    for key in [path] if path else list(_sqlite_connections):
+        conn = _sqlite_connections.pop(key, None)
+        if conn is not None:
+            conn.db.close()
+
+
+def chunked(rows, size):
+    """Split ``rows`` into lists of at most ``size`` items."""
+    size = max(1, int(size))
+    return [rows[i:i + size] for i in range(0, len(rows), size)]
+
+
+class PartialWriteError(Exception):
+    """A write that failed after committing some of its rows.
+
+    ``written`` / ``total`` map each table to the rows committed / given;
+    the committed rows are the first ``written[table]`` of those given. Every
+    write here is an idempotent upsert, so re-running the whole write is safe
+    and finishes it. The original error is ``error`` (and ``__cause__``).
+    """
+
+    def __init__(self, written, total, error):
+        self.written, self.total, self.error = written, total, error
+        done = ", ".join(f"{written.get(t, 0)} of {n} {t}" for t, n in total.items() if n)
+        super().__init__(f"Only part of the write was saved ({done}): {error}. "
+                         f"Run it again to finish; rows already saved are simply rewritten.")
+
+
+def bulk_upsert(conn, table, rows, on_conflict, chunk_size=UPSERT_CHUNK_SIZE,
+                retries=UPSERT_RETRIES, progress=None):
+    """Upsert ``rows`` into ``table`` as list upserts, one request per chunk.
+
+    An upsert on ``on_conflict`` is idempotent, so a failed chunk is simply
+    re-sent (up to ``retries`` extra attempts with exponential backoff).
+    ``progress(done, total)`` is called after every committed chunk. Returns
+    the number of rows written. A chunk that keeps failing re-raises its
+    error, as ``PartialWriteError`` if earlier chunks were already committed.
+    """
+    rows = list(rows)
+    chunks = chunked(rows, chunk_size)
+    written = 0
+    for i, chunk in enumerate(chunks, start=1):
+        for attempt in range(retries + 1):
+            try:
+                conn.table(table).upsert(chunk, on_conflict=on_conflict).execute()
+                break
+            except Exception as e:
+                if attempt < retries:
+                    time.sleep(RETRY_BACKOFF * (2 ** attempt))
+                elif written:
+                    raise PartialWriteError({table: written}, {table: len(rows)}, e) from e
+                else:
+                    raise
+        written += len(chunk)
+        if progress:
+            progress(i, len(chunks))
+    return written
+
+
+def write_all(conn, writes, progress=None):
+    """``bulk_upsert`` each ``(table, rows, on_conflict)`` in order.
+
+    Returns ``{table: rows written}``. If a write fails once anything has
+    been committed, raises ``PartialWriteError`` covering every table.
+    """
+    writes = [(table, list(rows), on_conflict) for table, rows, on_conflict in writes]
+    total = {table: len(rows) for table, rows, _ in writes}
+    written = {}
+    for table, rows, on_conflict in writes:
+        try:
+            written[table] = bulk_upsert(conn, table, rows, on_conflict, progress=progress)
+        except PartialWriteError as e:
+            raise PartialWriteError(dict(written, **e.written), total, e.error) from e.error
+        except Exception as e:
+            if any(written.values()):
+                raise PartialWriteError(written, total, e) from e
+            raise
+    return written
+
+
+def fetch_all(*queries, return_exceptions=False):
+    """Execute independent queries concurrently; their results, in order.
+
+    Each query is an unexecuted builder (``conn.table(...).select(...)``).
+    They run on a shared thread pool, so a view waits for its slowest query
+    instead of the sum of them, each in a copy of the caller's context. With
+    ``return_exceptions`` a failed query yields its exception in place of a
+    result; otherwise the first failure is raised once all have finished.
+    """
+    origin = sys._getframe(1).f_code.co_name
+    futures = [_pool().submit(contextvars.copy_context().run, _execute, origin, q) for q in queries]
+    wait(futures)
+    results = []
+    for future in futures:
+        error = future.exception()
+        if error is not None and not return_exceptions:
+            raise error
+        results.append(error if error is not None else future.result())
+    return results
+
+
+class _AllPages:
+    def __init__(self, make_query, page_size):
+        self._make_query = make_query
+        self._page_size = page_size
+
+    def execute(self):
+        rows, last_id = [], None
+        while True:
+            query = self._make_query()
+            if last_id is not None:
+                query = query.gt("id", last_id)
+            page = query.order("id").limit(self._page_size).execute().data or []
+            # Stop on an empty page, not a short one: a server max-rows below
+            # page_size also returns short pages.
+            if not page:
+                return QueryResult(rows)
+            rows.extend(page)
+            last_id = page[-1]['id']
+
+
+def all_pages(make_query, page_size=READ_PAGE_SIZE):
+    """A query whose ``execute()`` returns every row of ``make_query()``, however many.
+
+    ``make_query`` builds the filtered select (which must include ``id``);
+    it is re-run in ``id`` keyset pages of ``page_size`` rows so a server-side
+    row limit cannot cut the result short. Works with ``fetch_all``.
+    """
+    return _AllPages(make_query, page_size)
+
+
+def _pool():
+    global _fetch_pool
+    with _fetch_pool_lock:
+        if _fetch_pool is None:
+            _fetch_pool = ThreadPoolExecutor(max_workers=FETCH_WORKERS, thread_name_prefix="eb-fetch")
+        return _fetch_pool
+
+
+def _execute(origin, query):
+    QUERY_ORIGIN.set(origin)
+    return query.execute()
+
+
+class QueryResult:
+    """Minimal stand-in for the client's response: just ``data`` and ``count``."""
+
+    def __init__(self, data, count=None):
+        self.data = data
+        self.count = count
+
+
+class QueryCache:
+    """Size-bounded LRU of select results, each entry expiring after ``ttl`` seconds.
+
+    Entries remember every table they read (including embedded ones such as
+    ``profiles(full_name)``) so a write to any of them drops the entry, or,
+    through ``apply``, patches it in place with the rows just written.
+    """
+
+    def __init__(self, ttl=CACHE_TTL, max_entries=CACHE_MAX_ENTRIES, clock=time.monotonic):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.clock = clock
+        self._entries = OrderedDict()
+        self._lock = threading.RLock()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or self.clock() - entry[0] > self.ttl:
+                self._entries.pop(key, None)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[2]
+
+    def put(self, key, tables, value, calls=None):
+        with self._lock:
+            self._entries[key] = (self.clock(), frozenset(tables), value, calls)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, table):
+        with self._lock:
+            stale = [k for k, entry in self._entries.items() if table in entry[1]]
+            for key in stale:
+                del self._entries[key]
+
+    def apply(self, table, rows, deleted=False):
+        """Fold rows just written to ``table`` into the cached reads of it.
+
+        ``rows`` are the full rows the write returned. Entries whose query
+        (``calls`` given to ``put``) is a plain filter chain on ``table`` have
+        those rows merged in, or dropped once they stop matching; every other
+        entry reading ``table`` is invalidated and refetched on next use.
+        """
+        if not isinstance(rows, list) or not all(isinstance(r, dict) and "id" in r for r in rows):
+            self.invalidate(table)
+            return
+        changed = {row["id"]: row for row in rows}
+        with self._lock:
+            for key, (stamp, tables, value, calls) in list(self._entries.items()):
+                if table not in tables:
+                    continue
+                try:
+                    if key[0] != table or calls is None or value.count is not None:
+                        raise _Unpatchable
+                    data = _patched(value.data, calls, changed, deleted)
+                except _Unpatchable:
+                    del self._entries[key]
+                    continue
+                self._entries[key] = (stamp, tables, QueryResult(data), calls)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+class _Unpatchable(Exception):
+    pass
+
+
+def _patched(data, calls, changed, deleted):
+    """Cached ``data`` of query ``calls`` with ``changed`` ({id: row}) applied."""
+    if not isinstance(data, list) or any(m not in PATCHABLE_METHODS or (m == "select" and kw) for m, _, kw in calls):
+        raise _Unpatchable
+    if any(not isinstance(row, dict) or "id" not in row for row in data):
+        raise _Unpatchable
+    ordered = [args[0] for m, args, _ in calls if m == "order"]
+    limited = any(m == "limit" for m, _, _ in calls)
+
+    out = []
+    for row in data:
+        new = changed.get(row["id"])
+        if new is None:
+            out.append(row)
+            continue
+        if deleted or not _matches(new, calls):
+            # A limited page would pull the next row in; let it refetch.
+            if limited:
+                raise _Unpatchable
+            continue
+        if any(col in row and row[col] != new.get(col) for col in ordered):
+            raise _Unpatchable
+        out.append({k: new.get(k, v) for k, v in row.items()})
+
+    cached_ids = {row["id"] for row in data}
+    if not deleted and any(_matches(new, calls) for rid, new in changed.items() if rid not in cached_ids):
+        raise _Unpatchable
+    return out
+
+
+_FILTER_OPS = {"eq": operator.eq, "neq": operator.ne, "lt": operator.lt, "lte": operator.le,
+               "gt": operator.gt, "gte": operator.ge}
+
+
+def _matches(row, calls):
+    """Whether a full ``row`` passes every filter in ``calls`` (SQL NULL semantics)."""
+    for method, args, _ in calls:
+        if method in {"select", "order", "limit"}:
+            continue
+        column, target = args[0], args[1]
+        if column not in row:
+            raise _Unpatchable
+        value = row[column]
+        if value is None:
+            return False
+        if method == "in_":
+            if not any(_compare(value, t) == 0 for t in target):
+                return False
+        elif not _FILTER_OPS[method](_compare(value, target), 0):
+            return False
+    return True
+
+
+def _compare(value, target):
+    if isinstance(value, (int, float)) and isinstance(target, (int, float)) \
+            and not isinstance(value, bool) and not isinstance(target, bool):
+        a, b = value, target
+    else:
+        a, b = str(value), str(target)
+    return (a > b) - (a < b)
+
+
+def _copy_rows(data):
+    if isinstance(data, list):
+        return [dict(row) if isinstance(row, dict) else row for row in data]
+    return data
+
+
+class CachedConnection:
+    """Read-through cache in front of a connection's ``table(...)`` builder.
+
+    Query chains are recorded and only replayed against the real connection
+    on ``execute()``: selects are served from ``cache`` when possible, writes
+    go straight through and the rows they return are applied to the cached
+    reads of that table (``QueryCache.apply``), so a successful write needs no
+    refetch of the data it touched.
+    Anything else (``auth`` etc.) is delegated untouched. If given,
+    ``recorder(table, calls, seconds, rows, cached)`` is called for every
+    executed query, cache hits included.
+    """
+
+    def __init__(self, conn, cache, recorder=None):
+        self._conn = conn
+        self.cache = cache
+        self.recorder = recorder
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+    @property
+    def uncached(self):
+        """This connection without the read cache, for reads that must be fresh.
+
+        Queries made through it still go to the recorder, and its writes
+        still patch the cache.
+        """
+        return _Uncached(self)
+
+    def table(self, name, cache=True):
+        return _RecordedQuery(self, name, cache)
+
+    def _run(self, table, calls):
+        query = self._conn.table(table)
+        for method, args, kwargs in calls:
+            query = getattr(query, method)(*args, **kwargs)
+        return query.execute()
+
+    def execute(self, table, calls, cache=True):
+        start = time.perf_counter()
+        cached = False
+        res = None
+        try:
+            if calls and calls[0][0] in WRITE_METHODS:
+                try:
+                    res = self._run(table, calls)
+                except Exception:
+                    self.cache.invalidate(table)
+                    raise
+                self.cache.apply(table, res.data, deleted=calls[0][0] == "delete")
+                return res
+            if not cache:
+                res = self._run(table, calls)
+                return res
+
+            key = (table, repr(calls))
+            hit = self.cache.get(key)
+            cached = hit is not None
+            if hit is None:
+                fresh = self._run(table, calls)
+                hit = QueryResult(_copy_rows(fresh.data), getattr(fresh, "count", None))
+                self.cache.put(key, _tables_read(table, calls), hit, calls)
+            res = QueryResult(_copy_rows(hit.data), hit.count)
+            return res
+        finally:
+            if self.recorder:
+                rows = len(res.data) if res is not None and isinstance(res.data, list) else 0
+                self.recorder(table, calls, time.perf_counter() - start, rows, cached)
+
+
+def _tables_read(table, calls):
+    tables = {table}
+    for method, args, _ in calls:
+        if method == "select" and args:
+            tables.update(re.findall(r"(\w+)(?:!\w+)?\s*\(", str(args[0])))
+    return tables
+
+
+class _Uncached:
+    def __init__(self, conn):
+        self._conn = conn
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+    def table(self, name):
+        return self._conn.table(name, cache=False)
+
+
+class _RecordedQuery:
+    def __init__(self, conn, table, cache=True):
+        self._conn = conn
+        self._table = table
+        self._cache = cache
+        self._calls = []
+
+    def __getattr__(self, method):
+        def record(*args, **kwargs):
+            self._calls.append((method, args, kwargs))
+            return self
+        return record
+
+    def execute(self):
+        return self._conn.execute(self._table, self._calls, self._cache)
+
+
+def _pgrst_value(value):
+    return '"' + str(value).replace('\\', '\\\\').replace('"', '\\"') + '"'
+
+
+def fetch_page(conn, table, columns, page_size, cursor=None, filters=()):
+    """One page of ``table``, newest first, using keyset pagination.
+
+    Rows are ordered by ``(created_at, id)`` descending; ``cursor`` is the
+    ``(created_at, id)`` of the last row on the previous page, so every page
+    costs the same whatever its depth. ``filters`` is a sequence of
+    ``(method, *args)`` tuples applied to the query (e.g. ``("eq", "status",
+    "Paid")``). Returns ``(rows, next_cursor)``; ``next_cursor`` is ``None``
+    on the last page.
+    """
+    query = conn.table(table).select(columns)
+    for method, *args in filters:
+        query = getattr(query, method)(*args)
+    if cursor:
+        created_at, row_id = (_pgrst_value(v) for v in cursor)
+        query = query.or_(f"created_at.lt.{created_at},and(created_at.eq.{created_at},id.lt.{row_id})")
+    rows = query.order("created_at", desc=True).order("id", desc=True).limit(page_size + 1).execute().data or []
+
+    next_cursor = None
+    if len(rows) > page_size:
+        rows = rows[:page_size]
+        next_cursor = (rows[-1]['created_at'], rows[-1]['id'])
+    return rows, next_cursor
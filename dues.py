@@ -0,0 +1,250 @@
+"""Outstanding dues: per-tenant balances built from unpaid bill/rent rows.
+
+Rows are indexed by ``user_id`` in a single pass, so summaries stay linear in
+the number of unpaid records no matter how many tenants there are.
+"""
+import functools
+import io
+import urllib.parse
+from datetime import datetime, timezone
+
+import db
+
+UPI_PAYEE = "s.vihar@upi"
+UPI_PAYEE_NAME = "S Vihar Society"
+UPI_QR_CACHE_SIZE = 256
+# Columns a payment writes, and restores if the rest of a lump sum fails.
+PAYMENT_COLUMNS = ("amount_paid", "status", "payment_mode", "payment_date", "txn_id")
+
+
+def remaining(row, amount_key):
+    """What is still owed on one ``bills`` / ``rent_records`` row."""
+    return row[amount_key] - (row.get('amount_paid', 0) or 0)
+
+
+def outstanding_index(rows, amount_key):
+    """Group unpaid rows by tenant in one pass.
+
+    Returns ``{user_id: {"total": sum_of_remaining, "months": [(bill_month, rem), ...]}}``;
+    ``months`` keeps only rows with something left to pay, in row order.
+    """
+    index = {}
+    for row in rows or []:
+        entry = index.get(row['user_id'])
+        if entry is None:
+            entry = index[row['user_id']] = {"total": 0, "months": []}
+        rem = remaining(row, amount_key)
+        entry["total"] += rem
+        if rem > 0:
+            entry["months"].append((row['bill_month'], rem))
+    return index
+
+
+def reminder_link(mobile, months):
+    """WhatsApp link reminding a tenant of their pending electricity months."""
+    mobile = str(mobile or '').strip()
+    if len(mobile) == 10: mobile = "91" + mobile
+    elif mobile.startswith("+"): mobile = mobile[1:]
+    if not mobile or not months:
+        return None
+
+    breakdown_text = "".join(f"- {month}: ₹{rem}\n" for month, rem in months)
+    msg = "Hello,\n\nThis is a gentle reminder regarding your Electricity dues.\n\n"
+    if len(months) == 1:
+        msg += f"Pending {breakdown_text}"
+    else:
+        elec_pending = sum(rem for _, rem in months)
+        msg += f"Breakdown of pending months:\n{breakdown_text}\n*Total Electricity Due: ₹{elec_pending}*\n"
+    msg += "\nThank you"
+    return f"https://wa.me/{mobile}?text={urllib.parse.quote(msg)}"
+
+
+def upi_url(payee, amount, name=UPI_PAYEE_NAME):
+    """``upi://pay`` link asking for ``amount`` rupees, with every parameter percent-encoded."""
+    params = {"pa": payee, "pn": name, "am": f"{amount:.2f}", "cu": "INR"}
+    return "upi://pay?" + urllib.parse.urlencode(params, safe="@", quote_via=urllib.parse.quote)
+
+
+@functools.lru_cache(maxsize=UPI_QR_CACHE_SIZE)
+def upi_qr_png(payee, amount, name=UPI_PAYEE_NAME):
+    """PNG bytes of the QR code for ``upi_url``, generated locally and cached per ``(payee, amount)``."""
+    import segno
+    buf = io.BytesIO()
+    segno.make(upi_url(payee, amount, name), error="m").save(buf, kind="png", scale=6, border=2)
+    return buf.getvalue()
+
+
+def outstanding_summary(tenants, balances, pending_elec):
+    """One summary row per tenant: rent, electricity and total due plus a reminder link.
+
+    Totals come from the materialized ``balances`` (``ledger.index``); unpaid
+    electricity rows are only used for the month breakdown in the reminder.
+    """
+    elec_index = outstanding_index(pending_elec, 'total_amount')
+    empty = {"total": 0, "months": []}
+
+    summary = []
+    for t in tenants or []:
+        owed = balances.get(t['id'], {})
+        rent_pending = (owed.get('rent') or {}).get('outstanding') or 0
+        elec_pending = (owed.get('electricity') or {}).get('outstanding') or 0
+        elec_months = elec_index.get(t['id'], empty)["months"]
+        summary.append({
+            "Tenant Name": t['full_name'],
+            "Flat Number": t.get('flat_number', 'N/A'),
+            "Rent Pending (₹)": rent_pending,
+            "Electricity Pending (₹)": elec_pending,
+            "Total Due (₹)": rent_pending + elec_pending,
+            "WhatsApp Link": reminder_link(t.get('mobile'), elec_months) if elec_pending > 0 else None
+        })
+    return summary
+
+
+def allocate_payment(rent_rows, elec_rows, amount):
+    """Spread a lump-sum ``amount`` over unpaid rows, oldest month first.
+
+    Rent is settled before electricity within the same month. Returns
+    ``(allocations, leftover)``: one allocation per row that receives money,
+    with the row's new ``amount_paid``/``status``, and whatever could not be
+    applied because everything is paid off.
+    """
+    dues = []
+    for table, category, amount_key, rows in (
+        ("rent_records", "Rent", "amount", rent_rows),
+        ("bills", "Electricity", "total_amount", elec_rows),
+    ):
+        for row in rows or []:
+            rem = remaining(row, amount_key)
+            if rem > 0:
+                dues.append((str(row['bill_month']), 0 if category == "Rent" else 1, table, category, amount_key, row, rem))
+    dues.sort(key=lambda d: (d[0], d[1], str(d[5]['id'])))
+
+    allocations = []
+    left = amount
+    for bill_month, _, table, category, amount_key, row, rem in dues:
+        if left <= 0:
+            break
+        applied = min(rem, left)
+        left -= applied
+        new_total_paid = (row.get('amount_paid', 0) or 0) + applied
+        allocations.append({
+            "table": table, "category": category, "id": row['id'], "bill_month": bill_month,
+            "due": rem, "applied": applied, "amount_paid": new_total_paid,
+            "status": "Paid" if new_total_paid >= row[amount_key] else "Partial",
+        })
+    return allocations, left
+
+
+def _unchanged(query, row):
+    """Limit an update to ``row`` as it was read: same id, status and amount paid."""
+    query = query.eq("id", row['id']).eq("status", row['status'])
+    return query.eq("amount_paid", row['amount_paid']) if row.get('amount_paid') is not None else query
+
+
+def record_payment(conn, user_id, amount, payment_fields):
+    """Spread a lump-sum ``amount`` over ``user_id``'s unpaid rows as stored now.
+
+    The unpaid rows are re-read past the session cache and allocated with
+    ``allocate_payment``. Each touched row gets one update of ``amount_paid``,
+    ``status`` and ``payment_fields`` (mode, date, txn id), applied only if
+    the row is still as read; the updates run concurrently. The payment is
+    all or nothing: if any update fails or finds its row changed, the ones
+    that succeeded are put back and ``RuntimeError`` is raised (naming any
+    row that could not be put back). Returns ``(allocations, leftover)``.
+    """
+    raw = getattr(conn, "uncached", conn)
+    columns = ", ".join(PAYMENT_COLUMNS)
+    rent, elec = db.fetch_all(*(
+        raw.table(table).select(f"id, bill_month, {amount_key}, {columns}").eq("user_id", user_id).neq("status", "Paid")
+        for table, amount_key in (("rent_records", "amount"), ("bills", "total_amount"))
+    ))
+    before = {(table, row['id']): row for table, rows in (("rent_records", rent.data), ("bills", elec.data)) for row in rows or []}
+    allocations, leftover = allocate_payment(rent.data, elec.data, amount)
+    results = db.fetch_all(*(
+        _unchanged(conn.table(a['table']).update(dict(payment_fields, amount_paid=a['amount_paid'], status=a['status'])),
+                   before[(a['table'], a['id'])])
+        for a in allocations
+    ), return_exceptions=True)
+    saved = [a for a, res in zip(allocations, results) if not isinstance(res, Exception) and res.data]
+    if len(saved) == len(allocations):
+        return allocations, leftover
+
+    errors = [res for res in results if isinstance(res, Exception)]
+    reason = str(errors[0]) if errors else "a due changed while saving"
+    undone = db.fetch_all(*(
+        conn.table(a['table']).update({k: before[(a['table'], a['id'])].get(k) for k in PAYMENT_COLUMNS})
+            .eq("id", a['id']).eq("status", a['status']).eq("amount_paid", a['amount_paid'])
+        for a in saved
+    ), return_exceptions=True)
+    stuck = [a for a, res in zip(saved, undone) if isinstance(res, Exception) or not res.data]
+    if stuck:
+        raise RuntimeError(f"Payment only partly recorded and could not be undone ({reason}): "
+                           + ", ".join(f"₹{a['applied']} on {a['category']} {a['bill_month']}" for a in stuck)
+                           + ". Correct those rows in Records before trying again.")
+    raise RuntimeError(f"Payment not recorded ({reason}). Nothing was applied; check the balance and try again.")
+
+
+def approve_claims(conn, bill_ids, rent_ids):
+    """Mark claimed rows fully paid with conditional updates, as ``reject_claims`` does.
+
+    ``amount_paid`` is each row's own total, so the ids are grouped by total
+    (read past the session cache) and each group gets one update, run
+    concurrently and guarded on ``status = 'Verifying'`` and that total; rows
+    paid, rejected or re-billed meanwhile are left alone. Nothing is inserted,
+    so only UPDATE rights are needed. Returns ``{table: [approved ids]}``.
+    """
+    raw = getattr(conn, "uncached", conn)
+    approved = {}
+    for table, ids, amount_key in (("bills", bill_ids, 'total_amount'), ("rent_records", rent_ids, 'amount')):
+        ids = list(ids or [])
+        approved[table] = []
+        if not ids:
+            continue
+        fresh = raw.table(table).select(f"id, {amount_key}").in_("id", ids).eq("status", "Verifying").execute().data
+        by_total = {}
+        for row in fresh or []:
+            by_total.setdefault(row[amount_key], []).append(row['id'])
+        results = db.fetch_all(*(
+            conn.table(table).update({"status": "Paid", "amount_paid": total})
+            .in_("id", group).eq("status", "Verifying").eq(amount_key, total)
+            for total, group in by_total.items()
+        ))
+        approved[table] = [row['id'] for res in results for row in res.data or []]
+    return approved
+
+
+def reject_claims(conn, bill_ids, rent_ids):
+    """Send claims back to ``Pending`` with one update per table, clearing ``claimed_at``.
+
+    Only rows still ``Verifying`` are touched. Returns ``{table: [rejected ids]}``.
+    """
+    rejected = {}
+    for table, ids in (("bills", bill_ids), ("rent_records", rent_ids)):
+        ids = list(ids or [])
+        if not ids:
+            rejected[table] = []
+            continue
+        res = conn.table(table).update({"status": "Pending", "claimed_at": None}).in_("id", ids).eq("status", "Verifying").execute()
+        rejected[table] = [row['id'] for row in res.data or []]
+    return rejected
+
+
+def claim_payment(conn, user_id, bill_ids, rent_ids):
+    """Move a tenant's unpaid rows to ``Verifying`` with one update per table.
+
+    Only the given ids belonging to ``user_id`` that are not already paid are
+    touched. Every row of one claim gets the same ``claimed_at`` stamp, which
+    the admin verification queue shows and groups by. Returns
+    ``{table: [claimed ids]}`` as reported back by the database.
+    """
+    stamp = datetime.now(timezone.utc).isoformat()
+    claimed = {}
+    for table, ids in (("bills", bill_ids), ("rent_records", rent_ids)):
+        ids = list(ids or [])
+        if not ids:
+            claimed[table] = []
+            continue
+        res = conn.table(table).update({"status": "Verifying", "claimed_at": stamp}) \
+            .eq("user_id", user_id).in_("id", ids).neq("status", "Paid").execute()
+        claimed[table] = [row['id'] for row in res.data or []]
+    return claimed
@@ -0,0 +1,146 @@
+"""Query and rerun instrumentation.
+
+``MetricsLog.record`` is plugged into ``db.CachedConnection`` as its
+recorder, so every query made through ``conn`` is logged with its timing,
+row count, cache status and the section of the app that issued it. Records
+are grouped per Streamlit rerun; the admin debug panel in ``EB.py`` renders
+them and can capture a cProfile of a single rerun.
+"""
+import contextlib
+import contextvars
+import cProfile
+import io
+import itertools
+import json
+import os
+import pstats
+import sys
+import tempfile
+import time
+from collections import deque
+
+_section = contextvars.ContextVar("eb_section", default=())
+_SKIP_FILES = {os.path.abspath(__file__)}
+_PLUMBING = {"execute", "_run", "record"}
+
+
+@contextlib.contextmanager
+def section(name):
+    """Label every query issued inside the block with ``name`` (nestable)."""
+    token = _section.set(_section.get() + (name,))
+    try:
+        yield
+    finally:
+        _section.reset(token)
+
+
+def current_section():
+    return " / ".join(_section.get())
+
+
+def _caller():
+    """Name of the nearest app function that issued the query."""
+    import db
+    if db.QUERY_ORIGIN.get():
+        return db.QUERY_ORIGIN.get()
+    db_file = os.path.abspath(db.__file__)
+    frame = sys._getframe(2)
+    while frame is not None:
+        path = os.path.abspath(frame.f_code.co_filename)
+        if path not in _SKIP_FILES and not (path == db_file and frame.f_code.co_name in _PLUMBING):
+            return frame.f_code.co_name
+        frame = frame.f_back
+    return "?"
+
+
+class MetricsLog:
+    """Per-rerun query records, keeping the last ``max_reruns`` reruns."""
+
+    def __init__(self, max_reruns=50):
+        self.reruns = deque(maxlen=max_reruns)
+        self._ids = itertools.count(1)
+        self.start_rerun()
+
+    def start_rerun(self, label=""):
+        self.current = {"rerun": next(self._ids), "label": label, "started": time.time(), "queries": []}
+        self.reruns.append(self.current)
+        return self.current
+
+    def finish_rerun(self):
+        self.current["seconds"] = time.time() - self.current["started"]
+
+    def record(self, table, calls, seconds, rows, cached):
+        self.current["queries"].append({
+            "rerun": self.current["rerun"],
+            "ts": time.time(),
+            "section": current_section() or "-",
+            "caller": _caller(),
+            "table": table,
+            "action": calls[0][0] if calls else "?",
+            "query": describe(calls),
+            "seconds": seconds,
+            "rows": rows,
+            "cached": cached,
+        })
+
+    def totals(self, rerun=None):
+        """Query count, database time, cache hits and rows for one rerun."""
+        queries = (rerun or self.current)["queries"]
+        return {
+            "queries": sum(not q["cached"] for q in queries),
+            "cache_hits": sum(q["cached"] for q in queries),
+            "db_seconds": sum(q["seconds"] for q in queries if not q["cached"]),
+            "rows": sum(q["rows"] for q in queries),
+        }
+
+    def by_section(self, rerun=None):
+        """``[{section, queries, cache_hits, db_seconds, rows}]`` slowest first."""
+        groups = {}
+        for q in (rerun or self.current)["queries"]:
+            g = groups.setdefault(q["section"], {"section": q["section"], "queries": 0, "cache_hits": 0, "db_seconds": 0.0, "rows": 0})
+            if q["cached"]:
+                g["cache_hits"] += 1
+            else:
+                g["queries"] += 1
+                g["db_seconds"] += q["seconds"]
+            g["rows"] += q["rows"]
+        return sorted(groups.values(), key=lambda g: g["db_seconds"], reverse=True)
+
+    def to_jsonl(self):
+        """Every stored query record, one JSON object per line."""
+        return "".join(json.dumps(q, default=str) + "\n" for r in self.reruns for q in r["queries"])
+
+
+def describe(calls):
+    """Compact text form of a recorded query chain, e.g. ``select(*).eq(status,Paid)``."""
+    parts = []
+    for method, args, kwargs in calls:
+        shown = [repr(a) if not isinstance(a, str) else a for a in args]
+        shown += [f"{k}={v!r}" for k, v in kwargs.items()]
+        parts.append(f"{method}({', '.join(shown)})")
+    text = ".".join(parts)
+    return text if len(text) <= 300 else text[:297] + "..."
+
+
+class RerunProfiler:
+    """cProfile capture of one rerun; ``stop()`` returns ``(prof_bytes, summary_text)``."""
+
+    def __init__(self):
+        self.profile = cProfile.Profile()
+
+    def start(self):
+        self.profile.enable()
+
+    def stop(self, top=30):
+        self.profile.disable()
+        summary = io.StringIO()
+        pstats.Stats(self.profile, stream=summary).sort_stats("cumulative").print_stats(top)
+        with tempfile.NamedTemporaryFile(suffix=".prof", delete=False) as f:
+            path = f.name
+        try:
+            self.profile.dump_stats(path)
+            with open(path, "rb") as f:
+                data = f.read()
+        finally:
+            os.unlink(path)
+        return data, summary.getvalue()
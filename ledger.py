@@ -0,0 +1,147 @@
+"""Materialized per-tenant balances.
+
+The ``balances`` table holds one row per tenant and category (``rent`` /
+``electricity``): ``outstanding`` (what is still owed), ``oldest_unpaid``
+(bill month) and ``unpaid_count``, unique on ``(user_id, category)``. Every
+write that changes what a tenant owes calls ``refresh`` for the tenants it
+touched, so dashboards read a balance as one row instead of summing unpaid
+bills. ``migrations/balances.sql`` creates the table on Supabase and
+backfills it. ``reconcile`` recomputes everything from the raw rows and
+reports (or fixes) any drift:
+
+    python ledger.py --fix
+"""
+import argparse
+import sys
+from datetime import datetime, timezone
+
+import db
+import dues
+
+TABLE = "balances"
+# category -> (source table, amount column)
+CATEGORIES = {"rent": ("rent_records", "amount"), "electricity": ("bills", "total_amount")}
+REFRESH_CHUNK_SIZE = 200
+
+
+def _empty():
+    return {"outstanding": 0, "oldest_unpaid": None, "unpaid_count": 0}
+
+
+def expected_balances(pending_rent, pending_elec):
+    """``{(user_id, category): {outstanding, oldest_unpaid, unpaid_count}}`` from unpaid rows."""
+    out = {}
+    for category, rows in (("rent", pending_rent), ("electricity", pending_elec)):
+        amount_key = CATEGORIES[category][1]
+        for row in rows or []:
+            rem = dues.remaining(row, amount_key)
+            if rem <= 0:
+                continue
+            entry = out.setdefault((row['user_id'], category), _empty())
+            entry["outstanding"] += rem
+            entry["unpaid_count"] += 1
+            month = str(row['bill_month'])
+            if entry["oldest_unpaid"] is None or month < entry["oldest_unpaid"]:
+                entry["oldest_unpaid"] = month
+    return out
+
+
+def balance_rows(expected, keys):
+    """Rows to upsert for ``keys`` (``(user_id, category)`` pairs), zeroed where nothing is due."""
+    stamp = datetime.now(timezone.utc).isoformat()
+    return [dict(user_id=user_id, category=category, updated_at=stamp, **expected.get((user_id, category), _empty()))
+            for user_id, category in keys]
+
+
+def _unpaid_queries(conn, user_ids=None):
+    # Balances are written from fresh rows, never from a session's cached reads,
+    # and from every row: the reads are paged past the server's row limit.
+    raw = getattr(conn, "uncached", conn)
+    queries = []
+    for table, amount_key in CATEGORIES.values():
+        def unpaid(table=table, amount_key=amount_key):
+            query = raw.table(table).select(f"id, user_id, bill_month, {amount_key}, amount_paid").neq("status", "Paid")
+            return query.in_("user_id", user_ids) if user_ids is not None else query
+        queries.append(db.all_pages(unpaid))
+    return queries
+
+
+def refresh(conn, user_ids):
+    """Recompute and store both balances of every tenant in ``user_ids``.
+
+    Reads only those tenants' unpaid rows (in chunks of
+    ``REFRESH_CHUNK_SIZE`` tenants) and writes their balance rows with one
+    upsert per chunk. Returns the rows written.
+    """
+    user_ids = [u for u in dict.fromkeys(user_ids) if u]
+    written = []
+    for chunk in db.chunked(user_ids, REFRESH_CHUNK_SIZE) if user_ids else []:
+        rent, elec = db.fetch_all(*_unpaid_queries(conn, chunk))
+        rows = balance_rows(expected_balances(rent.data, elec.data), [(u, c) for u in chunk for c in CATEGORIES])
+        db.bulk_upsert(conn, TABLE, rows, "user_id, category")
+        written.extend(rows)
+    return written
+
+
+def reconcile(conn, fix=False):
+    """Check every stored balance against the raw unpaid rows.
+
+    Returns one ``{user_id, category, stored, expected}`` dict per balance
+    that is wrong or missing (a missing row counts only if something is
+    owed). With ``fix`` the expected values are written for those balances.
+    """
+    raw = getattr(conn, "uncached", conn)
+    rent, elec, stored = db.fetch_all(*_unpaid_queries(conn), db.all_pages(lambda: raw.table(TABLE).select("*")))
+    expected = expected_balances(rent.data, elec.data)
+    stored = {(r['user_id'], r['category']): r for r in stored.data or []}
+
+    mismatches = []
+    for key in sorted(set(expected) | set(stored), key=str):
+        want = expected.get(key, _empty())
+        have = stored.get(key)
+        if have is None and not want["unpaid_count"]:
+            continue
+        if have is None or abs((have.get('outstanding') or 0) - want["outstanding"]) > 0.005 \
+                or have.get('oldest_unpaid') != want["oldest_unpaid"] or (have.get('unpaid_count') or 0) != want["unpaid_count"]:
+            mismatches.append({"user_id": key[0], "category": key[1],
+                               "stored": {k: have.get(k) for k in want} if have else None, "expected": want})
+    if fix and mismatches:
+        db.bulk_upsert(conn, TABLE, balance_rows(expected, [(m['user_id'], m['category']) for m in mismatches]),
+                       "user_id, category")
+    return mismatches
+
+
+def balances_query(conn, user_id=None):
+    query = conn.table(TABLE).select("*")
+    return query.eq("user_id", user_id) if user_id else query
+
+
+def index(rows):
+    """``{user_id: {category: balance_row}}``."""
+    out = {}
+    for row in rows or []:
+        out.setdefault(row['user_id'], {})[row['category']] = row
+    return out
+
+
+def owed(balances, user_id, category=None):
+    """Outstanding amount of one tenant from an ``index``, for one category or both."""
+    entry = balances.get(user_id, {})
+    categories = [category] if category else list(CATEGORIES)
+    return sum((entry.get(c) or {}).get('outstanding') or 0 for c in categories)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Check the balances table against unpaid bills and rent.")
+    parser.add_argument("--fix", action="store_true", help="write the expected balances for every mismatch")
+    args = parser.parse_args(argv)
+
+    mismatches = reconcile(db.connect(), fix=args.fix)
+    for m in mismatches:
+        print(f"{m['user_id']} {m['category']}: stored {m['stored']} expected {m['expected']}")
+    print(f"{len(mismatches)} mismatched balance(s){' fixed' if args.fix and mismatches else ''}.")
+    return 1 if mismatches and not args.fix else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,235 @@
+"""Meter topology and readings.
+
+The building's meters are described declaratively in ``meter_topology.json``
+(or the file named by ``$METER_TOPOLOGY``): every node is a ``main`` meter, a
+``metered`` sub-meter with its own readings, or a ``derived`` residual whose
+units are its parent's units minus everything else metered under it. Derived
+nodes with a ``flat`` are billed to that flat; ones without are common
+(water) usage shared out by head count.
+
+One topology describes one billing pool: flat numbers must be unique across
+it (tenants are matched by ``flat_number`` alone), and all common/water
+nodes must sit under a single main meter, whose water usage is split over
+every billed flat. Further buildings can share the pool with prefixed flat
+numbers (``"B2-101"``); a building with its own water meter needs its own
+topology file.
+"""
+import json
+import os
+from datetime import date, timedelta
+from functools import lru_cache
+
+import db
+
+TOPOLOGY_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "meter_topology.json")
+NODE_TYPES = {"main", "metered", "derived"}
+
+# Readings are monthly, so a year's window almost always holds the latest one.
+LOOKBACK_DAYS = 400
+
+
+def _as_date(value):
+    return value if isinstance(value, date) else date.fromisoformat(str(value)[:10])
+
+
+def latest_readings_before(conn, table, key_column, keys, before):
+    """Latest ``current_reading`` strictly before ``before`` for each key.
+
+    Returns ``{key: current_reading}`` for every key that has an earlier
+    reading. Uses one ``in_`` query over a recent window, plus a single
+    unbounded query for the keys with no reading at all in that window; both
+    are paged past the server's row limit, so no key is cut off and handed
+    an older reading. Database errors propagate to the caller.
+    """
+    keys = [k for k in dict.fromkeys(keys) if k is not None]
+    if not keys:
+        return {}
+
+    before = _as_date(before)
+    window_start = before - timedelta(days=LOOKBACK_DAYS)
+    rows = db.all_pages(lambda: conn.table(table).select(f"id, {key_column}, bill_month, current_reading")
+                        .in_(key_column, keys).lt("bill_month", str(before)).gte("bill_month", str(window_start))).execute().data
+    latest = _index_latest(rows, key_column)
+
+    missing = [k for k in keys if k not in latest]
+    if missing:
+        rows = db.all_pages(lambda: conn.table(table).select(f"id, {key_column}, bill_month, current_reading")
+                            .in_(key_column, missing).lt("bill_month", str(window_start))).execute().data
+        latest.update(_index_latest(rows, key_column))
+    return latest
+
+
+def _index_latest(rows, key_column):
+    latest = {}
+    best_month = {}
+    for row in rows or []:
+        key = row[key_column]
+        if key not in best_month or str(row['bill_month']) > best_month[key]:
+            best_month[key] = str(row['bill_month'])
+            latest[key] = row['current_reading']
+    return latest
+
+
+def previous_sub_readings(conn, flats, before):
+    """``{flat_number: current_reading}`` of each flat's last reading before ``before``."""
+    return latest_readings_before(conn, "sub_meter_readings", "flat_number", flats, before)
+
+
+def previous_main_readings(conn, meter_names, before):
+    """``{meter_name: current_reading}`` of each main meter's last reading before ``before``."""
+    return latest_readings_before(conn, "main_meters", "meter_name", meter_names, before)
+
+
+def build_topology(config):
+    """Validate a topology config and index it for O(1) lookups.
+
+    Returns a dict with ``meters`` (name -> node), ``children`` (parent name ->
+    child names, in config order), ``mains`` (root meter names), ``flat_meter``
+    (flat -> main meter whose rate it pays), ``default_meter`` and
+    ``water_meter`` (the main meter carrying the common/water residual).
+    Raises ``ValueError`` for a flat on two meters or common meters under
+    more than one main meter (see the module docstring).
+    """
+    nodes = {}
+    children = {}
+    flat_node = {}
+    for node in config.get("meters", []):
+        name = str(node["name"])
+        if name in nodes:
+            raise ValueError(f"Duplicate meter '{name}' in topology")
+        if node.get("type") not in NODE_TYPES:
+            raise ValueError(f"Meter '{name}' has unknown type {node.get('type')!r}")
+        node = dict(node, name=name)
+        if node.get("flat") is not None:
+            node["flat"] = str(node["flat"])
+            if node["flat"] in flat_node:
+                raise ValueError(f"Flat '{node['flat']}' is on both '{flat_node[node['flat']]}' and '{name}'; "
+                                 "flat numbers must be unique")
+            flat_node[node["flat"]] = name
+        nodes[name] = node
+        if node["type"] != "main":
+            children.setdefault(str(node["parent"]), []).append(name)
+
+    for parent, names in children.items():
+        if parent not in nodes:
+            raise ValueError(f"Meters {names} reference unknown parent '{parent}'")
+        if sum(nodes[n]["type"] == "derived" for n in names) > 1:
+            raise ValueError(f"Meter '{parent}' has more than one derived child")
+        if nodes[parent]["type"] == "derived":
+            raise ValueError(f"Derived meter '{parent}' cannot have children")
+
+    mains = [n for n, node in nodes.items() if node["type"] == "main"]
+    root_of = {}
+    for main in mains:
+        for name in _walk(children, main):
+            root_of[name] = main
+    flat_meter = {node["flat"]: root_of[name] for name, node in nodes.items() if node.get("flat") and name in root_of}
+    common = [n for n, node in nodes.items() if node["type"] == "derived" and not node.get("flat")]
+    water_mains = list(dict.fromkeys(root_of[n] for n in common if n in root_of))
+    if len(water_mains) > 1:
+        raise ValueError(f"Common/water meters under several main meters ({', '.join(water_mains)}); "
+                         "only one water meter per topology is supported")
+
+    default_meter = config.get("default_meter") or (mains[0] if mains else None)
+    return {
+        "meters": nodes,
+        "children": children,
+        "mains": mains,
+        "flat_meter": flat_meter,
+        "default_meter": default_meter,
+        "water_meter": root_of.get(common[0], default_meter) if common else default_meter,
+    }
+
+
+@lru_cache(maxsize=4)
+def _load_topology(path):
+    with open(path, encoding="utf-8") as f:
+        return build_topology(json.load(f))
+
+
+def load_topology(path=None):
+    """The configured topology (cached per file)."""
+    return _load_topology(path or os.environ.get("METER_TOPOLOGY") or TOPOLOGY_FILE)
+
+
+def _walk(children, name):
+    yield name
+    for child in children.get(name, []):
+        yield from _walk(children, child)
+
+
+def meters_under(topology, main):
+    """Every node below ``main`` (excluding it), depth first in config order."""
+    return [n for n in _walk(topology["children"], main) if n != main]
+
+
+def flats_under(topology, main):
+    return [topology["meters"][n]["flat"] for n in meters_under(topology, main) if topology["meters"][n].get("flat")]
+
+
+def all_flats(topology):
+    return [node["flat"] for node in topology["meters"].values() if node.get("flat")]
+
+
+def evaluate(topology, main_units, metered_units):
+    """Units for every node under the given main meters, in one pass.
+
+    ``main_units`` maps main meter -> units consumed and ``metered_units``
+    maps metered node -> units consumed. Derived nodes get their parent's
+    units minus the units of their metered siblings, floored at 0. Returns
+    ``{node_name: units}`` covering mains, metered and derived nodes.
+    """
+    meters, children = topology["meters"], topology["children"]
+    units = {}
+    for main, main_value in main_units.items():
+        units[main] = main_value
+        for name in meters_under(topology, main):
+            if meters[name]["type"] == "metered":
+                units[name] = metered_units.get(name, 0)
+        # Parents are always yielded before their children by _walk.
+        for parent in _walk(children, main):
+            kids = children.get(parent, [])
+            derived = [k for k in kids if meters[k]["type"] == "derived"]
+            if derived:
+                used = sum(units.get(k, 0) for k in kids if meters[k]["type"] == "metered")
+                units[derived[0]] = max(0, units.get(parent, 0) - used)
+    return units
+
+
+def common_units(topology, units):
+    """Total units of derived nodes with no flat (shared water/common usage)."""
+    meters = topology["meters"]
+    return sum(u for name, u in units.items() if meters.get(name, {}).get("type") == "derived" and not meters[name].get("flat"))
+
+
+def reading_key(topology, name):
+    """Key a node's readings are stored under in ``sub_meter_readings``."""
+    node = topology["meters"][name]
+    return node.get("flat") or name
+
+
+def compute_readings(topology, main_units, metered, previous):
+    """Sub-meter rows and common usage for one or more main meters.
+
+    ``main_units`` maps main meter -> units consumed, ``metered`` maps metered
+    node -> ``(prev, curr)`` and ``previous`` maps reading key -> last saved
+    reading (used to roll derived flats forward). Returns ``(rows, water)``:
+    ``rows`` are ``{"flat", "prev", "curr", "units"}`` dicts ready to save and
+    ``water`` maps each main meter to its common/water units.
+    """
+    units = evaluate(topology, main_units, {name: curr - prev for name, (prev, curr) in metered.items()})
+    rows = []
+    water = {}
+    for main in main_units:
+        under = meters_under(topology, main)
+        for name in under:
+            node = topology["meters"][name]
+            key = reading_key(topology, name)
+            if node["type"] == "metered":
+                prev, curr = metered.get(name, (0, 0))
+                rows.append({"flat": key, "prev": prev, "curr": curr, "units": curr - prev})
+            elif node.get("flat"):
+                prev = previous.get(key) or 0
+                rows.append({"flat": key, "prev": prev, "curr": prev + units[name], "units": units[name]})
+        water[main] = common_units(topology, {name: units[name] for name in under})
+    return rows, water
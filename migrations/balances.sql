@@ -0,0 +1,31 @@
+-- Materialized per-tenant balances (see ledger.py). Run once in the Supabase
+-- SQL editor before deploying the app that reads them. Safe to re-run: the
+-- table is created only if missing and the backfill below upserts every
+-- tenant's balance from the unpaid bills and rent, the same as
+-- `python ledger.py --fix`. Give the table the same row level security
+-- policies as bills and rent_records.
+
+create table if not exists balances (
+    id bigint generated by default as identity primary key,
+    user_id uuid not null references profiles (id) on delete cascade,
+    category text not null check (category in ('rent', 'electricity')),
+    outstanding numeric not null default 0,
+    oldest_unpaid date,
+    unpaid_count integer not null default 0,
+    updated_at timestamptz not null default now(),
+    unique (user_id, category)
+);
+
+insert into balances (user_id, category, outstanding, oldest_unpaid, unpaid_count, updated_at)
+select user_id, 'electricity', sum(total_amount - coalesce(amount_paid, 0)), min(bill_month)::date, count(*), now()
+from bills
+where status <> 'Paid' and user_id is not null and total_amount - coalesce(amount_paid, 0) > 0
+group by user_id
+union all
+select user_id, 'rent', sum(amount - coalesce(amount_paid, 0)), min(bill_month)::date, count(*), now()
+from rent_records
+where status <> 'Paid' and user_id is not null and amount - coalesce(amount_paid, 0) > 0
+group by user_id
+on conflict (user_id, category) do update
+    set outstanding = excluded.outstanding, oldest_unpaid = excluded.oldest_unpaid,
+        unpaid_count = excluded.unpaid_count, updated_at = excluded.updated_at;
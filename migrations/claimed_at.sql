@@ -0,0 +1,6 @@
+-- When a tenant's "I have Paid" claim was made (see dues.claim_payment).
+-- Every row of one claim carries the same stamp; the admin verification
+-- queue shows it and lists the oldest claims first. Safe to re-run.
+
+alter table bills add column if not exists claimed_at timestamptz;
+alter table rent_records add column if not exists claimed_at timestamptz;
@@ -0,0 +1,32 @@
+-- Monthly consumption rollups read by the Consumption tab (see analytics.py).
+-- Run once in the Supabase SQL editor. Safe to re-run: the table is created
+-- only if missing and the backfill below upserts every month from the saved
+-- readings, the same as "Rebuild Rollups from History" in the app.
+
+create table if not exists consumption_rollups (
+    id bigint generated by default as identity primary key,
+    kind text not null check (kind in ('meter', 'flat')),
+    name text not null,
+    month date not null,
+    units numeric not null default 0,
+    amount numeric not null default 0,
+    water_units numeric not null default 0,
+    unique (kind, name, month)
+);
+
+insert into consumption_rollups (kind, name, month, units, amount, water_units)
+select 'meter', meter_name, date_trunc('month', bill_month::date)::date,
+       coalesce(sum(units_consumed), 0), round(coalesce(sum(total_bill_amount), 0)::numeric, 2),
+       coalesce(sum(water_units), 0)
+from main_meters
+group by meter_name, date_trunc('month', bill_month::date)
+on conflict (kind, name, month) do update
+    set units = excluded.units, amount = excluded.amount, water_units = excluded.water_units;
+
+insert into consumption_rollups (kind, name, month, units, amount, water_units)
+select 'flat', flat_number::text, date_trunc('month', bill_month::date)::date,
+       coalesce(sum(units_consumed), 0), 0, 0
+from sub_meter_readings
+group by flat_number, date_trunc('month', bill_month::date)
+on conflict (kind, name, month) do update
+    set units = excluded.units, amount = excluded.amount, water_units = excluded.water_units;
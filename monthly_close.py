@@ -0,0 +1,212 @@
+"""Monthly close from the command line.
+
+Runs the steps of the Meters, Generate Monthly and Outstanding tabs without
+the UI:
+
+1. Save the month's readings from a CSV/Excel file, in the format of the
+   Meters tab import (optional if they are already saved).
+2. Compute every tenant's electricity bill for the bill date.
+3. Generate rent.
+4. Refresh balances.
+5. Print the outstanding dues.
+
+Re-billed tenants keep what they already paid, and rent already generated
+for the date is left alone. Without ``--commit`` nothing is written. Any
+validation error (a rejected reading, several bill dates, no main meter
+readings) is printed, nothing is written and the exit status is 1.
+
+    python monthly_close.py --readings readings-2026-06.csv            # dry run
+    python monthly_close.py --readings readings-2026-06.csv --commit
+    python monthly_close.py --date 2026-06-05 --commit                 # readings already saved
+
+``$EB_BACKEND=sqlite`` runs it against the local stand-in.
+"""
+import argparse
+import sys
+from datetime import date
+
+import analytics
+import backfill
+import billing
+import db
+import dues
+import ledger
+import meters
+import readings_import
+
+
+def load_readings(conn, path, topology):
+    """Validate a readings file without writing it; the ``import_readings`` report with its rows."""
+    with open(path, "rb") as f:
+        return readings_import.import_readings(conn, readings_import.read_chunks(f, path), topology,
+                                               commit=False, keep_rows=True)
+
+
+def plan(conn, bill_date, main_rows=(), sub_rows=(), rent=True, topology=None):
+    """Bills and rent the close of ``bill_date`` would write, without writing.
+
+    ``main_rows`` / ``sub_rows`` are readings for that date not saved yet;
+    they override saved ones for the same meter or flat. Returns
+    ``{"bill_date", "main_meters", "sub_meter_readings", "bills", "rent",
+    "summary", "errors"}``.
+    """
+    topology = topology or meters.load_topology()
+    bill_date = str(bill_date)
+    tenants, saved_mm, saved_subs, old_bills, old_rent = db.fetch_all(
+        conn.table("profiles").select("*").eq("role", "tenant").order("flat_number"),
+        conn.table("main_meters").select("*").eq("bill_month", bill_date),
+        conn.table("sub_meter_readings").select("*").eq("bill_month", bill_date),
+        conn.table("bills").select("*").eq("bill_month", bill_date),
+        conn.table("rent_records").select("*").eq("bill_month", bill_date),
+    )
+    mm = {r['meter_name']: r for r in saved_mm.data or []}
+    mm.update({r['meter_name']: r for r in main_rows})
+    subs = {r['flat_number']: r for r in saved_subs.data or []}
+    subs.update({r['flat_number']: r for r in sub_rows})
+
+    errors = []
+    missing = [m for m in topology["mains"] if m not in mm]
+    if missing:
+        errors.append(f"no {', '.join(missing)} reading for {bill_date}")
+
+    frame, _ = billing.compute_electricity_bills(list(mm.values()), list(subs.values()), tenants.data, bill_date, topology)
+    stored = {b['user_id']: b for b in old_bills.data or []}
+    summary = {"new": 0, "changed": 0, "unchanged": 0, "paid_changed": 0, "rent_new": 0, "rent_existing": 0}
+    bills = []
+    for new in billing.bill_records(frame):
+        old = stored.get(new['user_id'])
+        if old is None:
+            summary["new"] += 1
+        elif old.get('total_amount') != new['total_amount'] or old.get('units_consumed') != new['units_consumed']:
+            summary["changed"] += 1
+            summary["paid_changed"] += old.get('status') == "Paid"
+        else:
+            summary["unchanged"] += 1
+            continue
+        bills.append(backfill.merge_bill(new, old))
+
+    rent_rows = []
+    if rent:
+        existing = {r['user_id'] for r in old_rent.data or []}
+        for row in billing.rent_records(billing.build_rent_batch(tenants.data, bill_date)):
+            if row['user_id'] in existing:
+                summary["rent_existing"] += 1
+            else:
+                rent_rows.append(row)
+        summary["rent_new"] = len(rent_rows)
+
+    return {
+        "bill_date": bill_date,
+        "main_meters": list(main_rows),
+        "sub_meter_readings": list(sub_rows),
+        "bills": bills,
+        "rent": rent_rows,
+        "summary": summary,
+        "errors": errors,
+    }
+
+
+def commit(conn, plan):
+    """Write a ``plan``: readings, bills and rent; then refresh rollups and balances.
+
+    Returns ``{table: rows written}``. If the write fails partway, balances
+    are refreshed for the bills and rent already saved and
+    ``db.PartialWriteError`` is raised; running the close again finishes it.
+    """
+    try:
+        written = db.write_all(conn, [
+            ("main_meters", plan["main_meters"], "meter_name, bill_month"),
+            ("sub_meter_readings", plan["sub_meter_readings"], "flat_number, bill_month"),
+            ("bills", plan["bills"], "user_id, bill_month"),
+            ("rent_records", plan["rent"], "user_id, bill_month"),
+        ])
+    except db.PartialWriteError as e:
+        saved = plan["bills"][:e.written.get("bills", 0)] + plan["rent"][:e.written.get("rent_records", 0)]
+        ledger.refresh(conn, [r['user_id'] for r in saved])
+        raise
+    ledger.refresh(conn, [r['user_id'] for r in plan["bills"] + plan["rent"]])
+    if plan["main_meters"] or plan["sub_meter_readings"]:
+        analytics.update_month(conn, plan["bill_date"])
+    return written
+
+
+def outstanding(conn):
+    """``dues.outstanding_summary`` rows for every tenant, from the stored balances."""
+    tenants, balances, pending_elec = db.fetch_all(
+        conn.table("profiles").select("*").eq("role", "tenant").order("flat_number"),
+        ledger.balances_query(conn),
+        conn.table("bills").select("user_id, bill_month, total_amount, amount_paid").neq("status", "Paid"),
+    )
+    return dues.outstanding_summary(tenants.data, ledger.index(balances.data), pending_elec.data)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Close a month: save readings, bill electricity and rent, list dues.")
+    parser.add_argument("--readings", help="CSV or Excel file with the month's readings")
+    parser.add_argument("--date", type=date.fromisoformat, help="bill date (YYYY-MM-DD); defaults to the file's")
+    parser.add_argument("--commit", action="store_true", help="write everything (default: dry run)")
+    parser.add_argument("--no-rent", action="store_true", help="skip rent generation")
+    args = parser.parse_args(argv)
+    if not args.readings and not args.date:
+        parser.error("give --readings, --date or both")
+
+    conn = db.connect()
+    topology = meters.load_topology()
+    errors, main_rows, sub_rows = [], [], []
+    if args.readings:
+        try:
+            report = load_readings(conn, args.readings, topology)
+        except (OSError, ValueError) as e:
+            print(f"error: cannot read {args.readings}: {e}", file=sys.stderr)
+            return 1
+        errors += [f"line {e['line']} ({e['meter']}, {e['bill_month']}): {e['error']}" for e in report["errors"]]
+        main_rows, sub_rows = report["main_meters"], report["sub_meter_readings"]
+        dates = sorted({r['bill_month'] for r in main_rows})
+        if len(dates) > 1:
+            errors.append(f"readings span several bill dates ({', '.join(dates)}); close one month at a time")
+        elif dates and args.date and dates[0] != str(args.date):
+            errors.append(f"readings are dated {dates[0]}, not {args.date}")
+        print(f"Readings: {report['rows']} row(s) read, {len(main_rows)} main and {len(sub_rows)} sub-meter reading(s) valid.")
+        bill_date = args.date or (dates[0] if dates else None)
+    else:
+        bill_date = args.date
+
+    result = None
+    if bill_date and len({r['bill_month'] for r in main_rows}) <= 1:
+        result = plan(conn, bill_date, main_rows, sub_rows, rent=not args.no_rent, topology=topology)
+        errors += result["errors"]
+    elif not bill_date:
+        errors.append("no valid main meter readings in the file")
+
+    if errors:
+        for error in errors:
+            print(f"error: {error}", file=sys.stderr)
+        print(f"{len(errors)} validation error(s); nothing written.", file=sys.stderr)
+        return 1
+
+    s = result["summary"]
+    print(f"Bills for {result['bill_date']}: {s['new']} new, {s['changed']} changed ({s['paid_changed']} already paid), "
+          f"{s['unchanged']} unchanged; ₹{sum(b['total_amount'] for b in result['bills'])} to write.")
+    if not args.no_rent:
+        print(f"Rent: {s['rent_new']} new (₹{sum(r['amount'] for r in result['rent'])}), {s['rent_existing']} already generated.")
+
+    if args.commit:
+        try:
+            written = commit(conn, result)
+        except db.PartialWriteError as e:
+            print(f"error: {e}", file=sys.stderr)
+            return 1
+        print("Written: " + ", ".join(f"{n} {t}" for t, n in written.items()))
+        heading = "Outstanding after close"
+    else:
+        heading = "Outstanding before close (dry run, nothing written)"
+    rows = [r for r in outstanding(conn) if r["Total Due (₹)"] > 0]
+    print(f"{heading}: {len(rows)} tenant(s), ₹{sum(r['Total Due (₹)'] for r in rows)} in total.")
+    for r in sorted(rows, key=lambda r: r["Total Due (₹)"], reverse=True):
+        print(f"  {str(r['Flat Number']):<8} {str(r['Tenant Name']):<24} rent ₹{r['Rent Pending (₹)']:<8} "
+              f"electricity ₹{r['Electricity Pending (₹)']:<8} total ₹{r['Total Due (₹)']}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,315 @@
+"""Bulk import of main and sub-meter readings from CSV or Excel.
+
+One row per meter and month, with columns ``bill_month`` (YYYY-MM-DD),
+``meter`` (a main meter, a metered sub-meter or its flat number),
+``previous_reading`` (optional: defaults to the last saved reading),
+``current_reading`` and ``total_bill_amount`` (main meters only). Derived
+flats and common/water usage are not imported. They are computed per main
+meter and month with the same topology rules as the Meters tab.
+
+Files are read ``chunk_size`` rows at a time and must be sorted by month,
+so only one month is held in memory. A main meter's month is written only
+if all of its rows are valid. Every rejected row is listed in the report
+with its line number.
+"""
+import io
+from datetime import date
+
+import pandas as pd
+
+import analytics
+import db
+import meters
+
+CHUNK_SIZE = 500
+COLUMNS = ["bill_month", "meter", "previous_reading", "current_reading", "total_bill_amount"]
+
+
+def template_csv(topology):
+    """An empty import file listing every meter that takes readings."""
+    rows = [{"bill_month": str(date.today()), "meter": name} for name in _importable(topology)]
+    return pd.DataFrame(rows, columns=COLUMNS).to_csv(index=False)
+
+
+def _importable(topology):
+    names = []
+    for main in topology["mains"]:
+        names.append(main)
+        names += [meters.reading_key(topology, n) for n in meters.meters_under(topology, main)
+                  if topology["meters"][n]["type"] == "metered"]
+    return names
+
+
+def read_chunks(source, filename="", chunk_size=CHUNK_SIZE):
+    """Yield lists of ``(line_number, record)`` from a CSV or Excel file, ``chunk_size`` rows at a time."""
+    name = str(filename or getattr(source, "name", "")).lower()
+    if name.endswith((".xlsx", ".xlsm")):
+        yield from _excel_chunks(source, chunk_size)
+        return
+    if isinstance(source, bytes):
+        source = io.BytesIO(source)
+    line = 1
+    for frame in pd.read_csv(source, chunksize=chunk_size, dtype=str, keep_default_na=False, skipinitialspace=True):
+        frame.columns = [str(c).strip().lower() for c in frame.columns]
+        chunk = []
+        for record in frame.to_dict("records"):
+            line += 1
+            chunk.append((line, record))
+        yield chunk
+
+
+def _excel_chunks(source, chunk_size):
+    try:
+        import openpyxl
+    except ImportError:
+        raise ValueError("Excel import needs the 'openpyxl' package; upload a CSV instead.")
+    sheet = openpyxl.load_workbook(source, read_only=True, data_only=True).active
+    rows = sheet.iter_rows(values_only=True)
+    header = [str(c or "").strip().lower() for c in next(rows, [])]
+    chunk = []
+    for line, values in enumerate(rows, start=2):
+        if all(v is None or str(v).strip() == "" for v in values):
+            continue
+        chunk.append((line, {h: "" if v is None else v for h, v in zip(header, values)}))
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _meter_index(topology):
+    """``{name or flat: (node name, main meter)}`` for every node that takes readings."""
+    index = {}
+    for main in topology["mains"]:
+        index[main] = (main, main)
+        for name in meters.meters_under(topology, main):
+            if topology["meters"][name]["type"] == "metered":
+                index[name] = (name, main)
+                index[meters.reading_key(topology, name)] = (name, main)
+    return index
+
+
+def _number(value, column, integer=True):
+    text = str(value).strip().replace(",", "")
+    if text == "":
+        return None
+    try:
+        number = float(text)
+    except ValueError:
+        raise ValueError(f"{column} '{value}' is not a number")
+    if number < 0:
+        raise ValueError(f"{column} cannot be negative")
+    if integer:
+        if number != int(number):
+            raise ValueError(f"{column} must be a whole number")
+        return int(number)
+    return number
+
+
+def parse_row(topology, index, record):
+    """One validated reading from a file record; raises ``ValueError`` with the reason."""
+    for column in ("bill_month", "meter", "current_reading"):
+        if str(record.get(column, "")).strip() == "":
+            raise ValueError(f"{column} is required")
+    try:
+        bill_month = date.fromisoformat(str(record["bill_month"]).strip()[:10])
+    except ValueError:
+        raise ValueError(f"bill_month '{record['bill_month']}' is not a YYYY-MM-DD date")
+
+    meter = str(record["meter"]).strip()
+    if meter not in index:
+        if meter in topology["meters"]:
+            raise ValueError(f"'{meter}' is a derived meter; its units are computed, not imported")
+        raise ValueError(f"unknown meter or flat '{meter}'")
+    name, main = index[meter]
+
+    row = {
+        "bill_month": bill_month,
+        "name": name,
+        "main": main,
+        "is_main": name == main,
+        "prev": _number(record.get("previous_reading", ""), "previous_reading"),
+        "curr": _number(record["current_reading"], "current_reading"),
+        "bill": _number(record.get("total_bill_amount", ""), "total_bill_amount", integer=False),
+    }
+    if row["is_main"] and row["bill"] is None:
+        raise ValueError("total_bill_amount is required for a main meter")
+    return row
+
+
+def _existing_dates(conn, month):
+    """``{reading key: bill date}`` already saved in the calendar month ``month``."""
+    first, after = analytics.month_start(month), analytics.next_month_start(month)
+    mm, subs = db.fetch_all(
+        conn.table("main_meters").select("meter_name, bill_month").gte("bill_month", first).lt("bill_month", after),
+        conn.table("sub_meter_readings").select("flat_number, bill_month").gte("bill_month", first).lt("bill_month", after),
+    )
+    existing = {r['meter_name']: str(r['bill_month'])[:10] for r in mm.data or []}
+    existing.update({r['flat_number']: str(r['bill_month'])[:10] for r in subs.data or []})
+    return existing
+
+
+def build_month(topology, rows, last, existing):
+    """Rows to save for one calendar month, grouped per main meter.
+
+    ``rows`` are ``(line, parsed row)`` pairs, ``last`` maps reading key ->
+    last known reading (updated in place for every accepted group) and
+    ``existing`` is ``_existing_dates`` for the month. Returns
+    ``(main_rows, sub_rows, errors)``.
+    """
+    groups = {}
+    for line, row in rows:
+        groups.setdefault(row["main"], []).append((line, row))
+
+    main_rows, sub_rows, errors = [], [], []
+    for main, group in groups.items():
+        head = next(((line, row) for line, row in group if row["is_main"]), None)
+        if head is None:
+            errors += [(line, row, f"no {main} reading for this month") for line, row in group]
+            continue
+        head_line, head_row = head
+        bill_date = head_row["bill_month"]
+
+        group_errors = []
+        for line, row in group:
+            key = meters.reading_key(topology, row["name"]) if not row["is_main"] else row["name"]
+            if row["prev"] is None:
+                row["prev"] = last.get(key) or 0
+            if row["bill_month"] != bill_date:
+                group_errors.append((line, row, f"date differs from the {main} reading ({bill_date})"))
+            elif row["curr"] < row["prev"]:
+                group_errors.append((line, row, f"current reading {row['curr']} is below previous {row['prev']}"))
+            elif last.get(key) is not None and row["prev"] < last[key]:
+                group_errors.append((line, row, f"previous reading {row['prev']} is below the last saved reading {last[key]}"))
+            elif existing.get(key) and existing[key] != str(bill_date):
+                group_errors.append((line, row, f"a reading for this month already exists on {existing[key]}"))
+
+        metered = {row["name"]: (row["prev"], row["curr"]) for _, row in group if not row["is_main"]}
+        missing = [n for n in meters.meters_under(topology, main)
+                   if topology["meters"][n]["type"] == "metered" and n not in metered]
+        if missing:
+            group_errors.append((head_line, head_row, f"missing sub-meter readings for {', '.join(missing)}"))
+        if group_errors:
+            # The residual depends on every reading of the group, so none of it is saved.
+            reported = {line for line, _, _ in group_errors}
+            errors += group_errors
+            errors += [(line, row, f"skipped: other {main} readings this month are invalid")
+                       for line, row in group if line not in reported]
+            continue
+
+        units = head_row["curr"] - head_row["prev"]
+        rate = head_row["bill"] / units if units > 0 else 0.0
+        readings, water = meters.compute_readings(topology, {main: units}, metered, last)
+        main_rows.append({
+            "meter_name": main,
+            "bill_month": str(bill_date),
+            "previous_reading": head_row["prev"],
+            "current_reading": head_row["curr"],
+            "units_consumed": units,
+            "total_bill_amount": head_row["bill"],
+            "calculated_rate": rate,
+            "water_units": water[main],
+            "water_cost": water[main] * rate,
+        })
+        sub_rows += [{
+            "flat_number": item['flat'],
+            "bill_month": str(bill_date),
+            "previous_reading": item['prev'],
+            "current_reading": item['curr'],
+            "units_consumed": item['units'],
+        } for item in readings]
+        last[main] = head_row["curr"]
+        last.update({item['flat']: item['curr'] for item in readings})
+    return main_rows, sub_rows, errors
+
+
+def import_readings(conn, chunks, topology=None, commit=True, chunk_size=CHUNK_SIZE, progress=None, keep_rows=False):
+    """Validate and (with ``commit``) save readings streamed from ``read_chunks``.
+
+    Valid months are written with list upserts of up to ``chunk_size``
+    rows, and each month's consumption rollups are refreshed. ``progress(rows_read)``
+    is called after every chunk. Returns a report dict with the row counts,
+    months and one ``{line, bill_month, meter, error}`` per rejected row.
+    With ``keep_rows`` the report also holds every accepted row under
+    ``main_meters`` and ``sub_meter_readings``.
+    """
+    topology = topology or meters.load_topology()
+    index = _meter_index(topology)
+    report = {"rows": 0, "main_rows": 0, "sub_rows": 0, "months": [], "errors": []}
+    if keep_rows:
+        report.update(main_meters=[], sub_meter_readings=[])
+    buffers = {"main_meters": [], "sub_meter_readings": []}
+    conflicts = {"main_meters": "meter_name, bill_month", "sub_meter_readings": "flat_number, bill_month"}
+    state = {"month": None, "rows": [], "imported": {}}
+    seen = set()
+    keys = list(dict.fromkeys(meters.reading_key(topology, n) for n in topology["meters"]
+                              if topology["meters"][n]["type"] != "main"))
+
+    def reject(line, record, error):
+        report["errors"].append({"line": line, "bill_month": str(record.get("bill_month", "")),
+                                 "meter": str(record.get("meter", "")), "error": error})
+
+    def write(force=False):
+        for table, rows in buffers.items():
+            if rows and (force or len(rows) >= chunk_size):
+                if commit:
+                    db.bulk_upsert(conn, table, rows, conflicts[table], chunk_size=chunk_size)
+                rows.clear()
+
+    def flush_month():
+        if not state["rows"]:
+            return
+        first_date = min(row["bill_month"] for _, row in state["rows"])
+        # Saved readings before this month, overridden by earlier months of the file
+        # (which may still be buffered, or not written at all on a dry run).
+        last = meters.previous_main_readings(conn, topology["mains"], first_date)
+        last.update(meters.previous_sub_readings(conn, keys, first_date))
+        last.update(state["imported"])
+        main_rows, sub_rows, errors = build_month(topology, state["rows"], last, _existing_dates(conn, first_date))
+        for line, row, error in errors:
+            reject(line, {"bill_month": row["bill_month"], "meter": row["name"]}, error)
+        if main_rows:
+            buffers["main_meters"].extend(main_rows)
+            buffers["sub_meter_readings"].extend(sub_rows)
+            report["main_rows"] += len(main_rows)
+            report["sub_rows"] += len(sub_rows)
+            report["months"].append(state["month"])
+            if keep_rows:
+                report["main_meters"].extend(main_rows)
+                report["sub_meter_readings"].extend(sub_rows)
+            state["imported"].update({r['meter_name']: r['current_reading'] for r in main_rows})
+            state["imported"].update({r['flat_number']: r['current_reading'] for r in sub_rows})
+        state["rows"] = []
+
+    for chunk in chunks:
+        for line, record in chunk:
+            report["rows"] += 1
+            try:
+                row = parse_row(topology, index, record)
+            except ValueError as e:
+                reject(line, record, str(e))
+                continue
+            month = analytics.month_start(row["bill_month"])
+            if state["month"] and month < state["month"]:
+                reject(line, record, f"file must be sorted by bill_month (after {state['month'][:7]})")
+                continue
+            if (row["name"], month) in seen:
+                reject(line, record, f"duplicate reading for {row['name']} in {month[:7]}")
+                continue
+            seen.add((row["name"], month))
+            if month != state["month"]:
+                flush_month()
+                state["month"] = month
+            state["rows"].append((line, row))
+        write()
+        if progress:
+            progress(report["rows"])
+    flush_month()
+    write(force=True)
+
+    if commit:
+        for month in report["months"]:
+            analytics.update_month(conn, month)
+    report["errors"].sort(key=lambda e: e["line"])
+    return report
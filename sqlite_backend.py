@@ -0,0 +1,450 @@
+"""Local SQLite stand-in for the Supabase connection.
+
+Implements the slice of the postgrest/supabase client the app uses —
+``table(...).select/insert/update/upsert/delete`` with ``eq/neq/lt/lte/gt/
+gte/in_/or_/order/limit`` and foreign-key embeds such as
+``profiles(full_name)`` — plus a minimal ``auth`` with email/password
+accounts, so the whole app runs offline on one machine.
+"""
+import hashlib
+import re
+import secrets
+import sqlite3
+import threading
+import uuid
+from types import SimpleNamespace
+
+from db import QueryResult
+
+NOW = "(strftime('%Y-%m-%dT%H:%M:%f+00:00', 'now'))"
+
+SCHEMA = f"""
+CREATE TABLE IF NOT EXISTS profiles (
+    id TEXT PRIMARY KEY,
+    created_at TEXT DEFAULT {NOW},
+    email TEXT,
+    full_name TEXT,
+    mobile TEXT,
+    role TEXT DEFAULT 'tenant',
+    flat_number TEXT,
+    num_people INTEGER DEFAULT 0,
+    rent_amount INTEGER DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS bills (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    created_at TEXT DEFAULT {NOW},
+    user_id TEXT REFERENCES profiles(id),
+    customer_name TEXT,
+    bill_month TEXT NOT NULL,
+    previous_reading INTEGER,
+    current_reading INTEGER,
+    units_consumed INTEGER,
+    tenant_water_units REAL,
+    rate_per_unit REAL,
+    water_charge REAL,
+    total_amount INTEGER,
+    amount_paid INTEGER DEFAULT 0,
+    status TEXT DEFAULT 'Pending',
+    payment_mode TEXT,
+    payment_date TEXT,
+    txn_id TEXT,
+    UNIQUE (user_id, bill_month)
+);
+CREATE TABLE IF NOT EXISTS rent_records (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    created_at TEXT DEFAULT {NOW},
+    user_id TEXT REFERENCES profiles(id),
+    bill_month TEXT NOT NULL,
+    amount INTEGER,
+    amount_paid INTEGER DEFAULT 0,
+    status TEXT DEFAULT 'Pending',
+    payment_mode TEXT,
+    payment_date TEXT,
+    txn_id TEXT,
+    UNIQUE (user_id, bill_month)
+);
+CREATE TABLE IF NOT EXISTS main_meters (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    created_at TEXT DEFAULT {NOW},
+    meter_name TEXT NOT NULL,
+    bill_month TEXT NOT NULL,
+    previous_reading INTEGER,
+    current_reading INTEGER,
+    units_consumed INTEGER,
+    total_bill_amount REAL,
+    calculated_rate REAL,
+    water_units REAL,
+    water_cost REAL,
+    UNIQUE (meter_name, bill_month)
+);
+CREATE TABLE IF NOT EXISTS sub_meter_readings (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    created_at TEXT DEFAULT {NOW},
+    flat_number TEXT NOT NULL,
+    bill_month TEXT NOT NULL,
+    previous_reading INTEGER,
+    current_reading INTEGER,
+    units_consumed INTEGER,
+    UNIQUE (flat_number, bill_month)
+);
+CREATE TABLE IF NOT EXISTS balances (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id TEXT REFERENCES profiles(id),
+    category TEXT NOT NULL,
+    outstanding INTEGER DEFAULT 0,
+    oldest_unpaid TEXT,
+    unpaid_count INTEGER DEFAULT 0,
+    updated_at TEXT,
+    UNIQUE (user_id, category)
+);
+CREATE TABLE IF NOT EXISTS consumption_rollups (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    kind TEXT NOT NULL,
+    name TEXT NOT NULL,
+    month TEXT NOT NULL,
+    units INTEGER DEFAULT 0,
+    amount REAL DEFAULT 0,
+    water_units REAL DEFAULT 0,
+    UNIQUE (kind, name, month)
+);
+CREATE TABLE IF NOT EXISTS auth_users (
+    id TEXT PRIMARY KEY,
+    email TEXT UNIQUE NOT NULL,
+    salt TEXT NOT NULL,
+    password_hash TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS bills_status_idx ON bills (status);
+CREATE INDEX IF NOT EXISTS bills_created_idx ON bills (created_at, id);
+CREATE INDEX IF NOT EXISTS rent_status_idx ON rent_records (status);
+CREATE INDEX IF NOT EXISTS rent_created_idx ON rent_records (created_at, id);
+CREATE INDEX IF NOT EXISTS bills_user_idx ON bills (user_id, status);
+CREATE INDEX IF NOT EXISTS rent_user_idx ON rent_records (user_id, status);
+"""
+
+# (table, embedded table) -> column on ``table`` referencing the embedded table's id.
+FOREIGN_KEYS = {
+    ("bills", "profiles"): "user_id",
+    ("rent_records", "profiles"): "user_id",
+}
+
+# Columns added after their table first shipped; added to older local files on open.
+ADDED_COLUMNS = {
+    "bills": {"claimed_at": "TEXT"},
+    "rent_records": {"claimed_at": "TEXT"},
+}
+
+COMPARISONS = {"eq": "=", "neq": "<>", "lt": "<", "lte": "<=", "gt": ">", "gte": ">="}
+
+
+class SQLiteConnection:
+    """Drop-in for ``st.connection("supabase", ...)`` backed by a SQLite file."""
+
+    def __init__(self, path=":memory:"):
+        self.path = path
+        self.lock = threading.RLock()
+        self.db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.db.row_factory = sqlite3.Row
+        self.db.executescript(SCHEMA)
+        for table, columns in ADDED_COLUMNS.items():
+            have = {row["name"] for row in self.db.execute(f"PRAGMA table_info({table})")}
+            for column, kind in columns.items():
+                if column not in have:
+                    self.db.execute(f"ALTER TABLE {table} ADD COLUMN {column} {kind}")
+        self._columns = {}
+        self.query_count = 0
+        self.auth = LocalAuth(self)
+
+    def table(self, name):
+        return SQLiteQuery(self, name)
+
+    def columns(self, table):
+        if table not in self._columns:
+            cols = [r["name"] for r in self.db.execute(f"PRAGMA table_info({table})")]
+            if not cols:
+                raise ValueError(f"Unknown table '{table}'")
+            self._columns[table] = cols
+        return self._columns[table]
+
+    def column(self, table, name):
+        if name not in self.columns(table):
+            raise ValueError(f"Column '{name}' does not exist on '{table}'")
+        return f'"{name}"'
+
+
+class SQLiteQuery:
+    def __init__(self, conn, table):
+        self.conn = conn
+        self.table = table
+        self.action = None
+        self.payload = None
+        self.on_conflict = None
+        self.ignore_duplicates = False
+        self.columns = "*"
+        self.count = None
+        self.where = []
+        self.params = []
+        self.orders = []
+        self.row_limit = None
+
+    # --- actions ---
+    def select(self, columns="*", count=None):
+        self.action, self.columns, self.count = "select", columns, count
+        return self
+
+    def insert(self, payload):
+        self.action, self.payload = "insert", payload
+        return self
+
+    def upsert(self, payload, on_conflict="", ignore_duplicates=False):
+        self.action, self.payload, self.on_conflict = "upsert", payload, on_conflict
+        self.ignore_duplicates = ignore_duplicates
+        return self
+
+    def update(self, payload):
+        self.action, self.payload = "update", payload
+        return self
+
+    def delete(self):
+        self.action = "delete"
+        return self
+
+    # --- filters ---
+    def _compare(self, op, column, value):
+        self.where.append(f"{self.conn.column(self.table, column)} {COMPARISONS[op]} ?")
+        self.params.append(value)
+        return self
+
+    def eq(self, column, value): return self._compare("eq", column, value)
+    def neq(self, column, value): return self._compare("neq", column, value)
+    def lt(self, column, value): return self._compare("lt", column, value)
+    def lte(self, column, value): return self._compare("lte", column, value)
+    def gt(self, column, value): return self._compare("gt", column, value)
+    def gte(self, column, value): return self._compare("gte", column, value)
+
+    def in_(self, column, values):
+        values = list(values)
+        if not values:
+            self.where.append("0")
+            return self
+        self.where.append(f"{self.conn.column(self.table, column)} IN ({', '.join('?' * len(values))})")
+        self.params.extend(values)
+        return self
+
+    def is_(self, column, value):
+        self.where.append(f"{self.conn.column(self.table, column)} IS {'NULL' if value in (None, 'null') else 'NOT NULL'}")
+        return self
+
+    def or_(self, filters):
+        sql, params = self._logic("or", _split_top(filters))
+        self.where.append(sql)
+        self.params.extend(params)
+        return self
+
+    def _logic(self, joiner, parts):
+        clauses, params = [], []
+        for part in parts:
+            group = re.match(r"^(and|or)\((.*)\)$", part, re.S)
+            if group:
+                sql, p = self._logic(group.group(1), _split_top(group.group(2)))
+            else:
+                column, op, value = part.split(".", 2)
+                if op == "is":
+                    sql, p = f"{self.conn.column(self.table, column)} IS {'NULL' if value == 'null' else 'NOT NULL'}", []
+                elif op == "in":
+                    values = [_unquote(v) for v in _split_top(value.strip("()"))]
+                    sql, p = f"{self.conn.column(self.table, column)} IN ({', '.join('?' * len(values))})", values
+                else:
+                    sql, p = f"{self.conn.column(self.table, column)} {COMPARISONS[op]} ?", [_unquote(value)]
+            clauses.append(f"({sql})")
+            params.extend(p)
+        return f" {joiner.upper()} ".join(clauses), params
+
+    def order(self, column, desc=False):
+        nulls = "NULLS FIRST" if desc else "NULLS LAST"
+        self.orders.append(f"{self.conn.column(self.table, column)} {'DESC' if desc else 'ASC'} {nulls}")
+        return self
+
+    def limit(self, n):
+        self.row_limit = int(n)
+        return self
+
+    # --- execution ---
+    def _where_sql(self):
+        return f" WHERE {' AND '.join(self.where)}" if self.where else ""
+
+    def execute(self):
+        with self.conn.lock:
+            self.conn.query_count += 1
+            if self.action == "select":
+                return self._select()
+            if self.action in ("insert", "upsert"):
+                return self._write()
+            if self.action == "update":
+                return self._update()
+            if self.action == "delete":
+                return self._delete()
+            raise ValueError("No action (select/insert/upsert/update/delete) on query")
+
+    def _select(self):
+        plain, embeds = _parse_columns(self.columns)
+        cols = self.conn.columns(self.table)
+        wanted = cols if "*" in plain else [c for c in plain]
+        fetch = list(dict.fromkeys(wanted + [FOREIGN_KEYS[(self.table, e[1])] for e in embeds if (self.table, e[1]) in FOREIGN_KEYS]))
+        sql = f"SELECT {', '.join(self.conn.column(self.table, c) for c in fetch)} FROM {self.table}{self._where_sql()}"
+        if self.orders:
+            sql += f" ORDER BY {', '.join(self.orders)}"
+        if self.row_limit is not None:
+            sql += f" LIMIT {self.row_limit}"
+        rows = [dict(r) for r in self.conn.db.execute(sql, self.params)]
+
+        for alias, target, sub_cols in embeds:
+            fk = FOREIGN_KEYS.get((self.table, target))
+            if fk is None:
+                raise ValueError(f"No relationship between '{self.table}' and '{target}'")
+            keys = list({r[fk] for r in rows if r[fk] is not None})
+            found = {}
+            if keys:
+                sub_plain, _ = _parse_columns(sub_cols)
+                sub_wanted = self.conn.columns(target) if "*" in sub_plain else sub_plain
+                select = ", ".join(self.conn.column(target, c) for c in dict.fromkeys(sub_wanted + ["id"]))
+                for r in self.conn.db.execute(f"SELECT {select} FROM {target} WHERE id IN ({', '.join('?' * len(keys))})", keys):
+                    r = dict(r)
+                    found[r["id"]] = {c: r[c] for c in sub_wanted}
+            for r in rows:
+                r[alias] = found.get(r[fk])
+
+        extra = set(fetch) - set(wanted)
+        if extra:
+            rows = [{k: v for k, v in r.items() if k not in extra} for r in rows]
+
+        count = None
+        if self.count:
+            count = self.conn.db.execute(f"SELECT COUNT(*) FROM {self.table}{self._where_sql()}", self.params).fetchone()[0]
+        return QueryResult(rows, count)
+
+    def _write(self):
+        rows = self.payload if isinstance(self.payload, list) else [self.payload]
+        conflict = [c.strip() for c in (self.on_conflict or "").split(",") if c.strip()]
+        out = []
+        db = self.conn.db
+        db.execute("BEGIN")
+        try:
+            for row in rows:
+                keys = list(row.keys())
+                cols = ", ".join(self.conn.column(self.table, k) for k in keys)
+                sql = f"INSERT INTO {self.table} ({cols}) VALUES ({', '.join('?' * len(keys))})"
+                if self.action == "upsert":
+                    target = conflict or ["id"]
+                    updates = [k for k in keys if k not in target]
+                    target_sql = ", ".join(self.conn.column(self.table, c) for c in target)
+                    if updates and not self.ignore_duplicates:
+                        sets = ", ".join(f"{self.conn.column(self.table, k)} = excluded.{self.conn.column(self.table, k)}" for k in updates)
+                        sql += f" ON CONFLICT ({target_sql}) DO UPDATE SET {sets}"
+                    else:
+                        sql += f" ON CONFLICT ({target_sql}) DO NOTHING"
+                sql += " RETURNING *"
+                out.extend(dict(r) for r in db.execute(sql, [_value(row[k]) for k in keys]).fetchall())
+            db.execute("COMMIT")
+        except Exception:
+            db.execute("ROLLBACK")
+            raise
+        return QueryResult(out)
+
+    def _update(self):
+        keys = list(self.payload.keys())
+        sets = ", ".join(f"{self.conn.column(self.table, k)} = ?" for k in keys)
+        sql = f"UPDATE {self.table} SET {sets}{self._where_sql()} RETURNING *"
+        rows = self.conn.db.execute(sql, [_value(self.payload[k]) for k in keys] + self.params).fetchall()
+        return QueryResult([dict(r) for r in rows])
+
+    def _delete(self):
+        rows = self.conn.db.execute(f"DELETE FROM {self.table}{self._where_sql()} RETURNING *", self.params).fetchall()
+        return QueryResult([dict(r) for r in rows])
+
+
+class LocalAuth:
+    """Email/password accounts stored next to the data, mirroring ``conn.auth``."""
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    def _hash(self, password, salt):
+        return hashlib.pbkdf2_hmac("sha256", password.encode(), salt.encode(), 100_000).hex()
+
+    def sign_up(self, credentials):
+        email, password = credentials["email"].strip().lower(), credentials["password"]
+        salt = secrets.token_hex(16)
+        user_id = str(uuid.uuid4())
+        with self.conn.lock:
+            try:
+                self.conn.db.execute(
+                    "INSERT INTO auth_users (id, email, salt, password_hash) VALUES (?, ?, ?, ?)",
+                    (user_id, email, salt, self._hash(password, salt)),
+                )
+            except sqlite3.IntegrityError:
+                raise ValueError("User already registered")
+        return SimpleNamespace(user=SimpleNamespace(id=user_id, email=email), session=None)
+
+    def sign_in_with_password(self, credentials):
+        email, password = credentials["email"].strip().lower(), credentials["password"]
+        with self.conn.lock:
+            row = self.conn.db.execute("SELECT * FROM auth_users WHERE email = ?", (email,)).fetchone()
+        if row is None or not secrets.compare_digest(row["password_hash"], self._hash(password, row["salt"])):
+            raise ValueError("Invalid login credentials")
+        user = SimpleNamespace(id=row["id"], email=row["email"])
+        return SimpleNamespace(user=user, session=SimpleNamespace(user=user))
+
+    def sign_out(self):
+        pass
+
+
+def _value(v):
+    if isinstance(v, (dict, list)):
+        raise ValueError("Nested values are not supported by the SQLite backend")
+    return v
+
+
+def _unquote(value):
+    value = value.strip()
+    if len(value) >= 2 and value[0] == value[-1] == '"':
+        return re.sub(r'\\(.)', r'\1', value[1:-1])
+    return value
+
+
+def _split_top(text):
+    """Split on commas that are not inside parentheses or double quotes."""
+    parts, depth, quoted, buf, i = [], 0, False, [], 0
+    while i < len(text):
+        ch = text[i]
+        if quoted and ch == "\\" and i + 1 < len(text):
+            buf.append(text[i:i + 2])
+            i += 2
+            continue
+        if ch == '"':
+            quoted = not quoted
+        elif not quoted and ch == "(":
+            depth += 1
+        elif not quoted and ch == ")":
+            depth -= 1
+        if ch == "," and depth == 0 and not quoted:
+            parts.append("".join(buf).strip())
+            buf = []
+        else:
+            buf.append(ch)
+        i += 1
+    if "".join(buf).strip():
+        parts.append("".join(buf).strip())
+    return parts
+
+
+def _parse_columns(columns):
+    """``"*, profiles(full_name)"`` -> (``["*"]``, ``[(alias, table, "full_name")]``)."""
+    plain, embeds = [], []
+    for part in _split_top(columns or "*"):
+        embed = re.match(r"^(?:(\w+):)?(\w+)(?:!\w+)?\s*\((.*)\)$", part, re.S)
+        if embed:
+            alias, target, sub = embed.groups()
+            embeds.append((alias or target, target, sub))
+        else:
+            plain.append(part)
+    return plain, embeds
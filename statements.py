@@ -0,0 +1,270 @@
+"""Monthly tenant statements as HTML and PDF.
+
+A statement covers one tenant and calendar month. It shows the electricity
+bill broken down into units × rate, the water share as billed and the
+rounded total, then rent, what has been paid and what is still due.
+``month_statements`` builds them from the tenant's own ``bills``,
+``rent_records`` and ``balances`` rows only. ``render_html`` and
+``render_pdf`` (pure-Python ``fpdf2``) render them.
+
+``write_zip`` renders a whole month in a process pool and writes every file
+into one ZIP as it is produced:
+
+    python statements.py --month 2026-06-01 --out statements-2026-06.zip
+"""
+import argparse
+import html
+import math
+import multiprocessing
+import os
+import re
+import sys
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date
+
+import db
+import ledger
+
+FORMATS = ("html", "pdf")
+# Below this many statements per process the pool costs more than it saves.
+STATEMENTS_PER_WORKER = 50
+
+
+def _by_month(rows):
+    return sorted(rows or [], key=lambda row: str(row['bill_month']))
+
+
+def build_statement(tenant, bills=(), rents=(), outstanding=None):
+    """One statement dict from a tenant profile and that month's rows.
+
+    ``bills`` / ``rents`` are the tenant's ``bills`` / ``rent_records`` rows
+    in the month (usually one each). The water share is shown as billed:
+    the bill's stored ``tenant_water_units`` at the rate its ``water_charge``
+    implies. ``outstanding`` is the tenant's total balance over all months,
+    if known.
+    """
+    electricity = []
+    for bill in _by_month(bills):
+        water_units = bill.get('tenant_water_units') or 0
+        electricity.append(dict(
+            bill, elec_cost=(bill.get('units_consumed') or 0) * (bill.get('rate_per_unit') or 0),
+            water={"units": water_units, "rate": (bill.get('water_charge') or 0) / water_units if water_units else 0},
+        ))
+    rent = _by_month(rents)
+    total = sum(b.get('total_amount') or 0 for b in electricity) + sum(r.get('amount') or 0 for r in rent)
+    paid = sum(row.get('amount_paid') or 0 for row in electricity + rent)
+    months = [str(row['bill_month']) for row in electricity + rent]
+    return {
+        "tenant": tenant,
+        "month": min(months)[:7] if months else "",
+        "electricity": electricity,
+        "rent": rent,
+        "total": total,
+        "paid": paid,
+        "due": total - paid,
+        "outstanding": outstanding,
+    }
+
+
+def month_statements(conn, bill_month, user_ids=None):
+    """Statements for every tenant with a bill or rent record in ``bill_month``'s calendar month.
+
+    With ``user_ids`` only those tenants' rows are read, so a tenant's
+    session never loads anyone else's data.
+    """
+    # Imported here so the render workers never load pandas.
+    import analytics
+    first, after = analytics.month_start(bill_month), analytics.next_month_start(bill_month)
+    tenants = conn.table("profiles").select("*").eq("role", "tenant")
+    bills = conn.table("bills").select("*").gte("bill_month", first).lt("bill_month", after)
+    rent = conn.table("rent_records").select("*").gte("bill_month", first).lt("bill_month", after)
+    balances = ledger.balances_query(conn)
+    if user_ids is not None:
+        tenants, bills, rent, balances = (q.in_(c, user_ids) for q, c in
+                                          ((tenants, "id"), (bills, "user_id"), (rent, "user_id"), (balances, "user_id")))
+    tenants, bills, rent, balances = db.fetch_all(tenants, bills, rent, balances)
+    profiles = {t['id']: t for t in tenants.data or []}
+    balances = ledger.index(balances.data)
+    # A calendar month can hold more than one bill date, so keep every row.
+    by_user = {}
+    for kind, rows in (("bills", bills.data), ("rent", rent.data)):
+        for row in rows or []:
+            by_user.setdefault(row['user_id'], {"bills": [], "rent": []})[kind].append(row)
+
+    out = []
+    for user_id, rows in by_user.items():
+        name = next((b.get('customer_name') for b in rows["bills"] if b.get('customer_name')), None) or "Unknown"
+        tenant = profiles.get(user_id) or {"id": user_id, "full_name": name}
+        out.append(build_statement(tenant, rows["bills"], rows["rent"], ledger.owed(balances, user_id)))
+    return sorted(out, key=lambda s: (str(s['tenant'].get('flat_number') or ""), str(s['tenant'].get('full_name'))))
+
+
+def _money(value, symbol):
+    return f"{symbol}{value:,.2f}" if isinstance(value, float) and not float(value).is_integer() else f"{symbol}{value:,.0f}"
+
+
+def _tag(row, rows):
+    return f" ({str(row['bill_month'])[:10]})" if len(rows) > 1 else ""
+
+
+def lines(statement, symbol="₹"):
+    """``[(label, detail, amount)]`` rows of a statement; ``amount`` is pre-formatted."""
+    rows = []
+    for elec in statement["electricity"]:
+        tag = _tag(elec, statement["electricity"])
+        rows.append((f"Electricity{tag}",
+                     f"{elec.get('units_consumed') or 0} units ({elec.get('previous_reading') or 0} to "
+                     f"{elec.get('current_reading') or 0}) × {symbol}{elec.get('rate_per_unit') or 0:.2f}/unit",
+                     _money(round(elec['elec_cost'], 2), symbol)))
+        water = elec["water"]
+        rows.append((f"Water share{tag}",
+                     f"{water['units']:.2f} units of common water × {symbol}{water['rate']:.2f}/unit",
+                     _money(round(elec.get('water_charge') or 0, 2), symbol)))
+        rows.append((f"Electricity bill{tag}", "electricity + water, rounded up", _money(elec.get('total_amount') or 0, symbol)))
+    for rent in statement["rent"]:
+        rows.append((f"Rent{_tag(rent, statement['rent'])}", "", _money(rent.get('amount') or 0, symbol)))
+    rows.append(("Total for the month", "", _money(statement["total"], symbol)))
+    rows.append(("Paid", "", _money(statement["paid"], symbol)))
+    rows.append(("Due for the month", "", _money(statement["due"], symbol)))
+    if statement["outstanding"] is not None:
+        rows.append(("Total outstanding", "all months", _money(statement["outstanding"], symbol)))
+    return rows
+
+
+def _statuses(statement):
+    """``[(label, status)]`` of every bill and rent row in a statement."""
+    return [(f"{kind}{_tag(row, statement[key])}", row.get('status'))
+            for kind, key in (("Electricity", "electricity"), ("Rent", "rent")) for row in statement[key]]
+
+
+def _title(statement):
+    tenant = statement["tenant"]
+    flat = f"Flat {tenant['flat_number']} · " if tenant.get('flat_number') else ""
+    return f"{flat}{tenant.get('full_name') or 'Tenant'}", f"Statement for {statement['month']}"
+
+
+def render_html(statement):
+    """A self-contained HTML page for one statement."""
+    name, heading = _title(statement)
+    body = "".join(
+        f"<tr><th>{html.escape(label)}</th><td>{html.escape(detail)}</td><td class='amt'>{html.escape(amount)}</td></tr>"
+        for label, detail, amount in lines(statement))
+    status = " · ".join(f"{html.escape(kind)}: {html.escape(str(state))}" for kind, state in _statuses(statement))
+    return (
+        "<!DOCTYPE html><html><head><meta charset='utf-8'>"
+        f"<title>{html.escape(heading)} - {html.escape(name)}</title>"
+        "<style>body{font-family:sans-serif;max-width:720px;margin:2em auto}"
+        "table{border-collapse:collapse;width:100%}th,td{border-bottom:1px solid #ddd;padding:6px;text-align:left}"
+        "td.amt{text-align:right;white-space:nowrap}</style></head><body>"
+        f"<h2>S. Vihar · {html.escape(heading)}</h2><p><b>{html.escape(name)}</b></p>"
+        f"<table>{body}</table><p>{status}</p></body></html>"
+    )
+
+
+def _latin(text):
+    # The built-in PDF fonts only cover Latin-1.
+    return str(text).replace("→", "->").replace("·", "-").encode("latin-1", "replace").decode("latin-1")
+
+
+def render_pdf(statement):
+    """One statement as PDF bytes."""
+    try:
+        from fpdf import FPDF
+    except ImportError:
+        raise ValueError("PDF statements need the 'fpdf2' package; download the HTML instead.")
+    name, heading = _title(statement)
+    pdf = FPDF(format="A4")
+    pdf.set_auto_page_break(True, margin=15)
+    pdf.add_page()
+    pdf.set_font("Helvetica", "B", 16)
+    pdf.cell(0, 10, _latin(f"S. Vihar - {heading}"), new_x="LMARGIN", new_y="NEXT")
+    pdf.set_font("Helvetica", "", 12)
+    pdf.cell(0, 8, _latin(name), new_x="LMARGIN", new_y="NEXT")
+    pdf.ln(4)
+    for label, detail, amount in lines(statement, symbol="Rs. "):
+        total = label in ("Total for the month", "Due for the month")
+        pdf.set_font("Helvetica", "B" if total else "", 10)
+        y = pdf.get_y()
+        pdf.multi_cell(45, 6, _latin(label))
+        label_bottom = pdf.get_y()
+        pdf.set_xy(pdf.l_margin + 45, y)
+        pdf.multi_cell(105, 6, _latin(detail))
+        detail_bottom = pdf.get_y()
+        pdf.set_xy(pdf.l_margin + 150, y)
+        pdf.cell(0, 6, _latin(amount), align="R")
+        pdf.set_y(max(label_bottom, detail_bottom, y + 6))
+        pdf.line(pdf.l_margin, pdf.get_y(), pdf.w - pdf.r_margin, pdf.get_y())
+    pdf.ln(4)
+    pdf.set_font("Helvetica", "", 9)
+    for kind, state in _statuses(statement):
+        pdf.cell(0, 5, _latin(f"{kind}: {state}"), new_x="LMARGIN", new_y="NEXT")
+    return bytes(pdf.output())
+
+
+def file_name(statement, fmt):
+    tenant = statement["tenant"]
+    stem = "_".join(str(p) for p in (tenant.get('flat_number'), tenant.get('full_name')) if p)
+    stem = re.sub(r"[^A-Za-z0-9_-]+", "-", stem).strip("-") or str(tenant.get('id'))
+    return f"{statement['month']}_{stem}.{fmt}"
+
+
+def _render(args):
+    statement, formats = args
+    renderers = {"html": lambda s: render_html(s).encode("utf-8"), "pdf": render_pdf}
+    return [(file_name(statement, fmt), renderers[fmt](statement)) for fmt in formats]
+
+
+def render_all(statements, formats=FORMATS, workers=None):
+    """Yield ``[(file name, bytes)]`` per statement, in order, rendered in a process pool.
+
+    ``workers`` defaults to one process per ``STATEMENTS_PER_WORKER``
+    statements up to the CPU count; with one worker everything runs here.
+    """
+    jobs = [(s, tuple(formats)) for s in statements]
+    if workers is None:
+        workers = min(os.cpu_count() or 1, len(jobs) // STATEMENTS_PER_WORKER)
+    workers = min(len(jobs), workers)
+    if workers <= 1:
+        yield from map(_render, jobs)
+        return
+    # spawn, not fork: the app process runs server threads.
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as pool:
+        yield from pool.map(_render, jobs, chunksize=max(1, math.ceil(len(jobs) / (workers * 4))))
+
+
+def write_zip(statements, fileobj, formats=FORMATS, workers=None, progress=None):
+    """Render ``statements`` into a ZIP written to ``fileobj``; returns the file count.
+
+    Files are added as soon as each statement is rendered. ``progress(done)``
+    is called after every statement.
+    """
+    count = 0
+    with zipfile.ZipFile(fileobj, "w", zipfile.ZIP_DEFLATED) as zf:
+        for done, files in enumerate(render_all(statements, formats, workers), start=1):
+            for name, data in files:
+                zf.writestr(name, data)
+                count += 1
+            if progress:
+                progress(done)
+    return count
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Render every tenant's statement for a month into a ZIP.")
+    parser.add_argument("--month", required=True, type=date.fromisoformat, help="any date in the month (YYYY-MM-DD)")
+    parser.add_argument("--out", help="ZIP file to write (default: statements-YYYY-MM.zip)")
+    parser.add_argument("--format", choices=FORMATS, action="append", help="only this format (repeatable)")
+    parser.add_argument("--workers", type=int, default=None, help="processes for rendering")
+    args = parser.parse_args(argv)
+
+    statements = month_statements(db.connect(), args.month)
+    out = args.out or f"statements-{str(args.month)[:7]}.zip"
+    with open(out, "wb") as f:
+        count = write_zip(statements, f, args.format or FORMATS, args.workers)
+    print(f"{len(statements)} statement(s), {count} file(s) written to {out}.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,100 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import db
+import ledger
+import monthly_close
+
+BILL_DATE = "2026-06-05"
+FLATS = ["101", "102", "201", "202", "301", "302", "401"]
+READINGS = [
+    ("Ground Meter", 1000, 1500, 4000),
+    ("101", 100, 200, ""),
+    ("102", 300, 420, ""),
+    ("Middle Meter", 2000, 2300, 2400),
+    ("201", 50, 150, ""),
+    ("Upper Meter", 3000, 3600, 4800),
+    ("301", 10, 110, ""),
+    ("401", 20, 170, ""),
+]
+
+
+@pytest.fixture
+def conn(tmp_path, monkeypatch):
+    path = str(tmp_path / "eb.db")
+    monkeypatch.setenv(db.BACKEND_ENV, "sqlite")
+    monkeypatch.setenv(db.SQLITE_PATH_ENV, path)
+    conn = db.connect()
+    conn.table("profiles").insert([
+        {"id": f"t{flat}", "full_name": f"Tenant {flat}", "role": "tenant", "flat_number": flat,
+         "num_people": n % 4 + 1, "rent_amount": 5000 + 100 * n}
+        for n, flat in enumerate(FLATS)
+    ]).execute()
+    yield conn
+    db.close(path)
+
+
+def readings_file(tmp_path, readings=READINGS):
+    path = tmp_path / "readings.csv"
+    lines = ["bill_month,meter,previous_reading,current_reading,total_bill_amount"]
+    lines += [f"{BILL_DATE},{meter},{prev},{curr},{bill}" for meter, prev, curr, bill in readings]
+    path.write_text("\n".join(lines) + "\n")
+    return str(path)
+
+
+def count(conn, table):
+    return len(conn.table(table).select("id").execute().data)
+
+
+def test_dry_run_plans_the_close_without_writing(conn, tmp_path, capsys):
+    path = readings_file(tmp_path)
+    report = monthly_close.load_readings(conn, path, None)
+    plan = monthly_close.plan(conn, BILL_DATE, report["main_meters"], report["sub_meter_readings"])
+
+    assert plan["errors"] == []
+    assert {b["user_id"] for b in plan["bills"]} == {f"t{flat}" for flat in FLATS}
+    assert plan["summary"]["new"] == len(FLATS) and plan["summary"]["rent_new"] == len(FLATS)
+    assert sum(b["units_consumed"] for b in plan["bills"]) == 500 + 300 + 600 - 280
+
+    assert monthly_close.main(["--readings", path]) == 0
+    assert "dry run, nothing written" in capsys.readouterr().out
+    for table in ("main_meters", "sub_meter_readings", "bills", "rent_records", "balances"):
+        assert count(conn, table) == 0
+
+
+def test_commit_writes_bills_rent_and_balances(conn, tmp_path):
+    assert monthly_close.main(["--readings", readings_file(tmp_path), "--commit"]) == 0
+
+    bills = conn.table("bills").select("*").execute().data
+    rent = conn.table("rent_records").select("*").execute().data
+    assert count(conn, "main_meters") == 3 and count(conn, "sub_meter_readings") == len(FLATS)
+    assert len(bills) == len(rent) == len(FLATS)
+    assert {r["amount"] for r in rent} == {5000 + 100 * n for n in range(len(FLATS))}
+
+    balances = ledger.index(conn.table("balances").select("*").execute().data)
+    for row in bills + rent:
+        assert ledger.owed(balances, row["user_id"]) > 0
+    assert sum(ledger.owed(balances, f"t{flat}") for flat in FLATS) == \
+        sum(b["total_amount"] for b in bills) + sum(r["amount"] for r in rent)
+    assert ledger.reconcile(conn) == []
+
+    # Closing the same month again changes nothing.
+    again = monthly_close.plan(conn, BILL_DATE)
+    assert again["bills"] == [] and again["rent"] == []
+    assert again["summary"]["unchanged"] == len(FLATS) and again["summary"]["rent_existing"] == len(FLATS)
+
+
+@pytest.mark.parametrize("readings, error", [
+    ([r if r[0] != "101" else ("101", 200, 150, "") for r in READINGS], "below previous"),
+    ([r for r in READINGS if r[0] != "201"], "missing sub-meter readings for 201"),
+])
+def test_validation_error_exits_1_and_writes_nothing(conn, tmp_path, capsys, readings, error):
+    assert monthly_close.main(["--readings", readings_file(tmp_path, readings), "--commit"]) == 1
+    err = capsys.readouterr().err
+    assert error in err and "nothing written" in err
+    for table in ("main_meters", "sub_meter_readings", "bills", "rent_records"):
+        assert count(conn, table) == 0
@@ -0,0 +1,99 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import db
+import statements
+
+BILL_DATE = "2026-06-05"
+PEOPLE = {"t1": 2, "t2": 3, "t3": 4}
+
+
+@pytest.fixture
+def conn(tmp_path, monkeypatch):
+    path = str(tmp_path / "eb.db")
+    monkeypatch.setenv(db.BACKEND_ENV, "sqlite")
+    monkeypatch.setenv(db.SQLITE_PATH_ENV, path)
+    yield db.connect()
+    db.close(path)
+
+
+class Spy:
+    """Records every row a query returns, per table."""
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.rows = {}
+
+    def table(self, name):
+        return _SpyQuery(self, name, self.conn.table(name))
+
+
+class _SpyQuery:
+    def __init__(self, spy, table, query):
+        self.spy, self.table, self.query = spy, table, query
+
+    def __getattr__(self, name):
+        return lambda *args, **kwargs: _SpyQuery(self.spy, self.table, getattr(self.query, name)(*args, **kwargs))
+
+    def execute(self):
+        result = self.query.execute()
+        self.spy.rows.setdefault(self.table, []).extend(result.data or [])
+        return result
+
+
+def bill(uid, bill_month=BILL_DATE, units=50):
+    # Billed water: 90 units over the 9 people of all three flats.
+    water = 90 / 9 * PEOPLE[uid]
+    return {"user_id": uid, "customer_name": f"Tenant {uid}", "bill_month": bill_month, "units_consumed": units,
+            "rate_per_unit": 8.0, "tenant_water_units": water, "water_charge": water * 8.0,
+            "total_amount": units * 8 + round(water * 8)}
+
+
+def seed(conn):
+    conn.table("profiles").insert([
+        {"id": uid, "full_name": f"Tenant {uid}", "role": "tenant", "flat_number": str(100 + n), "num_people": num}
+        for n, (uid, num) in enumerate(PEOPLE.items(), 1)
+    ]).execute()
+    conn.table("bills").insert([bill(uid) for uid in PEOPLE]).execute()
+    conn.table("rent_records").insert([{"user_id": uid, "bill_month": BILL_DATE, "amount": 5000} for uid in PEOPLE]).execute()
+
+
+def test_tenant_statement_matches_admin_statement(conn):
+    seed(conn)
+    admin = {s["tenant"]["id"]: s for s in statements.month_statements(conn, BILL_DATE)}
+    for uid in PEOPLE:
+        own, = statements.month_statements(conn, BILL_DATE, user_ids=[uid])
+        assert statements.lines(own) == statements.lines(admin[uid])
+    water = dict((label, detail) for label, detail, _ in statements.lines(admin["t1"]))["Water share"]
+    assert water == "20.00 units of common water × ₹8.00/unit"
+
+
+def test_tenant_statement_reads_only_the_tenants_rows(conn):
+    seed(conn)
+    spy = Spy(conn)
+    statements.month_statements(spy, BILL_DATE, user_ids=["t2"])
+    for table in ("profiles", "bills", "rent_records"):
+        assert {row.get("user_id", row.get("id")) for row in spy.rows[table]} == {"t2"}
+
+
+def test_water_share_stays_as_billed_after_a_profile_edit(conn):
+    seed(conn)
+    before, = statements.month_statements(conn, BILL_DATE, user_ids=["t1"])
+    conn.table("profiles").update({"num_people": 6}).eq("id", "t3").execute()
+    after, = statements.month_statements(conn, BILL_DATE, user_ids=["t1"])
+    assert statements.lines(after) == statements.lines(before)
+
+
+def test_every_bill_in_the_month_is_listed(conn):
+    seed(conn)
+    conn.table("bills").insert(bill("t1", "2026-06-20", units=10)).execute()
+    statement, = statements.month_statements(conn, BILL_DATE, user_ids=["t1"])
+    assert [b["bill_month"] for b in statement["electricity"]] == [BILL_DATE, "2026-06-20"]
+    assert statement["total"] == bill("t1")["total_amount"] + bill("t1", units=10)["total_amount"] + 5000
+    labels = [label for label, _, _ in statements.lines(statement)]
+    assert "Electricity (2026-06-05)" in labels and "Electricity (2026-06-20)" in labels
+    assert statements.render_pdf(statement)[:4] == b"%PDF"